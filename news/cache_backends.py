@@ -0,0 +1,367 @@
+"""
+Двухуровневый кэш: ограниченный LRU в памяти процесса перед общим кэшем.
+
+* локальный уровень живёт не дольше LOCAL_TIMEOUT секунд, чтобы процессы
+  не расходились с общим кэшем надолго;
+* целые числа считаются счётчиками (incr/decr, поколения пространств имён,
+  лимиты частоты) и читаются только из общего кэша;
+* get_or_set пересчитывает значение в одном месте (single-flight через
+  блокировку в общем кэше: его add, как и incr счётчиков, должен быть
+  атомарным между процессами, как у LockingFileBasedCache ниже, Redis
+  или Memcached; у обычного FileBasedCache это не так), а горячие ключи обновляет заранее
+  с вероятностью, растущей к концу срока жизни (XFetch), чтобы они
+  не истекали у всех воркеров одновременно. None тоже кэшируется:
+  «поста нет» — такой же результат, как и сам пост;
+* локальный уровень хранит значения сериализованными, как общий кэш:
+  каждый get получает свою копию, и потоки не меняют объект друг друга.
+"""
+import math
+import os
+import pickle
+import random
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.files import locks
+from django.utils.functional import cached_property
+
+from . import metrics
+
+
+class Entry:
+    """Значение в общем кэше вместе со сроком жизни и временем пересчёта."""
+    __slots__ = ('value', 'expires_at', 'delta')
+
+    def __init__(self, value, expires_at, delta=0.0):
+        self.value = value
+        self.expires_at = expires_at
+        self.delta = delta
+
+    def __getstate__(self):
+        return self.value, self.expires_at, self.delta
+
+    def __setstate__(self, state):
+        self.value, self.expires_at, self.delta = state
+
+
+class LockingFileBasedCache(FileBasedCache):
+    """
+    Файловый кэш с атомарными add и incr между процессами и потоками.
+
+    add и incr у FileBasedCache — чтение и отдельная запись: два процесса
+    могут оба «добавить» ключ и оба взять блокировку get_or_set или оба
+    записать g + 1, и одна инвалидация потеряется. Здесь чтение и запись
+    идут под эксклюзивной блокировкой файла
+    (django.core.files.locks), которую ОС снимает и при падении
+    процесса. Файлов блокировок не больше 256: ключ попадает в один
+    из них по первым символам имени своего файла.
+    """
+    lock_suffix = '.lock'
+
+    @contextmanager
+    def _locked(self, fname):
+        self._createdir()
+        stripe = os.path.basename(fname)[:2]
+        with open(os.path.join(self._dir, stripe + self.lock_suffix), 'ab') as lock_file:
+            locks.lock(lock_file, locks.LOCK_EX)
+            try:
+                yield
+            finally:
+                locks.unlock(lock_file)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        with self._locked(self._key_to_file(key, version)):
+            return super().add(key, value, timeout, version)
+
+    def incr(self, key, delta=1, version=None):
+        # В отличие от BaseCache.incr срок жизни ключа сохраняется:
+        # счётчик окна лимита не должен продлеваться каждым запросом
+        fname = self._key_to_file(key, version)
+        with self._locked(fname):
+            try:
+                with open(fname, 'rb') as file:
+                    expiry = pickle.load(file)
+                    value = pickle.loads(zlib.decompress(file.read()))
+            except (FileNotFoundError, EOFError):
+                expiry, value = 0, None
+            if value is None or (expiry is not None and expiry < time.time()):
+                raise ValueError(f"Key '{key}' not found")
+            value += delta
+            self.set(key, value, None if expiry is None else expiry - time.time(), version)
+        return value
+
+
+class LocalLRU:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            data = None
+            item = self._data.get(key)
+            if item is not None:
+                if item[1] > time.time():
+                    self._data.move_to_end(key)
+                    data = item[0]
+                else:
+                    del self._data[key]
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        # Десериализация вне блокировки: каждому вызову своя копия
+        return pickle.loads(data)
+
+    def set(self, key, entry, local_expires_at):
+        data = pickle.dumps(entry, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._data[key] = (data, local_expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._data),
+        }
+
+
+class TwoTierCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._shared_alias = options.get('SHARED', 'shared')
+        self._local_timeout = options.get('LOCAL_TIMEOUT', 5)
+        self._lock_timeout = options.get('LOCK_TIMEOUT', 10)
+        self._beta = options.get('EARLY_REFRESH_BETA', 1.0)
+        self._local = _local_tiers.setdefault(
+            location or self._shared_alias,
+            LocalLRU(options.get('LOCAL_MAX_ENTRIES', 1000))
+        )
+        self._shared_stats = _shared_stats.setdefault(
+            location or self._shared_alias,
+            {'hits': 0, 'misses': 0, 'early_refreshes': 0, 'lock_waits': 0}
+        )
+
+    @cached_property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    def _count(self, name, value):
+        # Экземпляры бэкенда в разных потоках делят один словарь статистики
+        with _stats_lock:
+            self._shared_stats[name] += value
+
+    def _resolve_timeout(self, timeout):
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    @staticmethod
+    def _is_counter(value):
+        return isinstance(value, int) and not isinstance(value, bool)
+
+    def _wrap(self, value, timeout, delta=0.0):
+        if self._is_counter(value):
+            return value
+        return Entry(value, self.get_backend_timeout(timeout), delta)
+
+    def _remember(self, local_key, entry):
+        if not isinstance(entry, Entry):
+            return
+        local_expires_at = time.time() + self._local_timeout
+        if entry.expires_at is not None:
+            local_expires_at = min(local_expires_at, entry.expires_at)
+        self._local.set(local_key, entry, local_expires_at)
+
+    def _get_entry(self, key, version):
+        local_key = self.make_and_validate_key(key, version=version)
+        entry = self._local.get(local_key)
+        if entry is not None:
+            metrics.record_cache(hit=True)
+            return entry
+        return self._get_shared_entry(key, version, local_key)
+
+    def _get_shared_entry(self, key, version, local_key):
+        entry = self.shared.get(key, version=version)
+        if entry is None:
+            self._count('misses', 1)
+            metrics.record_cache(hit=False)
+            return None
+        self._count('hits', 1)
+        metrics.record_cache(hit=True)
+        if not isinstance(entry, Entry):
+            return Entry(entry, None)
+        self._remember(local_key, entry)
+        return entry
+
+    def get(self, key, default=None, version=None):
+        entry = self._get_entry(key, version)
+        return default if entry is None else entry.value
+
+    async def aget(self, key, default=None, version=None):
+        # Попадание в локальный уровень отдаётся без перехода в поток,
+        # в поток уходит только чтение общего кэша
+        local_key = self.make_and_validate_key(key, version=version)
+        entry = self._local.get(local_key)
+        if entry is not None:
+            metrics.record_cache(hit=True)
+        else:
+            entry = await sync_to_async(self._get_shared_entry, thread_sensitive=True)(
+                key, version, local_key
+            )
+        return default if entry is None else entry.value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, delta=0.0):
+        timeout = self._resolve_timeout(timeout)
+        entry = self._wrap(value, timeout, delta)
+        self.shared.set(key, entry, timeout, version=version)
+        local_key = self.make_and_validate_key(key, version=version)
+        self._local.delete(local_key)
+        self._remember(local_key, entry)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self._resolve_timeout(timeout)
+        entry = self._wrap(value, timeout)
+        added = self.shared.add(key, entry, timeout, version=version)
+        if added:
+            self._remember(self.make_and_validate_key(key, version=version), entry)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self._local.delete(self.make_and_validate_key(key, version=version))
+        return self.shared.touch(key, self._resolve_timeout(timeout), version=version)
+
+    def delete(self, key, version=None):
+        self._local.delete(self.make_and_validate_key(key, version=version))
+        return self.shared.delete(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self._local.delete(self.make_and_validate_key(key, version=version))
+        return self.shared.incr(key, delta, version=version)
+
+    def has_key(self, key, version=None):
+        return self._get_entry(key, version) is not None
+
+    def get_many(self, keys, version=None):
+        found = {}
+        missing = []
+        for key in keys:
+            entry = self._local.get(self.make_and_validate_key(key, version=version))
+            if entry is not None:
+                found[key] = entry.value
+            else:
+                missing.append(key)
+
+        metrics.record_cache(hit=True, count=len(found))
+        if missing:
+            shared = self.shared.get_many(missing, version=version)
+            self._count('hits', len(shared))
+            self._count('misses', len(missing) - len(shared))
+            metrics.record_cache(hit=True, count=len(shared))
+            metrics.record_cache(hit=False, count=len(missing) - len(shared))
+            for key, entry in shared.items():
+                if isinstance(entry, Entry):
+                    self._remember(self.make_and_validate_key(key, version=version), entry)
+                    found[key] = entry.value
+                else:
+                    found[key] = entry
+        return found
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self._resolve_timeout(timeout)
+        entries = {key: self._wrap(value, timeout) for key, value in data.items()}
+        failed = self.shared.set_many(entries, timeout, version=version)
+        for key, entry in entries.items():
+            if key not in failed:
+                self._remember(self.make_and_validate_key(key, version=version), entry)
+        return failed
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self._local.delete(self.make_and_validate_key(key, version=version))
+        self.shared.delete_many(keys, version=version)
+
+    def clear(self):
+        self._local.clear()
+        self.shared.clear()
+
+    def _should_refresh_early(self, entry):
+        # XFetch: чем ближе срок и чем дольше пересчёт, тем вероятнее обновление
+        if entry.expires_at is None or not entry.delta:
+            return False
+        jitter = -entry.delta * self._beta * math.log(1.0 - random.random())
+        return time.time() + jitter >= entry.expires_at
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+        entry = self._get_entry(key, version)
+        if entry is not None and not self._should_refresh_early(entry):
+            return entry.value
+
+        lock_key = f'{key}:lock'
+        deadline = time.monotonic() + self._lock_timeout
+        while True:
+            if self.shared.add(lock_key, 1, self._lock_timeout, version=version):
+                if entry is not None:
+                    self._count('early_refreshes', 1)
+                try:
+                    return self._compute(key, default, timeout, version)
+                finally:
+                    self.shared.delete(lock_key, version=version)
+
+            # Значение уже пересчитывает другой воркер: отдаём текущее,
+            # а если его нет — ждём, пока он снимет блокировку
+            if entry is not None:
+                return entry.value
+
+            self._count('lock_waits', 1)
+            while self.shared.has_key(lock_key, version=version) and time.monotonic() < deadline:
+                time.sleep(0.05)
+            entry = self._get_entry(key, version)
+            if entry is not None:
+                return entry.value
+            if time.monotonic() >= deadline:
+                return self._compute(key, default, timeout, version)
+            # Блокировка снята без значения — пересчёт упал;
+            # повторяет его тот, кто первым возьмёт блокировку
+
+    def _compute(self, key, default, timeout, version):
+        started = time.monotonic()
+        value = default() if callable(default) else default
+        self.set(key, value, timeout, version=version, delta=time.monotonic() - started)
+        return value
+
+    def stats(self):
+        return {
+            'local': self._local.stats(),
+            'shared': dict(self._shared_stats),
+        }
+
+
+# Локальный уровень общий для всех потоков процесса: экземпляры бэкенда
+# создаются на каждый поток, а LRU и статистика должны быть одни
+_local_tiers = {}
+_shared_stats = {}
+_stats_lock = threading.Lock()
@@ -1,6 +1,9 @@
 import os
+from datetime import datetime, timezone
+
 from celery import Celery
 from celery.schedules import crontab
+from celery.signals import before_task_publish
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'news.settings')
 
@@ -8,9 +11,34 @@ app = Celery('news')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
+
+@before_task_publish.connect
+def stamp_scheduled_time(sender=None, body=None, **kwargs):
+    # beat отправляет задание в момент срабатывания расписания: это время
+    # и задаёт период, даже если воркер возьмёт задание из очереди позже
+    if sender == 'post_news.tasks.run_scheduled_job':
+        body[1].setdefault('scheduled_at', datetime.now(timezone.utc).isoformat())
+
+
+# Единственный планировщик заданий. beat может работать на каждой
+# реплике: задания идут через run_scheduled_job, который выполняет
+# задание один раз за период (post_news/scheduler.py)
 app.conf.beat_schedule = {
     'weekly_news_digest': {
-        'task': 'post_news.tasks.send_weekly_digest',
+        'task': 'post_news.tasks.run_scheduled_job',
+        'args': ('send_weekly_digest',),
         'schedule': crontab(day_of_week='monday', hour=8, minute=0),
     },
+    # Подстраховка: дочищает outbox, если сигнал о новой записи потерялся
+    'drain_notification_outbox': {
+        'task': 'post_news.tasks.run_scheduled_job',
+        'args': ('drain_notification_outbox',),
+        'schedule': crontab(minute='*'),
+    },
+    # Накопленные голоса переносятся в рейтинги раз в минуту
+    'flush_votes': {
+        'task': 'post_news.tasks.run_scheduled_job',
+        'args': ('flush_votes',),
+        'schedule': crontab(minute='*'),
+    },
 }
@@ -0,0 +1,67 @@
+"""
+Маршрутизация запросов к БД: запись — в основную базу, чтение
+в представлениях «только для чтения» — в реплику.
+
+Состояние текущего запроса лежит в contextvar, его выставляет
+ReplicaRoutingMiddleware. Всё, что выполняется вне такого запроса
+(задачи Celery, команды, админка), читает из основной базы.
+"""
+from contextvars import ContextVar
+
+from django.conf import settings
+
+PRIMARY = 'default'
+REPLICA = 'replica'
+
+state = ContextVar('db_routing', default=None)
+
+
+class RoutingState:
+    def __init__(self, request):
+        self.request = request
+        self.wrote = False
+
+    @property
+    def use_replica(self):
+        # Решение принимается при чтении: представление известно только
+        # после разрешения URL, чтения middleware до него идут в основную базу
+        request = self.request
+        match = getattr(request, 'resolver_match', None)
+        return (
+            match is not None
+            and request.method in ('GET', 'HEAD')
+            and match.url_name in settings.REPLICA_READ_VIEWS
+            and settings.REPLICA_PIN_COOKIE not in request.COOKIES
+        )
+
+
+def read_database():
+    """
+    База для чтений текущего запроса. Нужна чтениям, которые идут
+    уже после ответа middleware, например в теле StreamingHttpResponse:
+    к тому времени состояние запроса сброшено.
+    """
+    routing = state.get()
+    # После записи в том же запросе читаем из основной базы,
+    # иначе можно не увидеть только что сохранённое
+    if REPLICA in settings.DATABASES and routing is not None and routing.use_replica and not routing.wrote:
+        return REPLICA
+    return PRIMARY
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return read_database()
+
+    def db_for_write(self, model, **hints):
+        routing = state.get()
+        if routing is not None:
+            routing.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплика — копия основной базы, объекты из них совместимы
+        return {obj1._state.db, obj2._state.db} <= {PRIMARY, REPLICA}
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY
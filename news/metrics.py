@@ -0,0 +1,199 @@
+"""
+Метрики запросов: счётчики текущего запроса и агрегаты по представлениям.
+
+Статистика текущего запроса лежит в contextvar, поэтому обёртка SQL
+и кэш пишут в неё без передачи request. Агрегаты хранятся в памяти
+процесса и отдаются в текстовом формате Prometheus на /metrics.
+"""
+import heapq
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseForbidden
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SLOWEST_QUERIES = 5
+PENDING_VOTES_TOP = 20
+
+current = ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.template_seconds = 0.0
+        self.slowest = []
+
+    def record_query(self, sql, seconds):
+        self.queries += 1
+        self.sql_seconds += seconds
+        item = (seconds, self.queries, sql)
+        if len(self.slowest) < SLOWEST_QUERIES:
+            heapq.heappush(self.slowest, item)
+        else:
+            heapq.heappushpop(self.slowest, item)
+
+    @property
+    def total_seconds(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total):
+        return ', '.join([
+            f'db;dur={self.sql_seconds * 1000:.1f};desc="{self.queries} queries"',
+            f'cache;desc="hits={self.cache_hits} misses={self.cache_misses}"',
+            f'tpl;dur={self.template_seconds * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+
+def sql_timer(execute, sql, params, many, context):
+    stats = current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.record_query(sql, time.perf_counter() - started)
+
+
+def instrument(connection):
+    if sql_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sql_timer)
+
+
+def instrument_open_connections():
+    for connection in connections.all(initialized_only=True):
+        instrument(connection)
+
+
+@receiver(connection_created)
+def instrument_new_connection(sender, connection, **kwargs):
+    instrument(connection)
+
+
+def record_cache(hit, count=1):
+    stats = current.get()
+    if stats is not None:
+        if hit:
+            stats.cache_hits += count
+        else:
+            stats.cache_misses += count
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def observe(self, view, stats, total):
+        with self._lock:
+            data = self._views.setdefault(view, {
+                'buckets': [0] * len(LATENCY_BUCKETS),
+                'count': 0,
+                'sum': 0.0,
+                'queries': 0,
+                'sql_seconds': 0.0,
+                'template_seconds': 0.0,
+                'cache_hits': 0,
+                'cache_misses': 0,
+            })
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if total <= bound:
+                    data['buckets'][index] += 1
+            data['count'] += 1
+            data['sum'] += total
+            data['queries'] += stats.queries
+            data['sql_seconds'] += stats.sql_seconds
+            data['template_seconds'] += stats.template_seconds
+            data['cache_hits'] += stats.cache_hits
+            data['cache_misses'] += stats.cache_misses
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                view: {**data, 'buckets': list(data['buckets'])}
+                for view, data in self._views.items()
+            }
+
+
+registry = Registry()
+
+
+def _counter(lines, name, help_text, values):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} counter')
+    for labels, value in values:
+        lines.append(f'{name}{{{labels}}} {value}')
+
+
+def render_prometheus():
+    lines = []
+    views = sorted(registry.snapshot().items())
+
+    name = 'news_request_duration_seconds'
+    lines.append(f'# HELP {name} Request latency by view.')
+    lines.append(f'# TYPE {name} histogram')
+    for view, data in views:
+        for bound, count in zip(LATENCY_BUCKETS, data['buckets']):
+            lines.append(f'{name}_bucket{{view="{view}",le="{bound}"}} {count}')
+        lines.append(f'{name}_bucket{{view="{view}",le="+Inf"}} {data["count"]}')
+        lines.append(f'{name}_sum{{view="{view}"}} {data["sum"]:.6f}')
+        lines.append(f'{name}_count{{view="{view}"}} {data["count"]}')
+
+    _counter(lines, 'news_request_queries_total', 'SQL queries by view.',
+             [(f'view="{view}"', data['queries']) for view, data in views])
+    _counter(lines, 'news_request_sql_seconds_total', 'Time spent in SQL by view.',
+             [(f'view="{view}"', f"{data['sql_seconds']:.6f}") for view, data in views])
+    _counter(lines, 'news_request_template_seconds_total', 'Template render time by view.',
+             [(f'view="{view}"', f"{data['template_seconds']:.6f}") for view, data in views])
+    _counter(lines, 'news_request_cache_total', 'Cache lookups by view and result.',
+             [(f'view="{view}",result="{result}"', data[f'cache_{result}'])
+              for view, data in views for result in ('hits', 'misses')])
+
+    cache = caches['default']
+    if hasattr(cache, 'stats'):
+        tiers = cache.stats()
+        _counter(lines, 'news_cache_tier_total', 'Cache tier events in this process.',
+                 [(f'tier="{tier}",event="{event}"', value)
+                  for tier, events in sorted(tiers.items())
+                  for event, value in sorted(events.items())
+                  if event != 'entries'])
+
+    from post_news import votes
+    lines.append('# HELP news_pending_votes Vote deltas not yet flushed to the database.')
+    lines.append('# TYPE news_pending_votes gauge')
+    for kind in votes.MODELS:
+        pending = votes.pending_deltas(kind)
+        lines.append(f'news_pending_votes{{kind="{kind}",measure="objects"}} {len(pending)}')
+        lines.append(f'news_pending_votes{{kind="{kind}",measure="delta"}} {sum(map(abs, pending.values()))}')
+
+    # Объекты с наибольшей неслитой дельтой: полный список по всем записям
+    # раздул бы вывод, для мониторинга хватает верхних PENDING_VOTES_TOP
+    name = 'news_pending_vote_delta'
+    lines.append(f'# HELP {name} Largest pending vote deltas by object.')
+    lines.append(f'# TYPE {name} gauge')
+    for kind in votes.MODELS:
+        pending = votes.pending_deltas(kind)
+        top = heapq.nlargest(PENDING_VOTES_TOP, pending.items(), key=lambda item: abs(item[1]))
+        for pk, delta in top:
+            lines.append(f'{name}{{kind="{kind}",id="{pk}"}} {delta}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    allowed = request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS or request.user.is_staff
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
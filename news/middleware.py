@@ -0,0 +1,134 @@
+import logging
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import db_routers, metrics
+
+logger = logging.getLogger('news.performance')
+
+
+class PerformanceMiddleware:
+    """
+    Считает для каждого запроса SQL (число и время), обращения к кэшу,
+    время рендеринга шаблона и полное время; отдаёт их в Server-Timing
+    и копит гистограммы по имени URL. Медленные запросы выборочно
+    пишутся в лог вместе с самыми долгими SQL.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        metrics.instrument_open_connections()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = metrics.RequestStats()
+        token = metrics.current.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.current.reset(token)
+        return self.finish(request, response, stats)
+
+    async def __acall__(self, request):
+        stats = metrics.RequestStats()
+        token = metrics.current.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.current.reset(token)
+        return self.finish(request, response, stats)
+
+    def finish(self, request, response, stats):
+        total = stats.total_seconds
+        response['Server-Timing'] = stats.server_timing(total)
+
+        match = getattr(request, 'resolver_match', None)
+        view = (match.url_name if match else None) or 'unresolved'
+        metrics.registry.observe(view, stats, total)
+
+        if total * 1000 >= settings.PERFORMANCE_SLOW_REQUEST_MS \
+                and random.random() < settings.PERFORMANCE_SLOW_SAMPLE_RATE:
+            self.log_slow_request(request, view, stats, total)
+
+        return response
+
+    def process_template_response(self, request, response):
+        stats = metrics.current.get()
+        render = response.render
+
+        def timed_render():
+            # Подмена снимается до рендеринга: после него ответ кладётся
+            # в кэш и должен оставаться сериализуемым
+            del response.render
+            started = time.perf_counter()
+            try:
+                return render()
+            finally:
+                stats.template_seconds += time.perf_counter() - started
+
+        if stats is not None:
+            response.render = timed_render
+        return response
+
+    def log_slow_request(self, request, view, stats, total):
+        slowest = '\n'.join(
+            f'    {seconds * 1000:.1f} ms  {sql}'
+            for seconds, _, sql in sorted(stats.slowest, reverse=True)
+        )
+        logger.warning(
+            'Slow request %s %s (%s): %.1f ms, %d queries in %.1f ms, template %.1f ms\n%s',
+            request.method, request.path, view, total * 1000,
+            stats.queries, stats.sql_seconds * 1000, stats.template_seconds * 1000, slowest
+        )
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Направляет чтения GET/HEAD-запросов к представлениям из
+    REPLICA_READ_VIEWS в реплику. После запроса с записью ставит cookie,
+    и следующие REPLICA_PIN_SECONDS секунд этот пользователь читает
+    из основной базы — реплика могла ещё не догнать его изменения.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        routing = db_routers.RoutingState(request)
+        token = db_routers.state.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            db_routers.state.reset(token)
+        return self.finish(routing, response)
+
+    async def __acall__(self, request):
+        routing = db_routers.RoutingState(request)
+        token = db_routers.state.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            db_routers.state.reset(token)
+        return self.finish(routing, response)
+
+    def finish(self, routing, response):
+        if routing.wrote:
+            response.set_cookie(
+                settings.REPLICA_PIN_COOKIE, '1',
+                max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax'
+            )
+        return response
@@ -50,13 +50,14 @@ INSTALLED_APPS = [
     'allauth.socialaccount',
     # ... include the providers you want to enable:
     'allauth.socialaccount.providers.google',
-    'django_apscheduler',
     'django_celery_beat',
 ]
 
 SITE_ID = 1
 
 MIDDLEWARE = [
+    'news.middleware.PerformanceMiddleware',
+    'news.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -100,12 +101,67 @@ WSGI_APPLICATION = 'news.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+SQLITE_OPTIONS = {
+    # WAL: читатели не ждут писателя и друг друга; при WAL
+    # synchronous=NORMAL остаётся безопасным при сбое процесса
+    'init_command': (
+        'PRAGMA journal_mode=WAL;'
+        'PRAGMA synchronous=NORMAL;'
+        'PRAGMA temp_store=MEMORY;'
+        'PRAGMA cache_size=-20000;'
+        'PRAGMA mmap_size=134217728'
+    ),
+    # Транзакция сразу берёт блокировку записи: при повышении блокировки
+    # посреди транзакции SQLite отвечает "database is locked", не дожидаясь
+    'transaction_mode': 'IMMEDIATE',
+    # busy timeout, секунды
+    'timeout': 20,
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'dbnew.sqlite3',
+        'OPTIONS': SQLITE_OPTIONS,
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+    },
+}
+
+# Реплика для чтения, например NEWS_REPLICA_DB=replica.sqlite3; файл
+# обновляется командой sync_replica. Без неё всё читается из основной базы
+if os.environ.get('NEWS_REPLICA_DB'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.environ['NEWS_REPLICA_DB'],
+        'TEST': {'MIRROR': 'default'},
     }
+
+DATABASE_ROUTERS = ['news.db_routers.PrimaryReplicaRouter']
+
+# Представления, чтения которых можно отдавать реплике
+REPLICA_READ_VIEWS = {
+    'post_list', 'post_detail', 'post_search', 'category_list', 'category_detail',
+    'post_export',
+    'api_post_list', 'api_post_detail', 'api_category_list', 'api_category_posts',
 }
+# Сколько секунд после записи пользователь читает из основной базы
+REPLICA_PIN_SECONDS = 10
+REPLICA_PIN_COOKIE = 'db_primary'
+
+# Асинхронные представления для чтения; news/asgi.py включает их
+ASYNC_READ_VIEWS = os.environ.get('NEWS_ASYNC_VIEWS') == '1'
+
+# Курсорная пагинация ленты и поиска вместо номеров страниц. По ссылке
+# с ?cursor= курсорный режим включается и без этой настройки
+CURSOR_PAGINATION = False
+
+# Статические снимки страниц, см. post_news/snapshots.py
+SNAPSHOTS_ENABLED = True
+SNAPSHOT_DIR = BASE_DIR / 'snapshots'
+SNAPSHOT_LIST_PAGES = 3
+# Хост, с которым рендерятся снимки; по умолчанию первый из ALLOWED_HOSTS
+SNAPSHOT_HOST = None
 
 
 # Password validation
@@ -153,6 +209,9 @@ STATICFILES_DIRS = [
     BASE_DIR / "static"
 ]
 
+# Слова, которые фильтр censor заменяет звёздочками
+CENSOR_WORDS = ['редиска', 'дурак', 'идиот']
+
 LOGIN_REDIRECT_URL = 'post_list'
 LOGIN_URL = '/accounts/login/'
 
@@ -164,6 +223,31 @@ ACCOUNT_EMAIL_VERIFICATION = 'none'
 
 ACCOUNT_FORMS = {'signup': 'post_news.forms.BasicSignupForm'}
 
+# Размер страницы JSON API по умолчанию и наибольший, который можно запросить limit
+API_PAGE_SIZE = 20
+API_MAX_PAGE_SIZE = 100
+
+# Лимиты частоты действий, "N/период/ключ": период s, m, h, d или "30s",
+# ключ user (для анонимов — ip) или ip. Счётчики живут в кэше, кроме
+# news_create: новости автора за период считаются по базе
+RATE_LIMITS = {
+    'news_create': '3/d/user',
+    'vote': '30/m/user',
+    'subscribe': '10/m/user',
+    'signup': '5/h/ip',
+}
+# Заголовок с адресом клиента, например 'HTTP_X_REAL_IP' за nginx;
+# без прокси адрес берётся из REMOTE_ADDR
+RATE_LIMIT_IP_META = 'REMOTE_ADDR'
+# Регистрация через allauth ограничивается его собственным лимитером
+ACCOUNT_RATE_LIMITS = {'signup': RATE_LIMITS['signup']}
+
+# Сессии читаются из общего кэша: лимитер и авторизация не ходят
+# в базу за сессией; локальный уровень не годится — выход из аккаунта
+# в одном процессе не был бы виден другим
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'shared'
+
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.mail.ru'
 EMAIL_PORT = 587
@@ -172,8 +256,8 @@ EMAIL_HOST_USER = ''  # email
 EMAIL_HOST_PASSWORD = ''  # пароль от почты
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER  # адрес отправителя по умолчанию
 
-APSCHEDULER_DATETIME_FORMAT = "N j, Y, f:s a"
-APSCHEDULER_RUN_NOW_TIMEOUT = 25
+# Сколько дней хранится история запусков заданий по расписанию
+JOB_RUN_RETENTION_DAYS = 14
 
 
 CELERY_BROKER_URL = 'redis://:@'  # redis host
@@ -182,9 +266,26 @@ CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 
+# Сколько подписчиков обрабатывает одна подзадача рассылки
+NOTIFICATION_CHUNK_SIZE = 500
+# Через сколько секунд зависшая запись outbox снова считается свободной
+OUTBOX_LOCK_TIMEOUT = 600
+OUTBOX_MAX_ATTEMPTS = 5
+
 CACHES = {
+    # Быстрый LRU в памяти процесса перед общим файловым кэшем
     'default': {
-        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'BACKEND': 'news.cache_backends.TwoTierCache',
+        'TIMEOUT': 60,
+        'OPTIONS': {
+            'SHARED': 'shared',
+            'LOCAL_MAX_ENTRIES': 500,
+            'LOCAL_TIMEOUT': 5,
+            },
+        },
+    # Файловый кэш с атомарным add: на нём держатся блокировки get_or_set
+    'shared': {
+        'BACKEND': 'news.cache_backends.LockingFileBasedCache',
         'LOCATION': os.path.join(BASE_DIR, 'cache_files'),
         'OPTIONS': {
             'MAX_ENTRIES': 1000,
@@ -194,6 +295,13 @@ CACHES = {
         }
     }
 
+# Запросы дольше порога пишутся в лог news.performance с самыми долгими SQL,
+# SAMPLE_RATE — доля таких запросов, попадающих в лог
+PERFORMANCE_SLOW_REQUEST_MS = 500
+PERFORMANCE_SLOW_SAMPLE_RATE = 1.0
+# Кому отдаётся /metrics (кроме staff-пользователей)
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
 LOG_DIR = os.path.join(BASE_DIR, 'logs')
 os.makedirs(LOG_DIR, exist_ok=True)
 
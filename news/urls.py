@@ -17,6 +17,8 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from .metrics import metrics_view
+
 
 urlpatterns = [
    path('admin/', admin.site.urls),
@@ -24,6 +26,9 @@ urlpatterns = [
    # Делаем так, чтобы все адреса из нашего приложения (simpleapp/urls.py)
    # подключались к главному приложению с префиксом products/.
    path('posts/', include('post_news.urls')),
+   # JSON API только для чтения для мобильных и партнёрских клиентов
+   path('api/', include('post_news.api_urls')),
    path('', include('protect.urls')),
    path('accounts/', include('allauth.urls')),
+   path('metrics', metrics_view, name='metrics'),
 ]
@@ -1,7 +1,30 @@
 from django.contrib import admin
 
-from .models import Author, Category, Post
+from .forms import PostForm
+from .models import Author, Category, JobRun, Post, NotificationOutbox
+
+
+@admin.register(Post)
+class PostAdmin(admin.ModelAdmin):
+    # Форма сайта: категории сохраняются через save_m2m разницей с текущими
+    form = PostForm
+    list_display = ('title', 'post_type', 'author', 'created_at')
+    list_filter = ('post_type',)
+    list_select_related = ('author__user',)
+    search_fields = ('title',)
+
 
 admin.site.register(Category)
-admin.site.register(Post)
-admin.site.register(Author)
\ No newline at end of file
+admin.site.register(Author)
+admin.site.register(NotificationOutbox)
+
+
+@admin.register(JobRun)
+class JobRunAdmin(admin.ModelAdmin):
+    # История запусков только для просмотра: строки — аренды заданий
+    list_display = ('name', 'period', 'status', 'duration', 'items', 'attempts', 'holder', 'started_at')
+    list_filter = ('name', 'status')
+    readonly_fields = [field.name for field in JobRun._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
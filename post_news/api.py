@@ -0,0 +1,205 @@
+"""
+JSON API только для чтения: лента, пост, категории и лента категории.
+
+Строки читаются через values() и сериализуются без создания моделей
+и без шаблонов. Готовое тело ответа кэшируется байтами вместе с ETag
+по полному URL в тех же пространствах имён, что и HTML-страницы,
+поэтому инвалидируется теми же сигналами; повторный запрос — пара
+чтений кэша, совпавший If-None-Match — 304 без тела.
+
+Текст поста отдаётся через цензуру, как и на странице поста.
+
+Параметры списков: cursor — курсор из next/previous, limit — размер
+страницы, fields — нужные поля через запятую (например, без text),
+type — NW или AR.
+"""
+import hashlib
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response, patch_response_headers
+from django.views.decorators.http import require_safe
+
+from . import caching
+from .censor import censor_text
+from .models import Category, Post
+from .pagination import CursorPaginator, InvalidCursor
+
+# Поле API -> колонка для values()
+POST_FIELDS = {
+    'id': 'id',
+    'post_type': 'post_type',
+    'title': 'title',
+    'excerpt': 'excerpt',
+    'text': 'text',
+    'created_at': 'created_at',
+    'updated_at': 'updated_at',
+    'rating': 'rating',
+    'author': 'author__user__username',
+}
+# Поля, которые и в HTML выводятся через фильтр censor
+CENSORED_FIELDS = {'text'}
+LIST_FIELDS = ['id', 'post_type', 'title', 'excerpt', 'created_at']
+DETAIL_FIELDS = [*POST_FIELDS, 'categories']
+# Поля курсора читаются всегда, даже если клиент их не просил
+CURSOR_FIELDS = ['created_at', 'id']
+POST_TYPES = {value for value, label in Post.POST_TYPES}
+CONTENT_TYPE = 'application/json'
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _dumps(data):
+    return json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def cached_json(timeout, *namespaces):
+    """
+    Представление возвращает данные для JSON, декоратор кэширует
+    сериализованное тело с его ETag и отвечает 304 по If-None-Match.
+    Пространства имён — как у cache_page_in.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            names = [
+                namespace(**kwargs) if callable(namespace) else namespace
+                for namespace in namespaces
+            ]
+            generations = '.'.join(f'{name}.{caching.generation(name)}' for name in names)
+            key = f'api:{generations}:{hashlib.md5(request.get_full_path().encode()).hexdigest()}'
+
+            cached = cache.get(key)
+            if cached is None:
+                try:
+                    body = _dumps(view(request, *args, **kwargs))
+                except ApiError as error:
+                    return JsonResponse({'detail': error.message}, status=error.status)
+                cached = (f'"{hashlib.md5(body).hexdigest()}"', body)
+                cache.set(key, cached, timeout)
+
+            etag, body = cached
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = HttpResponse(body, content_type=CONTENT_TYPE)
+            response.headers['ETag'] = etag
+            patch_response_headers(response, timeout)
+            return response
+        return wrapper
+    return decorator
+
+
+def _fields(request, allowed, default):
+    value = request.GET.get('fields')
+    if not value:
+        return default
+    fields = list(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in allowed]
+    if unknown or not fields:
+        raise ApiError(400, f'Unknown fields: {", ".join(unknown)}. Allowed: {", ".join(allowed)}.')
+    return fields
+
+
+def _limit(request):
+    value = request.GET.get('limit')
+    if value is None:
+        return settings.API_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= settings.API_MAX_PAGE_SIZE:
+        raise ApiError(400, f'limit must be between 1 and {settings.API_MAX_PAGE_SIZE}.')
+    return limit
+
+
+def _page_url(request, cursor):
+    if cursor is None:
+        return None
+    query = request.GET.copy()
+    query['cursor'] = cursor
+    return f'{request.path}?{query.urlencode()}'
+
+
+def _columns(fields):
+    return list(dict.fromkeys(POST_FIELDS[field] for field in fields))
+
+
+def _row(row, fields):
+    # Колонки values() переименовываются в поля API, например author
+    data = {field: row[POST_FIELDS[field]] for field in fields}
+    for field in CENSORED_FIELDS.intersection(data):
+        data[field] = censor_text(data[field])
+    return data
+
+
+def _post_page(request, queryset):
+    """Страница постов с курсорами по values()-строкам."""
+    fields = _fields(request, POST_FIELDS, LIST_FIELDS)
+    post_type = request.GET.get('type')
+    if post_type is not None:
+        if post_type not in POST_TYPES:
+            raise ApiError(400, f'type must be one of {", ".join(sorted(POST_TYPES))}.')
+        queryset = queryset.filter(post_type=post_type)
+
+    queryset = queryset.values(*_columns([*fields, *CURSOR_FIELDS]))
+    try:
+        page = CursorPaginator(queryset, _limit(request)).page(request.GET.get('cursor'))
+    except InvalidCursor:
+        raise ApiError(400, 'Invalid cursor.')
+
+    return {
+        'results': [_row(row, fields) for row in page.object_list],
+        'next': _page_url(request, page.next_cursor),
+        'previous': _page_url(request, page.previous_cursor),
+    }
+
+
+@require_safe
+@cached_json(60, caching.POSTS)
+def post_list(request):
+    return _post_page(request, Post.objects.all())
+
+
+@require_safe
+@cached_json(300, caching.post_namespace, caching.CATEGORIES)
+def post_detail(request, pk):
+    fields = _fields(request, DETAIL_FIELDS, DETAIL_FIELDS)
+    columns = [field for field in fields if field in POST_FIELDS]
+    post = Post.objects.filter(pk=pk).values(*_columns(columns or ['id'])).first()
+    if post is None:
+        raise ApiError(404, 'Post not found.')
+
+    data = _row(post, columns)
+    if 'categories' in fields:
+        data['categories'] = list(
+            Category.objects.filter(postcategory__post_id=pk).order_by('name').values('id', 'name')
+        )
+    return data
+
+
+@require_safe
+@cached_json(600, caching.CATEGORIES)
+def category_list(request):
+    return {'results': list(Category.objects.order_by('name').values('id', 'name'))}
+
+
+@require_safe
+@cached_json(300, caching.category_namespace)
+def category_posts(request, pk):
+    category = Category.objects.filter(pk=pk).values('id', 'name').first()
+    if category is None:
+        raise ApiError(404, 'Category not found.')
+    return {
+        'category': category,
+        **_post_page(request, Post.objects.filter(postcategory__category_id=pk)),
+    }
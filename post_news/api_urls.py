@@ -0,0 +1,10 @@
+from django.urls import path
+
+from . import api
+
+urlpatterns = [
+   path('posts/', api.post_list, name='api_post_list'),
+   path('posts/<int:pk>/', api.post_detail, name='api_post_detail'),
+   path('categories/', api.category_list, name='api_category_list'),
+   path('categories/<int:pk>/posts/', api.category_posts, name='api_category_posts'),
+]
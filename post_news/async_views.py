@@ -0,0 +1,115 @@
+"""
+Асинхронные варианты представлений для чтения: лента, пост, список
+категорий и категория. Данные читаются асинхронным ORM и API кэша,
+поэтому под ASGI запрос не держит поток, пока ждёт базу или кэш.
+
+Шаблоны и контекст те же, что у синхронных представлений; ответ
+рендерится из уже прочитанных списков, ленивых запросов в шаблон
+не передаётся. Рендеринг синхронный ({% cache %} и кэш фрагментов
+читают файловый кэш), поэтому идёт в пуле потоков, а не в цикле
+событий. Подключаются вместо синхронных при ASYNC_READ_VIEWS.
+"""
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.http import Http404
+from django.shortcuts import render
+
+from . import caching
+from .caching import acache_page_in, conditional_page
+from .models import Category, Post
+from .pagination import CursorPaginator, InvalidCursor, cursor_requested, number_page
+from .views import (
+    CategoryDetailView, CategoryListView, PostDetail, PostList,
+    categories_version, category_version, post_version, posts_version
+)
+
+
+# Шаблону база не нужна, поэтому не обязательно ждать общий
+# sync-поток, в котором Django выполняет синхронный код с базой
+_render = sync_to_async(render, thread_sensitive=False)
+
+
+async def _cursor_page(queryset, per_page, cursor):
+    try:
+        return await CursorPaginator(queryset, per_page).apage(cursor)
+    except InvalidCursor:
+        raise Http404('Неверный курсор страницы.')
+
+
+@conditional_page(posts_version)
+@acache_page_in(60, caching.POSTS)
+async def post_list(request):
+    if cursor_requested(request):
+        page = await _cursor_page(PostList.queryset, PostList.paginate_by, request.GET.get('cursor'))
+    else:
+        # Paginator синхронный: COUNT и выборка страницы уходят в поток
+        page = await sync_to_async(number_page)(
+            PostList.queryset.order_by(*PostList.ordering), PostList.paginate_by, request.GET.get('page')
+        )
+    return await _render(request, PostList.template_name, {
+        'posts': page.object_list,
+        'page_obj': page,
+        'paginator': getattr(page, 'paginator', None),
+        'is_paginated': page.has_other_pages(),
+        'time_now': datetime.utcnow(),
+        'next_sale': None,
+    })
+
+
+@conditional_page(post_version)
+@acache_page_in(300, caching.post_namespace)
+async def post_detail(request, pk):
+    object_key = await caching.amake_key(caching.post_namespace(pk), 'object')
+    post = await cache.aget(object_key)
+    if post is None:
+        try:
+            post = await Post.objects.aget(pk=pk)
+        except Post.DoesNotExist:
+            raise Http404('Пост не найден.')
+        await cache.aset(object_key, post, 300)
+
+    comments_key = await caching.amake_key(caching.comments_namespace(pk), 'list')
+    comments = await cache.aget(comments_key)
+    if comments is None:
+        comments = [comment async for comment in post.comment_set.aiterator()]
+        await cache.aset(comments_key, comments, 300)
+
+    return await _render(request, PostDetail.template_name, {
+        'post': post,
+        'object': post,
+        'comments': comments,
+    })
+
+
+@conditional_page(categories_version)
+@acache_page_in(600, caching.CATEGORIES)
+async def category_list(request):
+    categories = [category async for category in Category.objects.aiterator()]
+    return await _render(request, CategoryListView.template_name, {
+        'categories': categories,
+        'object_list': categories,
+    })
+
+
+@conditional_page(category_version)
+@acache_page_in(300, caching.category_namespace)
+async def category_detail(request, pk):
+    try:
+        category = await Category.objects.aget(pk=pk)
+    except Category.DoesNotExist:
+        raise Http404('Категория не найдена.')
+
+    streams = {}
+    for name, post_type in (('news', Post.NEWS), ('articles', Post.ARTICLE)):
+        queryset = Post.category_stream(category.pk, post_type)
+        streams[name] = await _cursor_page(
+            queryset, CategoryDetailView.paginate_by, request.GET.get(f'{name}_cursor')
+        )
+
+    return await _render(request, CategoryDetailView.template_name, {
+        'category': category,
+        'object': category,
+        **streams,
+    })
@@ -0,0 +1,312 @@
+"""
+Версионированные пространства имён кэша.
+
+У каждого пространства (лента постов, конкретный пост, его комментарии...)
+есть счётчик поколения, и он входит в каждый ключ этого пространства.
+Инвалидация — один incr счётчика: старые ключи перестают читаться
+и просто вытесняются по таймауту, перебирать их не нужно.
+
+incr общего кэша должен быть атомарным (LockingFileBasedCache
+в news/cache_backends.py): иначе две одновременные инвалидации
+запишут одно и то же g + 1, и одна из них потеряется.
+"""
+import datetime
+import hashlib
+import time
+from functools import partial, wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.template.loader import get_template
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_response_headers
+from django.utils.http import http_date
+from django.utils.safestring import mark_safe
+from django.views.decorators.cache import cache_page
+
+from . import snapshots
+
+# Ленты и поиск: меняются при любом изменении любого поста
+POSTS = 'posts'
+CATEGORIES = 'categories'
+
+# Фрагменты строк списков не инвалидируются, а вытесняются по таймауту:
+# правка объекта меняет его версию, а с ней и ключ фрагмента
+FRAGMENT_TIMEOUT = 24 * 60 * 60
+
+# Версия шаблонов строк в ключе фрагмента: увеличить при изменении
+# post_row.html и других шаблонов cached_fragments, иначе после деплоя
+# строки до таймаута отдаются в старой разметке
+FRAGMENT_VERSION = 1
+
+
+def post_namespace(pk, **kwargs):
+    return f'post:{pk}'
+
+
+def comments_namespace(pk, **kwargs):
+    return f'comments:{pk}'
+
+
+def category_namespace(pk, **kwargs):
+    return f'category:{pk}'
+
+
+def _generation_key(namespace):
+    return f'ns:{namespace}:gen'
+
+
+def _initial_generation():
+    # Если счётчик вытеснен, новый начинается с текущего времени
+    # и не совпадёт ни с одним из прежних поколений
+    return time.time_ns() // 1000
+
+
+def generation(namespace):
+    key = _generation_key(namespace)
+    value = cache.get(key)
+    if value is None:
+        cache.add(key, _initial_generation(), None)
+        value = cache.get(key)
+    return value
+
+
+async def ageneration(namespace):
+    key = _generation_key(namespace)
+    value = await cache.aget(key)
+    if value is None:
+        await cache.aadd(key, _initial_generation(), None)
+        value = await cache.aget(key)
+    return value
+
+
+def bump(*namespaces):
+    """
+    Сдвигает поколения после фиксации текущей транзакции: до неё
+    читатель закэшировал бы под новым поколением ещё старые данные.
+    Вне транзакции сдвигает сразу.
+    """
+    transaction.on_commit(partial(_bump, namespaces), robust=True)
+
+
+def _bump(namespaces):
+    for namespace in namespaces:
+        key = _generation_key(namespace)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, _initial_generation(), None)
+
+
+def make_key(namespace, *parts):
+    return ':'.join([namespace, str(generation(namespace)), *map(str, parts)])
+
+
+async def amake_key(namespace, *parts):
+    # Для асинхронных представлений: поколение читается через aget/aadd,
+    # без блокирующего чтения файлового кэша в цикле событий
+    return ':'.join([namespace, str(await ageneration(namespace)), *map(str, parts)])
+
+
+def cache_page_in(timeout, *namespaces):
+    """
+    cache_page, ключ которого включает поколения пространств имён.
+    Пространство можно задать функцией от kwargs представления,
+    например post_namespace для страницы конкретного поста.
+    """
+    def decorator(view):
+        def render_or_snapshot(request, *args, **kwargs):
+            # Промах кэша страниц: сначала снимок той же версии, если он есть
+            response = snapshots.serve(request)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            # Шаблон рендерится позже, личный ли ответ — видно после рендеринга;
+            # private не даёт cache_page сохранить страницу
+            if getattr(response, 'is_rendered', True):
+                _forbid_shared_cache(request, response)
+            else:
+                response.add_post_render_callback(partial(_forbid_shared_cache, request))
+            return response
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            names = [
+                namespace(**kwargs) if callable(namespace) else namespace
+                for namespace in namespaces
+            ]
+            key_prefix = '.'.join(f'{name}.{generation(name)}' for name in names)
+            request.page_version = key_prefix
+            return cache_page(timeout, key_prefix=key_prefix)(render_or_snapshot)(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def is_personal(request, response):
+    """
+    Ответ нельзя класть в общий кэш страниц: запрос пришёл с cookie
+    (сессия, csrftoken), при рендеринге выдан csrf-токен формы,
+    ответ ставит cookie или зависит от всех заголовков (Vary: *).
+    """
+    return bool(
+        request.COOKIES
+        or request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+        or response.cookies
+        or '*' in _vary_headers(response)
+    )
+
+
+def _forbid_shared_cache(request, response):
+    # Cookie запроса сюда не относятся: страницы с ними cache_page
+    # и так хранит отдельно по Vary: Cookie
+    if request.META.get('CSRF_COOKIE_NEEDS_UPDATE') or response.cookies:
+        patch_cache_control(response, private=True)
+
+
+def _vary_headers(response):
+    return sorted({header.strip().upper() for header in response.get('Vary', '').split(',') if header.strip()})
+
+
+def _vary_key(request, headers, url):
+    # Как у cache_page: значения заголовков из Vary входят в ключ тела
+    values = '|'.join(request.META.get('HTTP_' + header.replace('-', '_'), '') for header in headers)
+    return hashlib.md5(f'{url}|{values}'.encode()).hexdigest()
+
+
+def acache_page_in(timeout, *namespaces):
+    """
+    То же для async-представлений. cache_page обращается к кэшу
+    синхронно, поэтому здесь кэшируется готовое тело страницы
+    по полному URL и заголовкам из Vary через асинхронный API кэша.
+    Кэш читается и пишется только для GET/HEAD без cookie,
+    личные ответы (см. is_personal) не кэшируются.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or request.COOKIES:
+                return await view(request, *args, **kwargs)
+
+            names = [
+                namespace(**kwargs) if callable(namespace) else namespace
+                for namespace in namespaces
+            ]
+            generations = [f'{name}.{await ageneration(name)}' for name in names]
+            request.page_version = '.'.join(generations)
+            url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+            # Список заголовков из Vary хранится по URL, как у cache_page
+            headers_key = ':'.join(['page.vary', *generations, url])
+
+            headers = await cache.aget(headers_key)
+            content = None
+            if headers is not None:
+                content = await cache.aget(':'.join(['page', *generations, _vary_key(request, headers, url)]))
+            if content is not None:
+                response = HttpResponse(content)
+                if headers:
+                    response['Vary'] = ', '.join(headers)
+            else:
+                response = await sync_to_async(snapshots.serve)(request)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                if response.status_code == 200 and not response.streaming and not is_personal(request, response):
+                    headers = _vary_headers(response)
+                    await cache.aset(headers_key, headers, timeout)
+                    await cache.aset(':'.join(['page', *generations, _vary_key(request, headers, url)]),
+                                     response.content, timeout)
+            patch_response_headers(response, timeout)
+            return response
+        return wrapper
+    return decorator
+
+
+def _validators(request, version):
+    # Слабый ETag: страница одной версии может отличаться байтами
+    # (шапка для вошедшего пользователя)
+    digest = hashlib.md5(f'{version}|{request.get_full_path()}'.encode()).hexdigest()
+    last_modified = None
+    if isinstance(version, datetime.datetime):
+        last_modified = int(version.timestamp())
+    return f'W/"{digest}"', last_modified
+
+
+def _set_validators(response, etag, last_modified):
+    # Заголовки перезаписываются: страница из cache_page хранит те,
+    # что были выставлены при её сохранении
+    if response.status_code in (200, 304):
+        response.headers['ETag'] = etag
+        if last_modified is not None:
+            response.headers['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def conditional_page(version_func):
+    """
+    Условный GET. version_func(request, **kwargs) возвращает версию
+    страницы: время последнего изменения (даёт ещё и Last-Modified)
+    или непрозрачное значение вроде поколения кэша; None — страницы нет.
+    Если клиент прислал совпадающий If-None-Match/If-Modified-Since,
+    отвечаем 304 до рендеринга и до чтения страницы из кэша, поэтому
+    декоратор ставится снаружи cache_page_in.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return await view(request, *args, **kwargs)
+                version = await sync_to_async(version_func)(request, *args, **kwargs)
+                if version is None:
+                    return await view(request, *args, **kwargs)
+                etag, last_modified = _validators(request, version)
+                response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                return _set_validators(response, etag, last_modified)
+        else:
+            @wraps(view)
+            def wrapper(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return view(request, *args, **kwargs)
+                version = version_func(request, *args, **kwargs)
+                if version is None:
+                    return view(request, *args, **kwargs)
+                etag, last_modified = _validators(request, version)
+                response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+                if response is None:
+                    response = view(request, *args, **kwargs)
+                return _set_validators(response, etag, last_modified)
+        return wrapper
+    return decorator
+
+
+def fragment_key(template_name, obj, version_field='updated_at'):
+    version = getattr(obj, version_field)
+    if isinstance(version, datetime.datetime):
+        version = int(version.timestamp() * 1_000_000)
+    return f'fragment:v{FRAGMENT_VERSION}:{template_name}:{obj.pk}:{version}'
+
+
+def render_fragments(template_name, objects, name='object', version_field='updated_at',
+                     timeout=FRAGMENT_TIMEOUT):
+    """
+    Рендерит шаблон строки для каждого объекта списка с кэшированием
+    по фрагменту на объект. Ключ — версия и имя шаблона, pk и версия объекта,
+    поэтому правка объекта заменяет только его строку, а смена FRAGMENT_VERSION —
+    все строки. Фрагменты страницы читаются одним get_many, недостающие
+    рендерятся и пишутся одним set_many.
+    Шаблон строки получает только объект, без контекста запроса.
+    """
+    objects = list(objects)
+    keys = [fragment_key(template_name, obj, version_field) for obj in objects]
+    fragments = cache.get_many(keys)
+
+    missing = {}
+    if len(fragments) < len(set(keys)):
+        row_template = get_template(template_name)
+        for key, obj in zip(keys, objects):
+            if key not in fragments:
+                missing[key] = fragments[key] = row_template.render({name: obj})
+        cache.set_many(missing, timeout)
+
+    return [mark_safe(fragments[key]) for key in keys]
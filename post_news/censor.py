@@ -0,0 +1,92 @@
+"""
+Цензура текста одним проходом.
+
+Список слов (settings.CENSOR_WORDS) один раз компилируется в регулярное
+выражение-префиксное дерево: на каждой позиции текста проверяется не
+каждое слово, а только одна ветка дерева, поэтому время растёт с длиной
+текста и почти не зависит от размера списка. Совпадения ищутся без учёта
+регистра и только целыми словами, первая буква слова сохраняется.
+"""
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+DEFAULT_WORDS = ['редиска', 'дурак', 'идиот']
+# Запоминаются только короткие строки: заголовки и превью
+MEMOIZE_MAX_LENGTH = 1000
+
+_matcher = None
+
+
+def _node_pattern(node):
+    branches = [
+        re.escape(char) + _node_pattern(child)
+        for char, child in sorted(node.items())
+        if char
+    ]
+    if not branches:
+        return ''
+    body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    # Конец слова внутри дерева: продолжение необязательно
+    return f'(?:{body})?' if '' in node else body
+
+
+def trie_pattern(words):
+    trie = {}
+    for word in words:
+        word = word.strip().lower()
+        if not word:
+            continue
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+    return _node_pattern(trie)
+
+
+def compile_matcher(words):
+    pattern = trie_pattern(words)
+    if not pattern:
+        return None
+    return re.compile(rf'\b{pattern}\b', re.IGNORECASE)
+
+
+def get_matcher():
+    global _matcher
+    if _matcher is None:
+        _matcher = compile_matcher(getattr(settings, 'CENSOR_WORDS', DEFAULT_WORDS)) or False
+    return _matcher
+
+
+def _mask(match):
+    word = match.group()
+    return word[0] + '*' * (len(word) - 1)
+
+
+def _censor(text):
+    matcher = get_matcher()
+    if not matcher:
+        return text
+    return matcher.sub(_mask, text)
+
+
+@lru_cache(maxsize=4096)
+def _censor_memoized(text):
+    return _censor(text)
+
+
+def censor_text(text):
+    if len(text) <= MEMOIZE_MAX_LENGTH:
+        return _censor_memoized(text)
+    return _censor(text)
+
+
+@receiver(setting_changed)
+def reset_matcher(setting, **kwargs):
+    global _matcher
+    if setting == 'CENSOR_WORDS':
+        _matcher = None
+        _censor_memoized.cache_clear()
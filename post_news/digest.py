@@ -0,0 +1,76 @@
+from collections import defaultdict
+from itertools import groupby
+from operator import itemgetter
+
+from django.contrib.sites.models import Site
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+
+from .mailing import USERNAME_PLACEHOLDER
+from .models import Category, PostCategory
+
+
+class WeeklyDigest:
+    """
+    Дайджест за последние семь дней.
+
+    Посты недели читаются одним запросом и раскладываются по категориям,
+    подписки читаются вторым запросом потоком, отсортированные по пользователю.
+    Письмо рендерится один раз на каждый уникальный набор категорий
+    и переиспользуется для всех пользователей с таким же набором.
+    """
+
+    def __init__(self, now=None):
+        self.since = (now or timezone.now()) - timezone.timedelta(days=7)
+        self.category_posts = self._load_category_posts()
+        self.rendered = {}
+
+    def _load_category_posts(self):
+        category_posts = defaultdict(list)
+        rows = PostCategory.objects.filter(
+            post__created_at__gte=self.since
+        ).order_by('-post__created_at', '-post_id').values_list(
+            'category_id', 'post_id', 'post__title', 'post__created_at'
+        )
+        for category_id, post_id, title, created_at in rows:
+            category_posts[category_id].append((post_id, title, created_at))
+        return category_posts
+
+    def subscriptions(self):
+        # (username, email, набор категорий) — по одной строке на пользователя
+        rows = Category.subscribers.through.objects.filter(
+            category_id__in=self.category_posts
+        ).exclude(user__email='').order_by('user_id').values_list(
+            'user_id', 'user__username', 'user__email', 'category_id'
+        ).iterator()
+        for (_, username, email), group in groupby(rows, key=itemgetter(0, 1, 2)):
+            yield username, email, frozenset(row[3] for row in group)
+
+    def render(self, category_ids):
+        if category_ids not in self.rendered:
+            posts = {}
+            for category_id in category_ids:
+                for post_id, title, created_at in self.category_posts[category_id]:
+                    posts[post_id] = (title, created_at)
+
+            domain = self._domain()
+            self.rendered[category_ids] = render_to_string('weekly_digest_template.html', {
+                'username': USERNAME_PLACEHOLDER,
+                'posts': [
+                    {'title': title, 'url': f'http://{domain}{reverse("post_detail", args=[post_id])}'}
+                    for post_id, (title, created_at) in sorted(
+                        posts.items(), key=lambda item: item[1][1], reverse=True
+                    )
+                ],
+            })
+        return self.rendered[category_ids]
+
+    def _domain(self):
+        if not hasattr(self, '_site_domain'):
+            self._site_domain = Site.objects.get_current().domain
+        return self._site_domain
+
+    def __iter__(self):
+        for username, email, category_ids in self.subscriptions():
+            yield username, email, self.render(category_ids)
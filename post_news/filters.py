@@ -2,9 +2,15 @@ from django import forms
 from django_filters import FilterSet, DateFilter, CharFilter
 
 from .models import Post
+from .search import full_text_search
 
 
 class PostFilter(FilterSet):
+    q = CharFilter(
+        method='filter_full_text',
+        label='Поиск по тексту'
+    )
+
     title = CharFilter(
         field_name='title',
         lookup_expr='icontains',
@@ -26,4 +32,8 @@ class PostFilter(FilterSet):
 
     class Meta:
         model = Post
-        fields = ['title', 'author_name', 'created_after']
+        fields = ['q', 'title', 'author_name', 'created_after']
+
+    def filter_full_text(self, queryset, name, value):
+        # Результаты упорядочены по релевантности (bm25)
+        return full_text_search(queryset, value)
@@ -2,8 +2,10 @@ from allauth.account.forms import SignupForm
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User, Group
+from django.db import transaction
 
-from .models import Post, PostCategory, Category
+from .models import Post, Category, NotificationOutbox
+from .tasks import drain_notification_outbox
 
 
 class PostForm(forms.ModelForm):
@@ -22,24 +24,33 @@ class PostForm(forms.ModelForm):
             'author'
         ]
 
-    def save(self, commit=True):
-        # Сохраняем пост
-        instance = super().save(commit=False)
-
-        if commit:
-            instance.save()
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # При редактировании отмечены текущие категории поста
+        if self.instance.pk and 'categories' not in self.initial:
+            self.initial['categories'] = list(self.instance.categories.values_list('pk', flat=True))
 
-        # Очищаем существующие связи
-        PostCategory.objects.filter(post=instance).delete()
+    def _save_m2m(self):
+        # Категории — единственное m2m поста; привязки сравниваются
+        # с текущими, меняются только добавленные и убранные
+        self.instance.set_categories(self.cleaned_data['categories'])
+        if self._creating:
+            # Запись в outbox — после категорий и в той же транзакции:
+            # подписчиков рассылка ищет по категориям поста, а воркер
+            # будится только после фиксации
+            NotificationOutbox.enqueue(self.instance)
+            transaction.on_commit(drain_notification_outbox.delay)
 
-        # Создаем новые связи с категориями
-        for category in self.cleaned_data['categories']:
-            PostCategory.objects.create(
-                post=instance,
-                category=category
-            )
-
-        return instance
+    def save(self, commit=True):
+        # Админка сохраняет пост сама, а категории — позже через save_m2m
+        self._creating = self.instance._state.adding
+        if not commit:
+            # Категории сохранит save_m2m после сохранения поста
+            return super().save(commit=False)
+        # Пост и его категории фиксируются вместе: читатели
+        # не увидят пост без категорий
+        with transaction.atomic():
+            return super().save()
 
 
 class BaseRegisterForm(UserCreationForm):
@@ -0,0 +1,37 @@
+from itertools import islice
+
+from django.core.mail import EmailMessage
+from django.utils.html import escape
+
+FROM_EMAIL = 'my_mail@mail.ru'
+# Маркер, на место которого в готовое письмо подставляется имя подписчика
+USERNAME_PLACEHOLDER = '__subscriber_username__'
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def pk_ranges(pks, size):
+    """
+    Границы пачек (after, last] по возрастающим pk: пачка — строки
+    с after < pk <= last. В памяти одновременно только одна пачка pk.
+    """
+    after = 0
+    for chunk in chunked(pks, size):
+        yield after, chunk[-1]
+        after = chunk[-1]
+
+
+def personalize(subject, message, username, email):
+    # Письмо уже отрендерено один раз на всех, здесь только подставляется имя
+    email_message = EmailMessage(
+        subject,
+        message.replace(USERNAME_PLACEHOLDER, escape(username)),
+        FROM_EMAIL,
+        [email],
+    )
+    email_message.content_subtype = 'html'
+    return email_message
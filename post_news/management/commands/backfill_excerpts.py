@@ -0,0 +1,43 @@
+import logging
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from post_news import caching
+from post_news.models import Post
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Computes Post.excerpt for existing posts in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        updated = 0
+        last_id = 0
+
+        while True:
+            batch = list(Post.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', 'text', 'excerpt')[:batch_size])
+            if not batch:
+                break
+
+            # updated_at тоже сдвигается: по нему строятся ключи фрагментов строк
+            now = timezone.now()
+            changed = []
+            for pk, text, excerpt in batch:
+                new_excerpt = Post.make_excerpt(text)
+                if new_excerpt != excerpt:
+                    changed.append(Post(pk=pk, excerpt=new_excerpt, updated_at=now))
+            Post.objects.bulk_update(changed, ['excerpt', 'updated_at'])
+
+            updated += len(changed)
+            last_id = batch[-1][0]
+
+        # bulk_update не шлёт сигналов, ленты инвалидируются разом
+        caching.bump(caching.POSTS)
+        logger.info("Backfilled %d excerpts.", updated)
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {updated} excerpts."))
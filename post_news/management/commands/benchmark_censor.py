@@ -0,0 +1,60 @@
+import random
+import timeit
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from post_news import censor
+
+ALPHABET = 'абвгдеёжзийклмнопрстуфхцчшщъыьэюя'
+
+
+def random_words(rng, count, min_length=4, max_length=10):
+    return [
+        ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(min_length, max_length)))
+        for _ in range(count)
+    ]
+
+
+def naive_censor(text, words):
+    # Прежняя реализация: два str.replace на каждое слово
+    for word in words:
+        censored_word = word[0] + '*' * (len(word) - 1)
+        text = text.replace(word, censored_word)
+        text = text.replace(word.capitalize(), censored_word.capitalize())
+    return text
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmark of the censor filter for growing word lists and text lengths."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--words', default='10,100,1000,5000')
+        parser.add_argument('--lengths', default='1000,10000,100000')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--naive', action='store_true', help="Also time the old replace loop.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        word_counts = [int(value) for value in options['words'].split(',')]
+        lengths = [int(value) for value in options['lengths'].split(',')]
+        vocabulary = random_words(rng, 2000)
+
+        self.stdout.write(f"{'words':>7} {'chars':>8} {'ms':>9} {'us/kchar':>9}" + (f" {'naive ms':>9}" if options['naive'] else ''))
+        for word_count in word_counts:
+            words = random_words(rng, word_count)
+            with override_settings(CENSOR_WORDS=words):
+                censor.get_matcher()
+                for length in lengths:
+                    text = ''
+                    while len(text) < length:
+                        # Примерно каждое двадцатое слово текста — запрещённое
+                        text += (rng.choice(words) if rng.random() < 0.05 else rng.choice(vocabulary)) + ' '
+                    text = text[:length]
+
+                    seconds = min(timeit.repeat(lambda: censor._censor(text), number=1, repeat=options['repeat']))
+                    line = f"{word_count:>7} {length:>8} {seconds * 1000:>9.3f} {seconds * 1e6 / (length / 1000):>9.2f}"
+                    if options['naive']:
+                        naive = min(timeit.repeat(lambda: naive_censor(text, words), number=1, repeat=options['repeat']))
+                        line += f" {naive * 1000:>9.3f}"
+                    self.stdout.write(line)
@@ -0,0 +1,88 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from post_news import ratelimit
+from post_news.models import Author, Category, Post
+from post_news.pagination import NEXT, CursorPaginator
+from post_news.views import CategoryDetailView, PostList, news_author, news_in_window
+
+logger = logging.getLogger(__name__)
+
+
+def hot_queries():
+    """
+    Запросы, которые строят сами представления, через те же queryset
+    и функции. Идентификаторы берутся из базы, если там есть данные.
+    """
+    now = timezone.now()
+    author_id = Author.objects.values_list('pk', flat=True).first() or 1
+    category_id = Category.objects.values_list('pk', flat=True).first() or 1
+
+    feed = PostList.queryset.order_by(*PostList.ordering)
+    feed_cursor = CursorPaginator(PostList.queryset, PostList.paginate_by, PostList.cursor_ordering)
+    stream = CursorPaginator(Post.category_stream(category_id, Post.NEWS), CategoryDetailView.paginate_by)
+    rows = stream.per_page + 1
+
+    return {
+        'feed': feed[:PostList.paginate_by],
+        'feed_cursor': feed_cursor._query(
+            feed_cursor.encode(NEXT, {'created_at': now, 'id': 1})
+        )[1][:rows],
+        'category_stream': stream._query(None)[1][:rows],
+        'category_stream_cursor': stream._query(
+            stream.encode(NEXT, {'created_at': now, 'id': 1})
+        )[1][:rows],
+        'daily_limit_author': news_author(author_id),
+        'daily_limit': news_in_window(author_id, ratelimit.get_rate('news_create'), now),
+    }
+
+
+def explain(queryset):
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def unindexed_steps(plan):
+    # Каждое чтение таблицы должно идти по индексу или по первичному ключу
+    return [
+        step for step in plan
+        if step.startswith(('SCAN', 'SEARCH')) and ' USING ' not in step
+    ]
+
+
+class Command(BaseCommand):
+    help = "Checks that the hot feed, category and daily-limit queries use indexes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--analyze', action='store_true',
+            help="Run ANALYZE first: without statistics SQLite may plan differently than on real data.",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("Query plan check is only implemented for SQLite.")
+
+        if options['analyze']:
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+        failed = []
+        for name, queryset in hot_queries().items():
+            plan = explain(queryset)
+            bad = unindexed_steps(plan)
+            status = self.style.ERROR('FAIL') if bad else self.style.SUCCESS('OK')
+            self.stdout.write(f"{status} {name}")
+            for step in plan:
+                self.stdout.write(f"    {step}")
+            if bad:
+                failed.append(name)
+
+        if failed:
+            logger.error("Queries without index: %s", ', '.join(failed))
+            raise CommandError(f"Queries without index: {', '.join(failed)}")
@@ -0,0 +1,36 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from post_news import transfer
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Streams all posts as JSONL or CSV to stdout or a file, in the format import_posts reads."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(transfer.FORMATS), default='jsonl')
+        parser.add_argument('--output', help="File to write; stdout by default.")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Rows fetched from the database at a time.")
+
+    def handle(self, *args, **options):
+        encode, content_type = transfer.FORMATS[options['format']]
+        lines = encode(transfer.export_records(options['chunk_size']))
+
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+
+        exported = 0
+        with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+            for line in lines:
+                output.write(line)
+                exported += 1
+        if options['format'] == 'csv':
+            # Первая строка CSV — заголовок
+            exported -= 1
+        logger.info("Exported %d posts to %s.", exported, options['output'])
+        self.stdout.write(self.style.SUCCESS(f"Exported {exported} posts to {options['output']}."))
@@ -0,0 +1,41 @@
+import logging
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from post_news import transfer
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports posts from a JSONL file (or stdin with '-') in batches: one bulk insert "
+        "of posts, their categories and outbox entries per batch. See post_news.transfer for the format."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="JSONL file, or '-' for stdin.")
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--no-notify', action='store_true',
+                            help="Do not email subscribers about imported posts (e.g. for archives).")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+
+        # Уже загруженные пачки остаются в базе, ошибка останавливает импорт
+        # на строке, с которой его можно продолжить
+        try:
+            if options['path'] == '-':
+                created = transfer.import_posts(sys.stdin, options['batch_size'], not options['no_notify'])
+            else:
+                with open(options['path'], encoding='utf-8') as lines:
+                    created = transfer.import_posts(lines, options['batch_size'], not options['no_notify'])
+        except transfer.InvalidRecord as error:
+            raise CommandError(f"Import stopped at {error}; batches before it were saved.")
+        except OSError as error:
+            raise CommandError(str(error))
+
+        logger.info("Imported %d posts.", created)
+        self.stdout.write(self.style.SUCCESS(f"Imported {created} posts."))
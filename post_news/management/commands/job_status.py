@@ -0,0 +1,46 @@
+import logging
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from post_news import scheduler
+from post_news.models import JobRun
+from post_news.tasks import SCHEDULED_JOBS
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Shows recent runs of scheduled jobs (status, duration, items, which replica ran them) "
+        "and flags jobs with no successful run within the last two periods."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help="Recent runs shown per job.")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        overdue = 0
+        for name, (task, period, lease_seconds) in SCHEDULED_JOBS.items():
+            runs = list(JobRun.objects.filter(name=name).order_by('-started_at')[:options['runs']])
+            last_success = JobRun.objects.filter(
+                name=name, status=JobRun.SUCCESS
+            ).order_by('-started_at').values_list('started_at', flat=True).first()
+
+            # Запуск раз в период: если успеха нет и за два периода,
+            # пропущен по меньшей мере один запуск целиком
+            missed = last_success is None or now - last_success > 2 * scheduler.PERIODS[period]
+            overdue += missed
+            header = f"{name} (every {period}, current period {scheduler.period_key(period, now)})"
+            self.stdout.write(self.style.WARNING(f"{header}: OVERDUE") if missed else header)
+            for run in runs:
+                duration = f"{run.duration:.2f} s" if run.duration is not None else '-'
+                items = run.items if run.items is not None else '-'
+                self.stdout.write(
+                    f"  {run.period:<18} {run.status:<8} {duration:>10}  items {items:<6} "
+                    f"attempts {run.attempts}  {run.holder}  {run.error}"
+                )
+
+        logger.info("Job status: %d of %d jobs overdue.", overdue, len(SCHEDULED_JOBS))
+        self.stdout.write(self.style.SUCCESS(f"{len(SCHEDULED_JOBS)} jobs, {overdue} overdue."))
@@ -0,0 +1,117 @@
+import http.client
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from post_news.management.stats import percentile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATHS = '/posts/,/posts/categories/'
+
+
+class Command(BaseCommand):
+    help = (
+        "Drives running deployments with concurrent keep-alive GET requests and "
+        "reports requests/second and latency per target. To compare WSGI and ASGI "
+        "at equal worker counts, start both with the same --workers, e.g. "
+        "`gunicorn -w 4 -b :8000 news.wsgi` and `uvicorn --workers 4 --port 8001 news.asgi:application`, "
+        "then run `load_test --target wsgi=http://127.0.0.1:8000 --target asgi=http://127.0.0.1:8001`."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', action='append', required=True,
+                            help="NAME=BASE_URL of a running deployment; repeat for each one.")
+        parser.add_argument('--paths', default=DEFAULT_PATHS,
+                            help="Comma-separated paths, requested round-robin.")
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--duration', type=float, default=20.0, help="Seconds per target.")
+        parser.add_argument('--warmup', type=float, default=2.0,
+                            help="Seconds of unmeasured requests before each run, to fill caches.")
+        parser.add_argument('--output', default='load_test_results.json')
+
+    def handle(self, *args, **options):
+        paths = [path.strip() for path in options['paths'].split(',') if path.strip()]
+        targets = []
+        for target in options['target']:
+            name, sep, url = target.partition('=')
+            if not sep or not url.startswith(('http://', 'https://')):
+                raise CommandError(f"Bad --target {target!r}; expected NAME=http://host:port.")
+            targets.append((name, url.rstrip('/')))
+
+        results = {}
+        for name, url in targets:
+            self.run(url, paths, options['concurrency'], options['warmup'])
+            result = self.run(url, paths, options['concurrency'], options['duration'])
+            results[name] = result
+            self.stdout.write(
+                f"{name:<10} {result['rps']:>8.1f} req/s  p50 {result['p50_ms']:>7.1f} ms  "
+                f"p95 {result['p95_ms']:>7.1f} ms  p99 {result['p99_ms']:>7.1f} ms  "
+                f"errors {result['errors']}"
+            )
+
+        with open(options['output'], 'w') as output:
+            json.dump({
+                'concurrency': options['concurrency'],
+                'duration': options['duration'],
+                'paths': paths,
+                'targets': results,
+            }, output, indent=2)
+
+        logger.info("Load test results written to %s.", options['output'])
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}."))
+
+    def run(self, base_url, paths, concurrency, duration):
+        deadline = time.perf_counter() + duration
+        lock = threading.Lock()
+        latencies = []
+        errors = [0]
+
+        def worker(offset):
+            parts = urlsplit(base_url)
+            connection_class = (
+                http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+            )
+            connection = connection_class(parts.netloc, timeout=30)
+            own, failed, index = [], 0, offset
+            while time.perf_counter() < deadline:
+                path = parts.path + paths[index % len(paths)]
+                index += 1
+                started = time.perf_counter()
+                try:
+                    connection.request('GET', path)
+                    response = connection.getresponse()
+                    response.read()
+                    if response.status >= 400:
+                        failed += 1
+                    else:
+                        own.append(time.perf_counter() - started)
+                except (OSError, http.client.HTTPException):
+                    failed += 1
+                    connection.close()
+            connection.close()
+            with lock:
+                latencies.extend(own)
+                errors[0] += failed
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(worker, range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+        if not latencies:
+            return {'requests': 0, 'errors': errors[0], 'rps': 0.0,
+                    'p50_ms': 0.0, 'p95_ms': 0.0, 'p99_ms': 0.0}
+        return {
+            'requests': len(latencies),
+            'errors': errors[0],
+            'rps': len(latencies) / elapsed,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+        }
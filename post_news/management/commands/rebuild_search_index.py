@@ -0,0 +1,23 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from post_news import search
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the SQLite FTS5 index over post titles and texts in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("Full-text index is only available on SQLite.")
+
+        indexed = search.rebuild(batch_size=options['batch_size'])
+        logger.info("Indexed %d posts.", indexed)
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} posts."))
@@ -0,0 +1,39 @@
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from post_news import snapshots
+from post_news.mailing import chunked
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Re-renders static snapshots of all post and category pages and the first feed pages."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help="Render processes.")
+        parser.add_argument('--chunk-size', type=int, default=200, help="Pages per worker task.")
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError("--workers must be at least 1.")
+
+        started = time.perf_counter()
+        # Лента рендерится здесь: её курсоры зависят друг от друга
+        rendered = snapshots.render_list()
+        chunks = list(chunked(snapshots.all_paths(), options['chunk_size']))
+
+        # Соединения не должны наследоваться дочерними процессами
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as pool:
+            for count in pool.map(snapshots.render_many, chunks):
+                rendered += count
+
+        elapsed = time.perf_counter() - started
+        logger.info("Rendered %d snapshots in %.1f s.", rendered, elapsed)
+        self.stdout.write(self.style.SUCCESS(f"Rendered {rendered} snapshots in {elapsed:.1f} s."))
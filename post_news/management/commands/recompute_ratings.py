@@ -0,0 +1,16 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from post_news.models import Author
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Recomputes all author ratings from posts and comments (reconciliation)."
+
+    def handle(self, *args, **options):
+        ratings = Author.recompute_ratings()
+        logger.info("Recomputed ratings for %d authors.", len(ratings))
+        self.stdout.write(self.style.SUCCESS(f"Recomputed ratings for {len(ratings)} authors."))
@@ -0,0 +1,215 @@
+import json
+import logging
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import (
+    CaptureQueriesContext, override_settings, setup_databases, setup_test_environment,
+    teardown_databases, teardown_test_environment
+)
+from django.urls import reverse
+
+from news.celery import app as celery_app
+from post_news.models import Author, Category, Comment, Post, PostCategory
+from post_news.pagination import NEXT, CursorPaginator
+from post_news.management.stats import percentile
+from post_news.tasks import send_post_notification, send_weekly_digest
+
+logger = logging.getLogger(__name__)
+
+# Без кэша: измеряется стоимость страницы при промахе
+NO_CACHE = {
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+    'shared': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+}
+
+WORDS = ['новости', 'спорт', 'политика', 'технологии', 'здоровье', 'город', 'погода', 'экономика']
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a synthetic dataset in a test database, drives the news views and "
+        "mail tasks over it and records latency and SQL query counts as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='1,4',
+                            help="Comma-separated dataset multipliers; query counts must not grow between them.")
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--authors', type=int, default=20)
+        parser.add_argument('--categories', type=int, default=10)
+        parser.add_argument('--posts', type=int, default=500)
+        parser.add_argument('--comments', type=int, default=1000)
+        parser.add_argument('--subscription-density', type=float, default=0.3,
+                            help="Probability that a user is subscribed to a given category.")
+        parser.add_argument('--requests', type=int, default=20, help="Requests per view.")
+        parser.add_argument('--output', default='bench_results.json')
+        parser.add_argument('--max-query-growth', type=int, default=0,
+                            help="Allowed growth of a view's query count between the smallest and largest scale.")
+
+    def handle(self, *args, **options):
+        scales = [int(scale) for scale in options['scales'].split(',')]
+        self.rng = random.Random(1)
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        always_eager = celery_app.conf.task_always_eager
+        celery_app.conf.task_always_eager = True
+        try:
+            with override_settings(CACHES=NO_CACHE, ALLOWED_HOSTS=['testserver']):
+                results = {scale: self.run_scale(scale, options) for scale in scales}
+        finally:
+            celery_app.conf.task_always_eager = always_eager
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        failures = self.check_query_growth(results, scales, options['max_query_growth'])
+        report = {
+            'scales': {str(scale): result for scale, result in results.items()},
+            'failures': failures,
+        }
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2, ensure_ascii=False)
+        self.stdout.write(f"Results written to {options['output']}")
+
+        if failures:
+            raise CommandError('; '.join(failures))
+
+    def run_scale(self, scale, options):
+        counts = {
+            'users': options['users'] * scale,
+            'authors': options['authors'] * scale,
+            'categories': options['categories'],
+            'posts': options['posts'] * scale,
+            'comments': options['comments'] * scale,
+        }
+        result = {}
+        try:
+            with transaction.atomic():
+                result['dataset'] = self.seed(counts, options['subscription_density'])
+                result['scenarios'] = self.run_scenarios(options['requests'])
+                raise Rollback
+        except Rollback:
+            pass
+
+        self.stdout.write(f"scale {scale}: {result['dataset']}")
+        for name, scenario in result['scenarios'].items():
+            self.stdout.write(
+                f"  {name:<24} p50 {scenario['p50_ms']:>8.2f} ms  p95 {scenario['p95_ms']:>8.2f} ms  "
+                f"queries {scenario['queries']}"
+            )
+        return result
+
+    def seed(self, counts, density):
+        rng = self.rng
+        users = User.objects.bulk_create([
+            User(username=f'bench_user_{index}', email=f'bench_user_{index}@example.com')
+            for index in range(counts['users'])
+        ])
+        authors = Author.objects.bulk_create([Author(user=user) for user in users[:counts['authors']]])
+        categories = Category.objects.bulk_create([
+            Category(name=f'bench_category_{index}') for index in range(counts['categories'])
+        ])
+
+        posts = []
+        for index in range(counts['posts']):
+            text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(50, 400)))
+            posts.append(Post(
+                author=rng.choice(authors),
+                post_type=rng.choice([Post.NEWS, Post.ARTICLE]),
+                title=f'bench post {index} {rng.choice(WORDS)}',
+                text=text,
+                excerpt=Post.make_excerpt(text),
+            ))
+        posts = Post.objects.bulk_create(posts)
+
+        PostCategory.objects.bulk_create([
+            PostCategory(post=post, category=category)
+            for post in posts
+            for category in rng.sample(categories, rng.randint(1, 2))
+        ])
+        Comment.objects.bulk_create([
+            Comment(post=rng.choice(posts), user=rng.choice(users), text='bench comment')
+            for _ in range(counts['comments'])
+        ])
+        subscriptions = Category.subscribers.through
+        subscriptions.objects.bulk_create([
+            subscriptions(category=category, user=user)
+            for category in categories
+            for user in users
+            if rng.random() < density
+        ])
+
+        self.posts = [post.pk for post in posts]
+        self.categories = [category.pk for category in categories]
+        return {**counts, 'subscriptions': subscriptions.objects.count()}
+
+    def measure(self, call, repeat):
+        timings = []
+        queries = 0
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                call()
+                timings.append(time.perf_counter() - started)
+            queries = max(queries, len(context.captured_queries))
+        return {
+            'requests': repeat,
+            'wall_ms': round(sum(timings) * 1000, 3),
+            'p50_ms': round(percentile(timings, 0.5) * 1000, 3),
+            'p95_ms': round(percentile(timings, 0.95) * 1000, 3),
+            'queries': queries,
+        }
+
+    def get(self, client, path):
+        def call():
+            response = client.get(path())
+            if response.status_code != 200:
+                raise CommandError(f"{response.status_code} for {response.request['PATH_INFO']}")
+        return call
+
+    def run_scenarios(self, repeat):
+        rng = self.rng
+        client = Client()
+        feed = Post.objects.order_by('-created_at', '-id')
+        middle = feed[len(self.posts) // 2]
+        deep_cursor = CursorPaginator(feed, 10).encode(NEXT, middle)
+
+        views = {
+            'post_list': lambda: reverse('post_list'),
+            'post_list_deep_page': lambda: f"{reverse('post_list')}?cursor={deep_cursor}",
+            'post_detail': lambda: reverse('post_detail', args=[rng.choice(self.posts)]),
+            'post_search_title': lambda: f"{reverse('post_search')}?title={rng.choice(WORDS)}",
+            'post_search_full_text': lambda: f"{reverse('post_search')}?q={rng.choice(WORDS)}",
+            'category_list': lambda: reverse('category_list'),
+            'category_detail': lambda: reverse('category_detail', args=[rng.choice(self.categories)]),
+        }
+        scenarios = {name: self.measure(self.get(client, path), repeat) for name, path in views.items()}
+        for scenario in scenarios.values():
+            scenario['kind'] = 'view'
+
+        tasks = {
+            'send_post_notification': lambda: send_post_notification(rng.choice(self.posts)),
+            'send_weekly_digest': send_weekly_digest,
+        }
+        for name, call in tasks.items():
+            scenarios[name] = {**self.measure(call, 1 if name == 'send_weekly_digest' else repeat), 'kind': 'task'}
+        return scenarios
+
+    def check_query_growth(self, results, scales, allowed):
+        if len(scales) < 2:
+            return []
+        smallest, largest = results[min(scales)]['scenarios'], results[max(scales)]['scenarios']
+        return [
+            f"{name}: {smallest[name]['queries']} -> {scenario['queries']} queries"
+            for name, scenario in largest.items()
+            if scenario['kind'] == 'view' and scenario['queries'] > smallest[name]['queries'] + allowed
+        ]
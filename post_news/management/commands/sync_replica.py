@@ -0,0 +1,42 @@
+import logging
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from news.db_routers import PRIMARY, REPLICA
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Copies the primary SQLite database into the replica file (online backup)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=1024,
+                            help="Pages copied per step; readers are not blocked between steps.")
+
+    def handle(self, *args, **options):
+        if REPLICA not in settings.DATABASES:
+            raise CommandError("No replica configured; set NEWS_REPLICA_DB.")
+
+        primary = connections[PRIMARY].settings_dict
+        replica = connections[REPLICA].settings_dict
+        if primary['ENGINE'] != 'django.db.backends.sqlite3' or replica['ENGINE'] != primary['ENGINE']:
+            raise CommandError("sync_replica only works with SQLite databases.")
+        if str(primary['NAME']) == str(replica['NAME']):
+            raise CommandError("The replica points at the primary file.")
+
+        source = sqlite3.connect(primary['NAME'])
+        target = sqlite3.connect(replica['NAME'])
+        try:
+            source.backup(target, pages=options['pages'])
+            # Реплика тоже в WAL, чтобы чтения не блокировали следующую синхронизацию
+            target.execute('PRAGMA journal_mode=WAL')
+        finally:
+            target.close()
+            source.close()
+
+        logger.info("Replica %s synced from %s.", replica['NAME'], primary['NAME'])
+        self.stdout.write(self.style.SUCCESS(f"Replica {replica['NAME']} synced."))
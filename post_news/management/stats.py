@@ -0,0 +1,7 @@
+"""Общие расчёты для команд замеров run_benchmarks и load_test."""
+
+
+def percentile(values, q):
+    """Значение перцентиля q (0..1) по ближайшему рангу."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.4 on 2026-10-18 13:19
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def remove_duplicate_post_categories(apps, schema_editor):
+    # Перед уникальным ограничением оставляем по одной связи пост–категория
+    PostCategory = apps.get_model('post_news', 'PostCategory')
+    keep = PostCategory.objects.values('post_id', 'category_id').annotate(keep_id=Min('id')).values('keep_id')
+    PostCategory.objects.exclude(id__in=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post_news', '0004_post_fulltext_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-created_at', '-id'], name='post_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['post_type', '-created_at', '-id'], name='post_type_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['author', 'post_type', 'created_at'], name='post_author_type_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='postcategory',
+            index=models.Index(fields=['category', 'post'], name='postcategory_category_idx'),
+        ),
+        migrations.RunPython(remove_duplicate_post_categories, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='postcategory',
+            constraint=models.UniqueConstraint(fields=('post', 'category'), name='unique_post_category'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.4 on 2026-10-18 13:20
+
+from django.db import migrations, models
+
+from post_news import search
+
+
+def restore_search_triggers(apps, schema_editor):
+    # Добавление NOT NULL колонки в SQLite пересоздаёт таблицу постов
+    # вместе с триггерами полнотекстового индекса
+    search.install_triggers(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post_news', '0005_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='excerpt',
+            field=models.CharField(blank=True, default='', editable=False, max_length=300),
+        ),
+        migrations.RunPython(restore_search_triggers, migrations.RunPython.noop),
+    ]
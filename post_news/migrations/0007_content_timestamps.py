@@ -0,0 +1,39 @@
+# Generated by Django 5.1.4 on 2026-10-18 13:35
+
+from django.db import migrations, models
+
+from post_news import search
+
+
+def backfill_updated_at(apps, schema_editor):
+    # Время прежних правок не хранилось, берём время создания
+    Post = apps.get_model('post_news', 'Post')
+    Post.objects.update(updated_at=models.F('created_at'))
+
+
+def restore_search_triggers(apps, schema_editor):
+    # Добавление NOT NULL колонки в SQLite пересоздаёт таблицу постов
+    # вместе с триггерами полнотекстового индекса
+    search.install_triggers(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post_news', '0006_post_excerpt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='content_updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop),
+        migrations.RunPython(restore_search_triggers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.4 on 2026-10-18 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post_news', '0007_content_timestamps'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64)),
+                ('period', models.CharField(max_length=32)),
+                ('status', models.CharField(choices=[('running', 'Выполняется'), ('success', 'Выполнено'), ('failed', 'Ошибка'), ('skipped', 'Пропущено')], default='running', max_length=10)),
+                ('holder', models.CharField(blank=True, max_length=255)),
+                ('attempts', models.PositiveSmallIntegerField(default=1)),
+                ('started_at', models.DateTimeField()),
+                ('expires_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('duration', models.FloatField(blank=True, null=True)),
+                ('items', models.PositiveIntegerField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['name', 'started_at'], name='jobrun_name_started_idx')],
+                'constraints': [models.UniqueConstraint(fields=('name', 'period'), name='jobrun_name_period_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.4 on 2026-10-18 14:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post_news', '0009_pending_votes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('after_pk', models.PositiveBigIntegerField()),
+                ('last_pk', models.PositiveBigIntegerField()),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('outbox', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='post_news.notificationoutbox')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('outbox', 'after_pk'), name='notificationchunk_outbox_after_uniq')],
+            },
+        ),
+    ]
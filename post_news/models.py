@@ -1,8 +1,9 @@
-from django.core.mail import send_mail
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
-from django.template.loader import render_to_string
-from .tasks import send_post_notification
+from django.dispatch import Signal
+from django.utils.text import Truncator
+
+from . import votes
 
 
 class Author(models.Model):
@@ -10,28 +11,96 @@ class Author(models.Model):
     rating = models.FloatField(default=0.0)
 
     def update_rating(self):
+        self.rating = Author.recompute_ratings(Author.objects.filter(pk=self.pk)).get(self.pk, 0)
+
+    @classmethod
+    def recompute_ratings(cls, authors=None):
+        """
+        Пересчитывает рейтинг авторов с нуля тремя GROUP BY запросами
+        и одним bulk_update. Возвращает {id автора: рейтинг}.
+
+        Чтение и запись идут в одной транзакции, строки авторов
+        блокируются до чтения сумм: votes.flush, который в это время
+        прибавляет дельты к рейтингу через F(), дождётся записи
+        и прибавит свою дельту к уже пересчитанному значению.
+        """
+        with transaction.atomic():
+            return cls._recompute_ratings(authors)
+
+    @classmethod
+    def _recompute_ratings(cls, authors):
+        posts = Post.objects.all()
+        own_comments = Comment.objects.all()
+        post_comments = Comment.objects.all()
+        if authors is None:
+            authors = cls.objects.all()
+        else:
+            posts = posts.filter(author__in=authors)
+            own_comments = own_comments.filter(user__author__in=authors)
+            post_comments = post_comments.filter(post__author__in=authors)
+        # В SQLite транзакция IMMEDIATE и так берёт блокировку записи сразу
+        authors = list(authors.select_for_update().only('id', 'user_id', 'rating'))
+
         # Рейтинг статей автора * 3
-        post_rating = self.post_set.aggregate(
-            post_rating=models.Sum('rating')
-        )['post_rating'] * 3 or 0
+        post_rating = dict(posts.order_by().values('author_id').annotate(
+            total=models.Sum('rating')
+        ).values_list('author_id', 'total'))
 
         # Рейтинг комментариев автора
-        comment_rating = Comment.objects.filter(
-            user=self.user
-        ).aggregate(
-            comment_rating=models.Sum('rating')
-        )['comment_rating'] or 0
+        comment_rating = dict(own_comments.order_by().values('user_id').annotate(
+            total=models.Sum('rating')
+        ).values_list('user_id', 'total'))
 
         # Рейтинг комментариев к статьям автора
-        post_comment_rating = Comment.objects.filter(
-            post__author=self
-        ).aggregate(
-            post_comment_rating=models.Sum('rating')
-        )['post_comment_rating'] or 0
+        post_comment_rating = dict(post_comments.order_by().values('post__author_id').annotate(
+            total=models.Sum('rating')
+        ).values_list('post__author_id', 'total'))
+
+        ratings = {}
+        changed = []
+        for author in authors:
+            rating = (
+                (post_rating.get(author.pk) or 0) * 3
+                + (comment_rating.get(author.user_id) or 0)
+                + (post_comment_rating.get(author.pk) or 0)
+            )
+            ratings[author.pk] = rating
+            if author.rating != rating:
+                author.rating = rating
+                changed.append(author)
+
+        cls.objects.bulk_update(changed, ['rating'], batch_size=500)
+        return ratings
 
-        # Обновление общего рейтинга
-        self.rating = post_rating + comment_rating + post_comment_rating
-        self.save()
+    @classmethod
+    def vote_deltas(cls, kind, deltas):
+        """
+        Во сколько изменятся рейтинги авторов от голосов {pk: дельта}
+        за посты или комментарии.
+        """
+        author_deltas = {}
+
+        def add(author_id, delta):
+            if author_id is not None:
+                author_deltas[author_id] = author_deltas.get(author_id, 0) + delta
+
+        if kind == votes.POST:
+            for post_id, author_id in Post.objects.filter(
+                pk__in=deltas
+            ).values_list('pk', 'author_id'):
+                add(author_id, deltas[post_id] * 3)
+        elif kind == votes.COMMENT:
+            rows = list(Comment.objects.filter(
+                pk__in=deltas
+            ).values_list('pk', 'user_id', 'post__author_id'))
+            user_authors = dict(cls.objects.filter(
+                user_id__in={user_id for _, user_id, _ in rows}
+            ).values_list('user_id', 'pk'))
+            for comment_id, user_id, post_author_id in rows:
+                add(user_authors.get(user_id), deltas[comment_id])
+                add(post_author_id, deltas[comment_id])
+
+        return author_deltas
 
     def __str__(self):
         return self.user.username
@@ -40,6 +109,9 @@ class Author(models.Model):
 class Category(models.Model):
     name = models.CharField(max_length=255, unique=True)
     subscribers = models.ManyToManyField(User, related_name='subscribed_categories', blank=True)
+    # Время последнего изменения страницы категории: её самой,
+    # её постов или их привязки к ней. Ставится сигналами
+    content_updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
@@ -56,49 +128,130 @@ class Post(models.Model):
     author = models.ForeignKey(Author, on_delete=models.CASCADE)
     post_type = models.CharField(max_length=2, choices=POST_TYPES, default=NEWS)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     categories = models.ManyToManyField(Category, through='PostCategory')
     title = models.CharField(max_length=255)
     text = models.TextField()
+    # Превью для списков и писем, считается при сохранении,
+    # чтобы списки не читали и не резали весь текст
+    excerpt = models.CharField(max_length=300, blank=True, default='', editable=False)
     rating = models.IntegerField(default=0)
 
+    EXCERPT_WORDS = 20
+
+    class Meta:
+        indexes = [
+            # Лента: ORDER BY created_at DESC, id DESC
+            models.Index(fields=['-created_at', '-id'], name='post_created_idx'),
+            # Лента категории: фильтр по типу и та же сортировка
+            models.Index(fields=['post_type', '-created_at', '-id'], name='post_type_created_idx'),
+            # Дневной лимит публикаций автора
+            models.Index(fields=['author', 'post_type', 'created_at'], name='post_author_type_created_idx'),
+        ]
+
+    @classmethod
+    def category_stream(cls, category_id, post_type):
+        """Посты категории одного типа для её страницы, только выводимые колонки."""
+        return cls.objects.filter(
+            postcategory__category_id=category_id, post_type=post_type
+        ).only('id', 'title', 'created_at', 'excerpt')
+
+    @classmethod
+    def recent_news(cls, author_id, since):
+        """Даты новостей автора начиная с since, от новых к старым."""
+        return cls.objects.filter(
+            author_id=author_id, post_type=cls.NEWS, created_at__gte=since
+        ).order_by('-created_at').values_list('created_at', flat=True)
+
+    # Голоса копятся в PendingVote и переносятся в рейтинг задачей flush_votes
     def like(self):
-        self.rating += 1
-        self.save()
+        votes.record_vote(votes.POST, self.pk, 1)
 
     def dislike(self):
-        self.rating -= 1
-        self.save()
+        votes.record_vote(votes.POST, self.pk, -1)
 
     def preview(self):
-        return f"{self.text[:124]}..." if len(self.text) > 124 else self.text
+        return self.excerpt
 
-    def __str__(self):
-        return self.title
+    def set_categories(self, categories):
+        return PostCategory.objects.sync({self.pk: categories})
 
-    def notify_subscribers(self):
-        for subscriber in self.categories.values_list('subscribers', flat=True):
-            user = User.objects.get(id=subscriber)
-            subject = self.title
-            message = render_to_string('email_template.html', {
-                'username': user.username,
-                'title': self.title,
-                'preview': self.text[:50]  # первые 50 символов текста
-            })
-            send_mail(subject, message, 'from@example.com', [user.email])
+    @classmethod
+    def make_excerpt(cls, text):
+        max_length = cls._meta.get_field('excerpt').max_length
+        return Truncator(Truncator(text).words(cls.EXCERPT_WORDS)).chars(max_length)
 
     def save(self, *args, **kwargs):
-        is_new = self.pk is None
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            # auto_now пишется, только если поле есть в update_fields
+            update_fields = kwargs['update_fields'] = {*update_fields, 'updated_at'}
+        if update_fields is None or 'text' in update_fields:
+            self.excerpt = self.make_excerpt(self.text)
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'excerpt'}
         super().save(*args, **kwargs)
-        self.notify_subscribers()
-        if is_new:
-            # Асинхронная отправка уведомлений
-            send_post_notification.delay(self.id)
+
+    def __str__(self):
+        return self.title
+
+
+# bulk_create не шлёт post_save по строкам: о новых привязках
+# sync сообщает одним сигналом на все добавленные категории
+post_categories_added = Signal()
+
+
+class PostCategoryManager(models.Manager):
+    def sync(self, assignments):
+        """
+        Приводит категории постов к заданным, assignments —
+        {id поста: категории или их id}. Одна выборка текущих привязок,
+        один DELETE убранных и один bulk_create добавленных в одной
+        транзакции; неизменные привязки не трогаются.
+        Возвращает (число добавленных, число убранных).
+        """
+        wanted = {
+            (post_id, getattr(category, 'pk', category))
+            for post_id, categories in assignments.items()
+            for category in categories
+        }
+        with transaction.atomic(using=self.db, savepoint=False):
+            current = {
+                (post_id, category_id): pk
+                for pk, post_id, category_id in self.filter(
+                    post_id__in=list(assignments)
+                ).values_list('pk', 'post_id', 'category_id')
+            }
+            removed = [pk for pair, pk in current.items() if pair not in wanted]
+            added = sorted(wanted.difference(current))
+            if removed:
+                # Удаление шлёт post_delete по строкам, инвалидация — там
+                self.filter(pk__in=removed).delete()
+            if added:
+                self.bulk_create([self.model(post_id=post_id, category_id=category_id) for post_id, category_id in added])
+                post_categories_added.send(
+                    sender=self.model,
+                    post_ids=sorted({post_id for post_id, _ in added}),
+                    category_ids=sorted({category_id for _, category_id in added}),
+                )
+        return len(added), len(removed)
 
 
 class PostCategory(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE)
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
 
+    objects = PostCategoryManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'category'], name='unique_post_category'),
+        ]
+        indexes = [
+            # Посты категории: поиск по category_id сразу отдаёт post_id
+            models.Index(fields=['category', 'post'], name='postcategory_category_idx'),
+        ]
+
 
 class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE)
@@ -108,12 +261,142 @@ class Comment(models.Model):
     rating = models.IntegerField(default=0)
 
     def like(self):
-        self.rating += 1
-        self.save()
+        votes.record_vote(votes.COMMENT, self.pk, 1)
 
     def dislike(self):
-        self.rating -= 1
-        self.save()
+        votes.record_vote(votes.COMMENT, self.pk, -1)
 
     def __str__(self):
         return f"Comment by {self.user.username} on {self.post.title}"
+
+
+class PendingVote(models.Model):
+    """
+    Голос, ещё не перенесённый в рейтинг. Строки только вставляются;
+    votes.flush суммирует их по объектам и удаляет учтённые.
+    """
+    kind = models.CharField(max_length=16, choices=[(votes.POST, 'Пост'), (votes.COMMENT, 'Комментарий')])
+    object_id = models.PositiveBigIntegerField()
+    delta = models.SmallIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Суммы голосов по объектам при сбросе
+            models.Index(fields=['kind', 'object_id'], name='pendingvote_kind_object_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id}: {self.delta:+d}"
+
+
+class NotificationOutbox(models.Model):
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUSES = [
+        (PENDING, 'Ожидает отправки'),
+        (PROCESSING, 'Отправляется'),
+        (SENT, 'Отправлено'),
+        (FAILED, 'Ошибка')
+    ]
+
+    POST_CREATED = 'post_created'
+    EVENTS = [
+        (POST_CREATED, 'Новый пост'),
+    ]
+
+    post = models.ForeignKey(Post, on_delete=models.CASCADE)
+    event = models.CharField(max_length=32, choices=EVENTS, default=POST_CREATED)
+    # Ключ идемпотентности: одно событие по одному посту рассылается ровно один раз
+    idempotency_key = models.CharField(max_length=64, unique=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='outbox_status_created_idx'),
+        ]
+
+    @classmethod
+    def enqueue(cls, post, event=POST_CREATED):
+        return cls.objects.create(
+            post=post,
+            event=event,
+            idempotency_key=f'{event}:{post.pk}',
+        )
+
+    def __str__(self):
+        return f"{self.idempotency_key} ({self.status})"
+
+
+class NotificationChunk(models.Model):
+    """
+    Пачка рассылки записи outbox: подписчики с after_pk < pk <= last_pk.
+    Границы фиксируются при первой отправке записи. Повтор после сбоя
+    или истечения OUTBOX_LOCK_TIMEOUT отправляет только пачки без sent_at,
+    поэтому подписчик из отправленной пачки второго письма не получит.
+    started_at — пачку взял воркер; зависшую пачку можно забрать снова
+    после OUTBOX_LOCK_TIMEOUT.
+    """
+    outbox = models.ForeignKey(NotificationOutbox, on_delete=models.CASCADE, related_name='chunks')
+    after_pk = models.PositiveBigIntegerField()
+    last_pk = models.PositiveBigIntegerField()
+    started_at = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['outbox', 'after_pk'], name='notificationchunk_outbox_after_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.outbox_id} ({self.after_pk}, {self.last_pk}]"
+
+
+class JobRun(models.Model):
+    """
+    Запуск задания по расписанию. Строка на задание и период уникальна:
+    кто первым её вставил, тот и выполняет задание за этот период,
+    остальные реплики видят её и пропускают запуск. expires_at — срок
+    аренды: строку зависшего запуска после него может забрать другой.
+    """
+    RUNNING = 'running'
+    SUCCESS = 'success'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
+    STATUSES = [
+        (RUNNING, 'Выполняется'),
+        (SUCCESS, 'Выполнено'),
+        (FAILED, 'Ошибка'),
+        (SKIPPED, 'Пропущено')
+    ]
+
+    name = models.CharField(max_length=64)
+    # Период расписания, например 2024-W05 или 2024-01-31T08:00
+    period = models.CharField(max_length=32)
+    status = models.CharField(max_length=10, choices=STATUSES, default=RUNNING)
+    holder = models.CharField(max_length=255, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=1)
+    started_at = models.DateTimeField()
+    expires_at = models.DateTimeField()
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True)
+    items = models.PositiveIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'period'], name='jobrun_name_period_uniq'),
+        ]
+        indexes = [
+            # История задания и чистка старых запусков
+            models.Index(fields=['name', 'started_at'], name='jobrun_name_started_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} {self.period} ({self.status})"
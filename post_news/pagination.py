@@ -0,0 +1,189 @@
+"""
+Курсорная (keyset) пагинация.
+
+Вместо OFFSET страница ищется по ключу сортировки последней строки
+предыдущей страницы, а вместо COUNT(*) читается на одну строку больше,
+чтобы узнать, есть ли следующая страница. Стоимость любой страницы
+одинакова. Курсор — непрозрачный токен с направлением и ключом строки.
+"""
+import base64
+import datetime
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage, Paginator
+from django.db.models import Q
+from django.http import Http404
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def _json_default(value):
+    # isoformat с микросекундами: DjangoJSONEncoder обрезает их до миллисекунд,
+    # и курсор начинает пропускать строки
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+
+class CursorPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+
+class CursorPaginator:
+    def __init__(self, queryset, per_page, ordering=('-created_at', '-id')):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = list(ordering)
+        self.fields = [field.lstrip('-') for field in self.ordering]
+
+    def encode(self, direction, row):
+        values = [
+            row[field] if isinstance(row, dict) else getattr(row, field)
+            for field in self.fields
+        ]
+        payload = json.dumps([direction, values], default=_json_default, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            direction, values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            if direction not in (NEXT, PREVIOUS) or len(values) != len(self.fields):
+                raise ValueError
+            opts = self.queryset.model._meta
+            values = [
+                opts.get_field(field).to_python(value)
+                for field, value in zip(self.fields, values)
+            ]
+        except (ValueError, TypeError, ValidationError):
+            raise InvalidCursor(cursor)
+        return direction, values
+
+    def _beyond(self, values, direction):
+        # Лексикографическое сравнение по всем полям сортировки:
+        # (a < x) OR (a = x AND b < y) OR ...
+        condition = Q()
+        for index, ordering in enumerate(self.ordering):
+            descending = ordering.startswith('-')
+            if direction == PREVIOUS:
+                descending = not descending
+            lookup = 'lt' if descending else 'gt'
+            term = Q(**{f'{self.fields[index]}__{lookup}': values[index]})
+            for field, value in zip(self.fields[:index], values[:index]):
+                term &= Q(**{field: value})
+            condition |= term
+
+        # Избыточное условие на первое поле даёт СУБД границу для поиска
+        # по индексу, иначе OR по всем полям читается сканированием
+        lookup = 'lte' if self.ordering[0].startswith('-') == (direction != PREVIOUS) else 'gte'
+        return Q(**{f'{self.fields[0]}__{lookup}': values[0]}) & condition
+
+    def _reversed_ordering(self):
+        return [
+            field[1:] if field.startswith('-') else f'-{field}'
+            for field in self.ordering
+        ]
+
+    def _query(self, cursor):
+        if not cursor:
+            return None, self.queryset.order_by(*self.ordering)
+
+        direction, values = self.decode(cursor)
+        queryset = self.queryset.filter(self._beyond(values, direction))
+        if direction == PREVIOUS:
+            return direction, queryset.order_by(*self._reversed_ordering())
+        return direction, queryset.order_by(*self.ordering)
+
+    def _build_page(self, direction, rows):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if direction == PREVIOUS:
+            rows.reverse()
+
+        has_next = has_more if direction != PREVIOUS else True
+        has_previous = has_more if direction == PREVIOUS else direction is not None
+        if not rows:
+            return CursorPage(rows)
+        return CursorPage(
+            rows,
+            next_cursor=self.encode(NEXT, rows[-1]) if has_next else None,
+            previous_cursor=self.encode(PREVIOUS, rows[0]) if has_previous else None,
+        )
+
+    def page(self, cursor=None):
+        direction, queryset = self._query(cursor)
+        return self._build_page(direction, list(queryset[:self.per_page + 1]))
+
+    async def apage(self, cursor=None):
+        direction, queryset = self._query(cursor)
+        rows = [row async for row in queryset[:self.per_page + 1].aiterator()]
+        return self._build_page(direction, rows)
+
+
+def cursor_requested(request, param='cursor'):
+    """Курсорный режим: включён настройкой CURSOR_PAGINATION или курсором в запросе."""
+    return settings.CURSOR_PAGINATION or param in request.GET
+
+
+def number_page(queryset, per_page, number):
+    """Обычная страница по номеру для представлений без ListView; 404 на неверный номер."""
+    paginator = Paginator(queryset, per_page)
+    try:
+        page = paginator.page(number or 1)
+    except InvalidPage:
+        raise Http404('Неверный номер страницы.')
+    page.object_list = list(page.object_list)
+    return page
+
+
+class CursorPaginationMixin:
+    """
+    Подключает к ListView курсорную пагинацию как дополнительный режим,
+    по умолчанию страницы нумеруются как обычно (см. cursor_requested).
+    Номера страниц и общий счётчик в курсорном режиме недоступны,
+    в шаблоне есть page_obj.next_cursor и page_obj.previous_cursor.
+    """
+    cursor_ordering = ('-created_at', '-id')
+    cursor_param = 'cursor'
+
+    def use_cursor_pagination(self):
+        return cursor_requested(self.request, self.cursor_param)
+
+    def paginate_queryset(self, queryset, page_size):
+        if not self.use_cursor_pagination():
+            return super().paginate_queryset(queryset, page_size)
+
+        paginator = CursorPaginator(queryset, page_size, self.cursor_ordering)
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_param))
+        except InvalidCursor:
+            raise Http404('Неверный курсор страницы.')
+        return paginator, page, page.object_list, page.has_other_pages()
@@ -0,0 +1,133 @@
+"""
+Ограничение частоты действий на счётчиках в кэше.
+
+Скользящее окно приближается двумя фиксированными: счётчик текущего
+окна плюс счётчик предыдущего с весом его ещё не истёкшей доли. На запрос
+это один incr и один get_many, базы нет: пользователь определяется
+по id в сессии, без загрузки из таблицы пользователей.
+
+Лимиты задаются в settings.RATE_LIMITS строкой "N/период/ключ":
+период — s, m, h, d или число секунд вида "30s", ключ — user или ip.
+Для анонимного посетителя ключ user заменяется на ip.
+"""
+import math
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.cache import cache
+from django.http import HttpResponse
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+USER = 'user'
+IP = 'ip'
+
+
+class Rate:
+    def __init__(self, limit, period, scope):
+        self.limit = limit
+        self.period = period
+        self.scope = scope
+
+    @classmethod
+    def parse(cls, spec):
+        limit, period, scope = spec.split('/')
+        if period in PERIODS:
+            seconds = PERIODS[period]
+        elif period.endswith('s'):
+            seconds = int(period[:-1])
+        else:
+            raise ValueError(f'Bad rate period in {spec!r}')
+        if scope not in (USER, IP):
+            raise ValueError(f'Bad rate key in {spec!r}')
+        return cls(int(limit), seconds, scope)
+
+
+def get_rate(action):
+    return Rate.parse(settings.RATE_LIMITS[action])
+
+
+def client_ip(request):
+    # За прокси адрес клиента берётся из заголовка, который он выставляет
+    return request.META.get(settings.RATE_LIMIT_IP_META, '') or request.META.get('REMOTE_ADDR', '')
+
+
+def client_key(request, scope):
+    if scope == USER:
+        user_id = request.session.get(SESSION_KEY)
+        if user_id is not None:
+            return f'user:{user_id}'
+    return f'ip:{client_ip(request)}'
+
+
+def _incr(key, timeout):
+    # incr падает на отсутствующем ключе, add создаёт его. Счётчик точен,
+    # только если add и incr общего кэша атомарны (LockingFileBasedCache);
+    # иначе под нагрузкой он недосчитывает, поэтому лимит, который нельзя
+    # превышать (новости автора), проверяется по базе
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout)
+        return cache.incr(key)
+
+
+def _window(action, request, now):
+    rate = get_rate(action)
+    index, offset = divmod(now, rate.period)
+    prefix = f'ratelimit:{action}:{client_key(request, rate.scope)}'
+    return rate, f'{prefix}:{int(index)}', f'{prefix}:{int(index) - 1}', offset / rate.period
+
+
+def _usage(counts, current, previous, elapsed):
+    return counts.get(current, 0) + counts.get(previous, 0) * (1 - elapsed)
+
+
+def _retry_after(rate, elapsed):
+    return max(1, math.ceil(rate.period * (1 - elapsed)))
+
+
+def check(request, action):
+    """
+    Проверяет лимит, не расходуя его: (превышен ли, через сколько секунд повторить).
+    Для действий, которые засчитываются только при успехе, в паре с hit().
+    """
+    rate, current, previous, elapsed = _window(action, request, time.time())
+    usage = _usage(cache.get_many([current, previous]), current, previous, elapsed)
+    return usage >= rate.limit, _retry_after(rate, elapsed)
+
+
+def hit(request, action):
+    """Засчитывает действие: (разрешено ли, через сколько секунд повторить)."""
+    rate, current, previous, elapsed = _window(action, request, time.time())
+    # Счётчик живёт два окна: следующее окно читает его как предыдущее
+    count = _incr(current, 2 * rate.period)
+    usage = _usage({current: count, **cache.get_many([previous])}, current, previous, elapsed)
+    return usage <= rate.limit, _retry_after(rate, elapsed)
+
+
+def too_many_requests(retry_after):
+    response = HttpResponse(
+        'Слишком много запросов, попробуйте позже.',
+        status=429, content_type='text/plain; charset=utf-8'
+    )
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def limit(action, methods=('POST',)):
+    """
+    Декоратор представления: каждый запрос с методом из methods
+    засчитывается, сверх лимита отвечаем 429 до самого представления.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method in methods:
+                allowed, retry_after = hit(request, action)
+                if not allowed:
+                    return too_many_requests(retry_after)
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
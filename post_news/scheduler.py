@@ -0,0 +1,145 @@
+"""
+Единственное выполнение заданий по расписанию при нескольких репликах.
+
+Расписание задаёт celery beat (news/celery.py), и beat может работать
+на каждой реплике. Поэтому задание запускается через run_once:
+выполняет его только тот, кто первым вставил строку JobRun на это
+задание и период; остальные пропускают запуск. Строка — это и аренда,
+и история: статус, длительность, число обработанных элементов, ошибка.
+
+Пока предыдущий запуск держит аренду, новый не начинается и
+записывается как пропущенный. Строку запуска, чья аренда истекла
+(воркер упал), может забрать следующий срабатывающий beat того же
+периода. Упавший с ошибкой запуск повторно сам не выполняется:
+повтор рассылки отправил бы письма второй раз.
+"""
+import logging
+import os
+import socket
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import JobRun
+
+logger = logging.getLogger(__name__)
+
+MINUTE = 'minute'
+WEEK = 'week'
+PERIODS = {
+    MINUTE: timezone.timedelta(minutes=1),
+    WEEK: timezone.timedelta(weeks=1),
+}
+
+
+def period_key(period, now=None):
+    now = timezone.localtime(now)
+    if period == MINUTE:
+        return now.strftime('%Y-%m-%dT%H:%M')
+    if period == WEEK:
+        year, week, _ = now.isocalendar()
+        return f'{year}-W{week:02d}'
+    raise ValueError(f'Unknown period {period!r}')
+
+
+def holder():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _count(result):
+    # Задания возвращают число элементов или словарь чисел по видам
+    if isinstance(result, bool):
+        return None
+    if isinstance(result, int):
+        return result
+    if isinstance(result, dict):
+        return sum(value for value in result.values() if isinstance(value, int))
+    return None
+
+
+def claim(name, period, lease_seconds, now=None, scheduled_at=None):
+    """
+    Забирает запуск задания за период, в который оно запланировано
+    (scheduled_at, по умолчанию now). Возвращает JobRun или None,
+    если период уже выполняется или выполнен другим.
+    """
+    now = now or timezone.now()
+    key = period_key(period, scheduled_at or now)
+    expires_at = now + timezone.timedelta(seconds=lease_seconds)
+
+    overlapping = JobRun.objects.filter(
+        name=name, status=JobRun.RUNNING, expires_at__gt=now
+    ).exclude(period=key).exists()
+    if overlapping:
+        # Предыдущий запуск ещё идёт: пропуск виден в истории
+        JobRun.objects.get_or_create(name=name, period=key, defaults={
+            'status': JobRun.SKIPPED, 'holder': holder(),
+            'started_at': now, 'expires_at': now, 'finished_at': now,
+            'error': 'previous run still holds the lease',
+        })
+        return None
+
+    try:
+        with transaction.atomic():
+            return JobRun.objects.create(
+                name=name, period=key, holder=holder(),
+                started_at=now, expires_at=expires_at,
+            )
+    except IntegrityError:
+        pass
+
+    # Строка периода уже есть: забрать её можно, только если аренда
+    # истекла или запуск был пропущен из-за перекрытия
+    taken = JobRun.objects.filter(name=name, period=key).filter(
+        Q(status=JobRun.RUNNING, expires_at__lte=now) | Q(status=JobRun.SKIPPED)
+    ).update(
+        status=JobRun.RUNNING, holder=holder(), attempts=F('attempts') + 1,
+        started_at=now, expires_at=expires_at, finished_at=None, error='',
+    )
+    if not taken:
+        return None
+    return JobRun.objects.get(name=name, period=key)
+
+
+def run_once(name, period, lease_seconds, func, *args, scheduled_at=None, **kwargs):
+    """
+    Выполняет func, если этот процесс забрал период задания,
+    и записывает итог запуска. Возвращает результат func или None.
+    """
+    run = claim(name, period, lease_seconds, scheduled_at=scheduled_at)
+    if run is None:
+        logger.info('Job %s: period %s is taken by another run, skipped', name, period_key(period, scheduled_at))
+        return None
+
+    started = time.monotonic()
+    try:
+        result = func(*args, **kwargs)
+    except Exception as error:
+        _finish(run, JobRun.FAILED, started, error=f'{type(error).__name__}: {error}')
+        logger.exception('Job %s failed for period %s', name, run.period)
+        raise
+
+    _finish(run, JobRun.SUCCESS, started, items=_count(result))
+    logger.info('Job %s: period %s done in %.2f s, %s items', name, run.period, time.monotonic() - started, _count(result))
+
+    # История хранится JOB_RUN_RETENTION_DAYS дней
+    JobRun.objects.filter(
+        name=name,
+        started_at__lt=timezone.now() - timezone.timedelta(days=settings.JOB_RUN_RETENTION_DAYS),
+    ).delete()
+    return result
+
+
+def _finish(run, status, started, items=None, error=''):
+    # Запуск закрывает только владелец аренды: если её забрали,
+    # строка принадлежит новому запуску
+    JobRun.objects.filter(pk=run.pk, holder=run.holder, started_at=run.started_at).update(
+        status=status,
+        finished_at=timezone.now(),
+        duration=time.monotonic() - started,
+        items=items,
+        error=error,
+    )
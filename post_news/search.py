@@ -0,0 +1,136 @@
+"""
+Полнотекстовый поиск по постам на SQLite FTS5.
+
+Индекс ``post_news_post_fts`` — external content таблица поверх
+``post_news_post``: хранит только инвертированный индекс по title и text,
+а синхронизируется триггерами на вставку, изменение и удаление поста.
+На других СУБД поиск откатывается к icontains.
+"""
+import re
+
+from django.db import connection, transaction
+from django.db.models import FloatField, Q, TextField
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'post_news_post_fts'
+POST_TABLE = 'post_news_post'
+
+# Границы совпадения в сниппете: текст поста экранируется в фильтре
+# highlight, после чего маркеры заменяются на <mark>
+SNIPPET_START = '\x02'
+SNIPPET_END = '\x03'
+
+CREATE_TABLE_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"title, text, content='{POST_TABLE}', content_rowid='id', "
+    f"tokenize='unicode61 remove_diacritics 2')"
+)
+
+TRIGGERS_SQL = [
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {POST_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, text) VALUES (new.id, new.title, new.text);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {POST_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, text) VALUES ('delete', old.id, old.title, old.text);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF title, text ON {POST_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, text) VALUES ('delete', old.id, old.title, old.text);
+        INSERT INTO {FTS_TABLE}(rowid, title, text) VALUES (new.id, new.title, new.text);
+    END""",
+]
+
+DROP_SQL = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+
+def install(schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_TABLE_SQL)
+    install_triggers(schema_editor)
+    schema_editor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def install_triggers(schema_editor):
+    # Пересоздание таблицы постов в миграциях SQLite удаляет триггеры,
+    # такие миграции должны вызывать эту функцию после себя
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in TRIGGERS_SQL:
+        schema_editor.execute(sql)
+
+
+def uninstall(schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in DROP_SQL:
+        schema_editor.execute(sql)
+
+
+def match_expression(query):
+    # Каждое слово запроса ищется как префикс: "новост"* найдёт "новости"
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', query))
+
+
+def full_text_search(queryset, query):
+    expression = match_expression(query)
+    if not expression:
+        return queryset.none()
+
+    if connection.vendor != 'sqlite':
+        return queryset.filter(Q(title__icontains=query) | Q(text__icontains=query))
+
+    # Фильтр и аннотации — обычные выражения, поэтому результат можно
+    # дальше фильтровать, пересортировать и резать курсорной пагинацией.
+    # bm25 и snippet работают только в запросе с MATCH, поэтому считаются
+    # коррелированным подзапросом по rowid найденного поста.
+    # Заголовок весит в 10 раз больше текста, меньший bm25 — лучше
+    return queryset.filter(
+        pk__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [expression])
+    ).annotate(
+        search_rank=_match_column(f'bm25({FTS_TABLE}, 10.0, 1.0)', expression, FloatField()),
+        search_snippet=_match_column(
+            f"snippet({FTS_TABLE}, 1, '{SNIPPET_START}', '{SNIPPET_END}', '…', 16)",
+            expression, TextField()
+        ),
+    ).order_by('search_rank')
+
+
+def _match_column(function, expression, output_field):
+    return RawSQL(
+        f'SELECT {function} FROM {FTS_TABLE} '
+        f'WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.rowid = {POST_TABLE}.id',
+        [expression],
+        output_field=output_field
+    )
+
+
+def rebuild(batch_size=1000):
+    """Переиндексирует все посты пачками по batch_size, возвращает их число."""
+    indexed = 0
+    last_id = 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('delete-all')")
+        while True:
+            cursor.execute(
+                f"SELECT max(id), count(*) FROM "
+                f"(SELECT id FROM {POST_TABLE} WHERE id > %s ORDER BY id LIMIT %s)",
+                [last_id, batch_size]
+            )
+            batch_last_id, count = cursor.fetchone()
+            if not count:
+                break
+            with transaction.atomic():
+                cursor.execute(
+                    f"INSERT INTO {FTS_TABLE}(rowid, title, text) "
+                    f"SELECT id, title, text FROM {POST_TABLE} WHERE id > %s AND id <= %s",
+                    [last_id, batch_last_id]
+                )
+            indexed += count
+            last_id = batch_last_id
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+    return indexed
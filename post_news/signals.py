@@ -1,22 +1,68 @@
-from django.contrib.auth.models import User
-from django.core.mail import send_mail
-from django.db.models.signals import post_save
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from django.template.loader import render_to_string
+from django.utils import timezone
+
+from . import caching
+from .models import Category, Comment, Post, PostCategory, post_categories_added
+from .tasks import render_snapshots
+
+
+@receiver([post_save, post_delete], sender=Post)
+def invalidate_post_caches(sender, instance, **kwargs):
+    caching.bump(caching.POSTS, caching.post_namespace(instance.pk))
+
 
-from .models import Post
+def touch_categories(category_ids):
+    # Новое время изменения для условного GET и новое поколение для кэша
+    Category.objects.filter(pk__in=category_ids).update(content_updated_at=timezone.now())
+    caching.bump(*map(caching.category_namespace, category_ids))
 
 
 @receiver(post_save, sender=Post)
-def notify_subscribers(sender, instance, created, **kwargs):
-    if created:
-        subscribers = User.objects.filter(subscribed_categories__in=instance.categories.all()).distinct()
-
-        for user in subscribers:
-            subject = f'Новая новость: {instance.title}'
-            message = render_to_string('email_template.html', {
-                'username': user.username,
-                'title': instance.title,
-                'preview': instance.text[:50]
-            })
-            send_mail(subject, message, 'my_mail@mail.ru', [user.email])
+def invalidate_post_categories(sender, instance, created, **kwargs):
+    # У нового поста категорий ещё нет, а при удалении категории
+    # инвалидируются каскадным удалением PostCategory
+    if not created:
+        touch_categories(list(
+            PostCategory.objects.filter(post=instance).values_list('category_id', flat=True)
+        ))
+
+
+@receiver([post_save, post_delete], sender=PostCategory)
+def invalidate_category_content(sender, instance, **kwargs):
+    touch_categories([instance.category_id])
+
+
+@receiver(post_categories_added, sender=PostCategory)
+def invalidate_added_categories(sender, category_ids, **kwargs):
+    touch_categories(category_ids)
+    if settings.SNAPSHOTS_ENABLED:
+        transaction.on_commit(partial(render_snapshots.delay, category_ids=category_ids))
+
+
+@receiver([post_save, post_delete], sender=Comment)
+def invalidate_comment_caches(sender, instance, **kwargs):
+    caching.bump(caching.comments_namespace(instance.post_id))
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category_caches(sender, instance, **kwargs):
+    caching.bump(caching.CATEGORIES, caching.category_namespace(instance.pk))
+
+
+@receiver([post_save, post_delete], sender=Post)
+def schedule_post_snapshots(sender, instance, **kwargs):
+    # Снимки строятся после фиксации: у нового поста к этому моменту
+    # уже есть категории, а у удалённого снимок страницы удалится
+    if settings.SNAPSHOTS_ENABLED:
+        transaction.on_commit(partial(render_snapshots.delay, post_ids=[instance.pk]))
+
+
+@receiver([post_save, post_delete], sender=PostCategory)
+def schedule_category_snapshots(sender, instance, **kwargs):
+    if settings.SNAPSHOTS_ENABLED:
+        transaction.on_commit(partial(render_snapshots.delay, category_ids=[instance.category_id]))
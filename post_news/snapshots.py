@@ -0,0 +1,229 @@
+"""
+Статические снимки горячих страниц: пост, первые SNAPSHOT_LIST_PAGES
+страниц ленты и первые страницы категорий.
+
+Снимки перерисовываются при публикации, изменении и удалении поста,
+причём только те страницы, которые этот пост затрагивает. Раскладка
+файлов повторяет URL, поэтому их может отдавать фронтовой сервер:
+
+    /posts/5                  -> SNAPSHOT_DIR/posts/5/index.html
+    /posts/?page=2            -> SNAPSHOT_DIR/posts/page-2.html
+    /posts/?cursor=<курсор>   -> SNAPSHOT_DIR/posts/cursor-<курсор>.html
+
+например в nginx через map от $arg_page и $arg_cursor и try_files
+с переходом в Django. Страницы ленты снимаются в том режиме
+пагинации, который включён (CURSOR_PAGINATION). Рядом с каждым снимком лежит файл .version с поколениями
+кэша, под которыми он построен: Django отдаёт снимок при промахе
+кэша страниц, только если поколения совпадают с текущими.
+
+Снимки строятся для анонимного посетителя и отдаются только запросам
+без сессии. Страница, выдавшая при рендеринге csrf-токен или cookie,
+в снимок не попадает: токен в общем файле достался бы всем.
+"""
+import os
+import re
+import tempfile
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.http import Http404, HttpResponse, QueryDict
+from django.test import RequestFactory
+from django.urls import Resolver404, resolve, reverse
+
+CURSOR_PARAM = 'cursor'
+PAGE_PARAM = 'page'
+VERSION_SUFFIX = '.version'
+# Курсор — base64url без выравнивания, безопасен как имя файла
+CURSOR_RE = re.compile(r'^[A-Za-z0-9_-]+$')
+PAGE_RE = re.compile(r'^[1-9][0-9]*$')
+
+
+def root():
+    return Path(settings.SNAPSHOT_DIR)
+
+
+def snapshot_file(path, query):
+    """
+    Файл снимка для пути и параметров запроса или None,
+    если такие страницы не снимаются (поиск, курсоры категорий...).
+    """
+    directory = root() / path.strip('/')
+    if not query:
+        return directory / 'index.html'
+    if len(query) != 1:
+        return None
+    param, values = next(iter(query.lists()))
+    if len(values) != 1:
+        return None
+    value = values[0]
+    if param == CURSOR_PARAM and CURSOR_RE.match(value):
+        return directory / f'{CURSOR_PARAM}-{value}.html'
+    # Первая страница снимается без параметра, ?page=1 отдаёт Django
+    if param == PAGE_PARAM and PAGE_RE.match(value) and value != '1':
+        return directory / f'{PAGE_PARAM}-{value}.html'
+    return None
+
+
+def _version_file(file):
+    return file.with_name(file.name + VERSION_SUFFIX)
+
+
+def _write_atomic(file, content):
+    file.parent.mkdir(parents=True, exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=file.parent, prefix='.tmp-')
+    try:
+        with os.fdopen(descriptor, 'wb') as output:
+            output.write(content)
+        os.replace(temporary, file)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def _remove(file):
+    for name in (file, _version_file(file)):
+        try:
+            name.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def serve(request):
+    """
+    Ответ из снимка для промаха кэша страниц или None. Версию страницы
+    (поколения кэша) в запрос кладёт cache_page_in.
+    """
+    if (
+        not settings.SNAPSHOTS_ENABLED
+        or getattr(request, 'snapshot_render', False)
+        or request.method not in ('GET', 'HEAD')
+        or settings.SESSION_COOKIE_NAME in request.COOKIES
+    ):
+        return None
+
+    file = snapshot_file(request.path, request.GET)
+    if file is None:
+        return None
+    try:
+        if _version_file(file).read_text() != request.page_version:
+            return None
+        return HttpResponse(file.read_bytes())
+    except (FileNotFoundError, AttributeError):
+        return None
+
+
+def _host():
+    # Хост для рендеринга должен проходить проверку ALLOWED_HOSTS
+    if settings.SNAPSHOT_HOST:
+        return settings.SNAPSHOT_HOST
+    for host in settings.ALLOWED_HOSTS:
+        if host != '*':
+            return host.lstrip('.')
+    return 'localhost'
+
+
+def render(path):
+    """
+    Рендерит страницу по URL так, как её увидит анонимный посетитель,
+    и записывает снимок; снимок удаляется, если страницы больше нет.
+    Возвращает True, если снимок записан.
+    """
+    request = RequestFactory().get(path, HTTP_HOST=_host())
+    file = snapshot_file(request.path, request.GET)
+    if file is None:
+        raise ValueError(f'{path} is not a snapshot page')
+
+    request.user = AnonymousUser()
+    request.snapshot_render = True
+    try:
+        request.resolver_match = resolve(request.path_info)
+    except Resolver404:
+        _remove(file)
+        return False
+
+    match = request.resolver_match
+    try:
+        response = match.func(request, *match.args, **match.kwargs)
+    except Http404:
+        _remove(file)
+        return False
+    if hasattr(response, 'render') and callable(response.render):
+        response.render()
+
+    if response.status_code != 200 or request.META.get('CSRF_COOKIE_NEEDS_UPDATE') or response.cookies:
+        _remove(file)
+        return False
+
+    # Сначала снимок, потом версия: Django не отдаст снимок,
+    # пока версия не совпадёт с той, под которой он построен
+    _write_atomic(file, response.content)
+    _write_atomic(_version_file(file), request.page_version.encode())
+    return True
+
+
+def render_many(paths):
+    return sum(render(path) for path in paths)
+
+
+def list_paths():
+    """Первые SNAPSHOT_LIST_PAGES страниц ленты, как по ним идёт читатель."""
+    from .pagination import CursorPaginator
+    from .views import PostList
+
+    base = reverse('post_list')
+    if not settings.CURSOR_PAGINATION:
+        # Номера страниц не сдвигаются, лишние снимки удалит
+        # render с 404 за последней страницей
+        return [base] + [f'{base}?{PAGE_PARAM}={number}' for number in range(2, settings.SNAPSHOT_LIST_PAGES + 1)]
+
+    paginator = CursorPaginator(PostList.queryset, PostList.paginate_by, PostList.cursor_ordering)
+    paths = [base]
+    cursor = None
+    for _ in range(settings.SNAPSHOT_LIST_PAGES - 1):
+        cursor = paginator.page(cursor).next_cursor
+        if cursor is None:
+            break
+        paths.append(f'{base}?{CURSOR_PARAM}={cursor}')
+    return paths
+
+
+def prune_list_pages(paths):
+    # После публикации границы страниц сдвигаются и курсоры меняются,
+    # снимки по старым курсорам больше не нужны
+    keep = {snapshot_file(*_split(path)) for path in paths}
+    directory = root() / reverse('post_list').strip('/')
+    for file in directory.glob(f'{CURSOR_PARAM}-*.html'):
+        if file not in keep:
+            _remove(file)
+
+
+def _split(path):
+    parts = urlsplit(path)
+    return parts.path, QueryDict(parts.query)
+
+
+def post_path(post_id):
+    return reverse('post_detail', args=[post_id])
+
+
+def category_paths(category_ids):
+    return [reverse('category_detail', args=[pk]) for pk in category_ids]
+
+
+def render_list():
+    paths = list_paths()
+    rendered = render_many(paths)
+    prune_list_pages(paths)
+    return rendered
+
+
+def all_paths():
+    """Страницы постов и категорий для полной пересборки; лента — отдельно."""
+    from .models import Category, Post
+
+    return [
+        *map(post_path, Post.objects.values_list('pk', flat=True).iterator()),
+        *category_paths(Category.objects.values_list('pk', flat=True)),
+    ]
@@ -1,75 +1,277 @@
+import logging
+import time
+
+from django.conf import settings
+from django.db.models import Exists, F, OuterRef, Q
 from django.utils import timezone
-from .models import Post, User, Category
-from celery import shared_task
-from django.core.mail import send_mail
+from django.utils.dateparse import parse_datetime
+from . import scheduler, snapshots, votes
+from .digest import WeeklyDigest
+from .mailing import USERNAME_PLACEHOLDER, chunked, personalize, pk_ranges
+from .models import Post, PostCategory, User, Category, NotificationChunk, NotificationOutbox
+from celery import chord, shared_task
+from django.core.mail import get_connection
 from django.template.loader import render_to_string
 
+logger = logging.getLogger(__name__)
+
+
+def _mark_sent(outbox_id):
+    # Отправленной запись становится, когда отправлены все её пачки
+    if outbox_id is not None:
+        NotificationOutbox.objects.filter(pk=outbox_id, status=NotificationOutbox.PROCESSING).filter(
+            ~Exists(NotificationChunk.objects.filter(outbox=OuterRef('pk'), sent_at__isnull=True))
+        ).update(
+            status=NotificationOutbox.SENT,
+            processed_at=timezone.now()
+        )
+
+
+def _outbox_chunks(outbox_id, post_id, chunk_size):
+    """
+    Неотправленные пачки записи outbox. Границы пачек создаются при первой
+    отправке и дальше не меняются: повтор не пересылает отправленные пачки.
+    """
+    chunks = NotificationChunk.objects.filter(outbox_id=outbox_id)
+    if not chunks.exists():
+        subscriber_pks = post_recipients(post_id).values_list('pk', flat=True).iterator(chunk_size=chunk_size)
+        ranges = (
+            NotificationChunk(outbox_id=outbox_id, after_pk=after_pk, last_pk=last_pk)
+            for after_pk, last_pk in pk_ranges(subscriber_pks, chunk_size)
+        )
+        for batch in chunked(ranges, 500):
+            NotificationChunk.objects.bulk_create(batch)
+    return chunks.filter(sent_at__isnull=True).order_by('after_pk').values_list(
+        'after_pk', 'last_pk', 'pk'
+    ).iterator()
+
+
+def post_recipients(post_id):
+    subscriber_ids = Category.subscribers.through.objects.filter(
+        category__postcategory__post_id=post_id
+    ).values('user_id')
+    return User.objects.filter(pk__in=subscriber_ids).exclude(email='').order_by('pk')
+
+
+def notification_email(post):
+    # Общая часть письма рендерится один раз на пачку,
+    # имя подписчика подставляется уже в готовый текст
+    subject = f'Новый пост: {post.title}'
+    message = render_to_string('email_template.html', {
+        'username': USERNAME_PLACEHOLDER,
+        'title': post.title,
+        'preview': post.preview(),
+    })
+    return subject, message
+
+
+@shared_task
+def send_post_notification(post_id, outbox_id=None):
+    # outbox_id — запись outbox, которую отметит отправленной
+    # завершение рассылки, а не её запуск
+    if not Post.objects.filter(id=post_id).exists():
+        _mark_sent(outbox_id)
+        return 0
+
+    # Подписчики режутся на пачки по диапазонам pk: в сообщении хорда
+    # только границы пачек, адреса каждая подзадача читает сама
+    # и отправляет через одно SMTP-соединение
+    chunk_size = settings.NOTIFICATION_CHUNK_SIZE
+    if outbox_id is not None:
+        chunks = _outbox_chunks(outbox_id, post_id, chunk_size)
+    else:
+        subscriber_pks = post_recipients(post_id).values_list('pk', flat=True).iterator(chunk_size=chunk_size)
+        chunks = ((after_pk, last_pk, None) for after_pk, last_pk in pk_ranges(subscriber_pks, chunk_size))
+    header = [
+        send_notification_chunk.s(post_id, after_pk, last_pk, chunk_id)
+        for after_pk, last_pk, chunk_id in chunks
+    ]
+    if not header:
+        _mark_sent(outbox_id)
+        return 0
+
+    chord(header)(report_notification_throughput.s(post_id, outbox_id))
+    return len(header)
+
+
+def _claim_chunk(chunk_id, now):
+    # Пачку отправляет тот, кто её забрал: повторная отправка записи
+    # не дублирует пачку, которая ещё в очереди или отправляется
+    return NotificationChunk.objects.filter(pk=chunk_id, sent_at__isnull=True).filter(
+        Q(started_at__isnull=True)
+        | Q(started_at__lt=now - timezone.timedelta(seconds=settings.OUTBOX_LOCK_TIMEOUT))
+    ).update(started_at=now)
+
+
+@shared_task
+def send_notification_chunk(post_id, after_pk, last_pk, chunk_id=None):
+    # chunk_id — пачка записи outbox (NotificationChunk), без неё рассылка не отслеживается
+    started_at = time.time()
+    if chunk_id is not None and not _claim_chunk(chunk_id, timezone.now()):
+        return {'sent': 0, 'started_at': started_at, 'seconds': 0.0}
 
-def send_weekly_newsletter():
-    one_week_ago = timezone.now() - timezone.timedelta(days=7)
-    new_posts = Post.objects.filter(created_at__gte=one_week_ago)
+    post = Post.objects.only('id', 'title', 'excerpt').filter(id=post_id).first()
+    sent = 0
+    try:
+        if post is not None:
+            subject, message = notification_email(post)
+            recipients = post_recipients(post_id).filter(
+                pk__gt=after_pk, pk__lte=last_pk
+            ).values_list('username', 'email')
+            messages = [
+                personalize(subject, message, username, email)
+                for username, email in recipients
+            ]
+            with get_connection() as connection:
+                sent = connection.send_messages(messages) or 0
+    except Exception:
+        # Пачка не отправлена: её заберёт следующая попытка записи
+        if chunk_id is not None:
+            NotificationChunk.objects.filter(pk=chunk_id).update(started_at=None)
+        raise
 
-    subscribers = User.objects.filter(is_subscribed=True)
+    if chunk_id is not None:
+        NotificationChunk.objects.filter(pk=chunk_id).update(sent_at=timezone.now())
+    return {'sent': sent, 'started_at': started_at, 'seconds': time.time() - started_at}
 
-    for user in subscribers:
-        subject = 'Новые статьи за неделю'
-        message = 'Вот новые статьи, добавленные за последнюю неделю:\n\n'
 
-        for post in new_posts:
-            message += f"{post.title} - {post.get_absolute_url()}\n"
+@shared_task
+def report_notification_throughput(results, post_id, outbox_id=None):
+    # Колбэк хорда вызывается, только когда все пачки отправлены;
+    # если пачка упала, запись останется в обработке и по истечении
+    # OUTBOX_LOCK_TIMEOUT вернётся в очередь за неотправленными пачками
+    _mark_sent(outbox_id)
+    sent = sum(result['sent'] for result in results)
+    # Время считается от старта первой пачки, а не от постановки в очередь
+    elapsed = max(time.time() - min(result['started_at'] for result in results), 1e-6)
+    rate = sent / elapsed
 
-        send_mail(subject, message, 'my_mail@mail.com', [user.email])
+    logger.info(
+        'Post %s: sent %d notifications in %d chunks, %.2f s, %.1f emails/s',
+        post_id, sent, len(results), elapsed, rate
+    )
+    return {
+        'post_id': post_id,
+        'sent': sent,
+        'chunks': len(results),
+        'seconds': round(elapsed, 3),
+        'emails_per_second': round(rate, 1),
+    }
 
 
 @shared_task
-def send_post_notification(post_id):
-    post = Post.objects.get(id=post_id)
-
-    subscribers = User.objects.filter(
-        subscribed_categories__in=post.categories.all()
-    ).distinct()
-
-    for user in subscribers:
-        subject = f'Новый пост: {post.title}'
-        message = render_to_string('email_template.html', {
-            'username': user.username,
-            'post_title': post.title,
-            'post_preview': post.preview(),
-        })
-
-        send_mail(
-            subject,
-            message,
-            'my_mail@mail.ru',
-            [user.email]
+def drain_notification_outbox(batch_size=100):
+    now = timezone.now()
+
+    # Записи, зависшие в обработке после падения воркера или пачки рассылки,
+    # возвращаются в очередь, пока не исчерпаны попытки. Повтор отправляет
+    # только пачки без отметки об отправке, см. NotificationChunk
+    stale = NotificationOutbox.objects.filter(
+        status=NotificationOutbox.PROCESSING,
+        locked_at__lt=now - timezone.timedelta(seconds=settings.OUTBOX_LOCK_TIMEOUT)
+    )
+    stale.filter(attempts__gte=settings.OUTBOX_MAX_ATTEMPTS).update(status=NotificationOutbox.FAILED)
+    stale.update(status=NotificationOutbox.PENDING)
+
+    pending = list(NotificationOutbox.objects.filter(
+        status=NotificationOutbox.PENDING
+    ).order_by('pk').values_list('pk', 'post_id')[:batch_size])
+
+    processed = 0
+    for entry_id, post_id in pending:
+        # Запись забирает только тот воркер, чей UPDATE её изменил
+        claimed = NotificationOutbox.objects.filter(
+            pk=entry_id, status=NotificationOutbox.PENDING
+        ).update(
+            status=NotificationOutbox.PROCESSING,
+            attempts=F('attempts') + 1,
+            locked_at=timezone.now()
         )
+        if not claimed:
+            continue
+
+        try:
+            send_post_notification(post_id, entry_id)
+        except Exception:
+            logger.exception('Outbox entry %s failed', entry_id)
+            NotificationOutbox.objects.filter(pk=entry_id, attempts__gte=settings.OUTBOX_MAX_ATTEMPTS).update(
+                status=NotificationOutbox.FAILED
+            )
+            NotificationOutbox.objects.filter(pk=entry_id, attempts__lt=settings.OUTBOX_MAX_ATTEMPTS).update(
+                status=NotificationOutbox.PENDING
+            )
+            continue
+
+        # Отправленной запись отметит колбэк хорда рассылки
+        processed += 1
+
+    return processed
 
 
 @shared_task
 def send_weekly_digest():
+    started = time.monotonic()
+    subject = 'Еженедельный дайджест новостей'
+    digest = WeeklyDigest()
+
+    sent = 0
+    with get_connection() as connection:
+        for chunk in chunked(digest, settings.NOTIFICATION_CHUNK_SIZE):
+            sent += connection.send_messages([
+                personalize(subject, message, username, email)
+                for username, email, message in chunk
+            ]) or 0
 
-    last_week_posts = Post.objects.filter(
-        created_at__week=timezone.now().isocalendar()[1]
+    logger.info(
+        'Weekly digest: sent %d emails, %d distinct digests rendered, %.2f s',
+        sent, len(digest.rendered), time.monotonic() - started
     )
+    return sent
+
+
+@shared_task
+def flush_votes():
+    flushed = {kind: len(votes.flush(kind)) for kind in votes.MODELS}
+    logger.info('Flushed votes: %s', flushed)
+    return flushed
 
-    users = User.objects.all()
 
-    for user in users:
+@shared_task
+def render_snapshots(post_ids=(), category_ids=(), feed=False):
+    # Перерисовываются только страницы, которые затрагивают эти посты:
+    # их страницы, первые страницы ленты и страницы их категорий.
+    # feed — перерисовать ленту без страниц постов (массовый импорт)
+    category_ids = set(category_ids)
+    rendered = 0
+    if post_ids:
+        for post_id in post_ids:
+            rendered += snapshots.render(snapshots.post_path(post_id))
+        category_ids.update(
+            PostCategory.objects.filter(post_id__in=post_ids).values_list('category_id', flat=True)
+        )
+    if post_ids or feed:
+        rendered += snapshots.render_list()
+    rendered += snapshots.render_many(snapshots.category_paths(sorted(category_ids)))
+    logger.info('Rendered %d snapshots for posts %s, categories %s', rendered, list(post_ids), sorted(category_ids))
+    return rendered
 
-        user_categories = user.subscribed_categories.all()
 
-        user_posts = last_week_posts.filter(categories__in=user_categories)
+# Задания по расписанию: имя -> (задача, период, аренда в секундах).
+# beat (news/celery.py) запускает их через run_scheduled_job, и при
+# нескольких репликах задание выполняется один раз за период
+SCHEDULED_JOBS = {
+    'send_weekly_digest': (send_weekly_digest, scheduler.WEEK, 6 * 60 * 60),
+    'drain_notification_outbox': (drain_notification_outbox, scheduler.MINUTE, 5 * 60),
+    'flush_votes': (flush_votes, scheduler.MINUTE, 5 * 60),
+}
 
-        if user_posts.exists():
-            subject = 'Еженедельный дайджест новостей'
-            message = render_to_string('email_template.html', {
-                'username': user.username,
-                'posts': user_posts
-            })
 
-            send_mail(
-                subject,
-                message,
-                'my_mail@mail.ru',
-                [user.email]
-            )
+@shared_task
+def run_scheduled_job(name, scheduled_at=None):
+    # scheduled_at — время отправки из beat (news/celery.py); без него,
+    # например при ручном запуске, период считается по текущему времени
+    task, period, lease_seconds = SCHEDULED_JOBS[name]
+    if scheduled_at is not None:
+        scheduled_at = parse_datetime(scheduled_at)
+    # Задача выполняется в этом же процессе, который забрал период
+    return scheduler.run_once(name, period, lease_seconds, task, scheduled_at=scheduled_at)
@@ -1,19 +1,24 @@
 from django import template
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from post_news.censor import censor_text
+from post_news.search import SNIPPET_START, SNIPPET_END
 
 register = template.Library()
 
 
 @register.filter()
 def censor(value):
-    bad_words = ['редиска', 'дурак', 'идиот']
-
     if not isinstance(value, str):
         return value
 
-    for word in bad_words:
-        censored_word = word[0] + '*' * (len(word) - 1)
+    return censor_text(value)
 
-        value = value.replace(word, censored_word)
-        value = value.replace(word.capitalize(), censored_word.capitalize())
 
-    return value
\ No newline at end of file
+@register.filter()
+def highlight(value):
+    # Сниппет FTS5 содержит сырой текст поста, поэтому сначала экранируем
+    return mark_safe(
+        escape(value).replace(SNIPPET_START, '<mark>').replace(SNIPPET_END, '</mark>')
+    )
@@ -1,5 +1,7 @@
 from django import template
+from django.utils.safestring import mark_safe
 
+from post_news import caching
 
 register = template.Library()
 
@@ -8,5 +10,16 @@ register = template.Library()
 def url_replace(context, **kwargs):
     d = context['request'].GET.copy()
     for k, v in kwargs.items():
-        d[k] = v
+        # None убирает параметр: например, page при переходе на курсоры
+        if v is None:
+            d.pop(k, None)
+        else:
+            d[k] = v
     return d.urlencode()
+
+
+@register.simple_tag
+def cached_fragments(objects, template_name, name='object', version_field='updated_at'):
+    # {% cached_fragments posts 'post_row.html' name='post' %}:
+    # строки списка из кэша фрагментов, см. caching.render_fragments
+    return mark_safe(''.join(caching.render_fragments(template_name, objects, name, version_field)))
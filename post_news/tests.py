@@ -1,3 +1,1302 @@
-from django.test import TestCase
+import json
+import shutil
+import tempfile
+import threading
+import time
+from io import StringIO
+from smtplib import SMTPException
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.contrib.auth.models import Permission, User
+from django.contrib.sites.models import Site
+from django.core import mail
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.db.models import QuerySet, Sum
+from django.http import QueryDict
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from news.cache_backends import LockingFileBasedCache
+from news.celery import app, stamp_scheduled_time
+from . import async_views, caching, ratelimit, scheduler, search, snapshots, transfer, votes
+from .censor import censor_text
+from .digest import WeeklyDigest
+from .forms import PostForm
+from .management.commands import check_query_plans
+from .mailing import USERNAME_PLACEHOLDER
+from .models import (
+    Author, Category, Comment, JobRun, NotificationChunk, NotificationOutbox, PendingVote, Post, PostCategory,
+)
+from .pagination import CursorPaginator
+from .search import full_text_search
+from .tasks import (
+    drain_notification_outbox, flush_votes, report_notification_throughput, run_scheduled_job,
+    send_notification_chunk, send_post_notification, send_weekly_digest
+)
+from .templatetags import custom_filters
+from .views import PostList
+
+# Тесты не трогают файловый кэш и каталог снимков сайта
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'news.cache_backends.TwoTierCache',
+        'LOCATION': 'tests',
+        'OPTIONS': {'SHARED': 'shared'},
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tests-shared',
+    },
+}
+
+
+@override_settings(CACHES=TEST_CACHES, SNAPSHOTS_ENABLED=False)
+class NewsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        # Задачи Celery выполняются на месте, без брокера
+        self.addCleanup(setattr, app.conf, 'task_always_eager', app.conf.task_always_eager)
+        app.conf.task_always_eager = True
+
+    def make_author(self, username='author'):
+        return Author.objects.create(user=User.objects.create(username=username))
+
+    def make_post(self, author=None, categories=(), **fields):
+        fields.setdefault('title', 'Заголовок')
+        fields.setdefault('text', 'Текст поста')
+        post = Post.objects.create(author=author or self.make_author(), **fields)
+        for category in categories:
+            PostCategory.objects.create(post=post, category=category)
+        return post
+
+
+class NotificationFanOutTests(NewsTestCase):
+    def subscribe(self, category, count):
+        for number in range(count):
+            category.subscribers.add(
+                User.objects.create(username=f'reader{number}', email=f'reader{number}@example.com')
+            )
+
+    @override_settings(NOTIFICATION_CHUNK_SIZE=2)
+    def test_subscribers_are_sent_in_chunks(self):
+        category = Category.objects.create(name='Спорт')
+        self.subscribe(category, 5)
+        category.subscribers.add(User.objects.create(username='no_email'))
+        post = self.make_post(categories=[category])
+
+        self.assertEqual(send_post_notification(post.pk), 3)
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox),
+            [f'reader{number}@example.com' for number in range(5)],
+        )
+        for message in mail.outbox:
+            username = message.to[0].split('@')[0]
+            self.assertIn(username, message.body)
+            self.assertNotIn(USERNAME_PLACEHOLDER, message.body)
+
+    @override_settings(NOTIFICATION_CHUNK_SIZE=2)
+    def test_chord_carries_only_pk_ranges(self):
+        category = Category.objects.create(name='Спорт')
+        self.subscribe(category, 5)
+        post = self.make_post(categories=[category])
+        pks = list(category.subscribers.order_by('pk').values_list('pk', flat=True))
+
+        with mock.patch('post_news.tasks.chord') as chord:
+            self.assertEqual(send_post_notification(post.pk), 3)
+        header = chord.call_args.args[0]
+        self.assertEqual([signature.args for signature in header], [
+            (post.pk, 0, pks[1], None), (post.pk, pks[1], pks[3], None), (post.pk, pks[3], pks[4], None),
+        ])
+
+        send_notification_chunk(post.pk, pks[1], pks[3])
+        self.assertEqual([message.to[0] for message in mail.outbox], ['reader2@example.com', 'reader3@example.com'])
+
+    def test_throughput_is_measured_from_first_chunk(self):
+        now = time.time()
+        results = [
+            {'sent': 500, 'started_at': now - 10, 'seconds': 4},
+            {'sent': 500, 'started_at': now - 5, 'seconds': 5},
+        ]
+
+        report = report_notification_throughput(results, 1)
+        self.assertEqual((report['sent'], report['chunks']), (1000, 2))
+        self.assertAlmostEqual(report['seconds'], 10, delta=1)
+
+    def test_subscriber_of_several_categories_gets_one_email(self):
+        sport, politics = Category.objects.create(name='Спорт'), Category.objects.create(name='Политика')
+        self.subscribe(sport, 1)
+        politics.subscribers.add(*sport.subscribers.all())
+        post = self.make_post(categories=[sport, politics])
+
+        self.assertEqual(send_post_notification(post.pk), 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_post_without_subscribers_sends_nothing(self):
+        post = self.make_post(categories=[Category.objects.create(name='Спорт')])
+
+        self.assertEqual(send_post_notification(post.pk), 0)
+        self.assertEqual(send_post_notification(post.pk + 1), 0)
+        self.assertEqual(mail.outbox, [])
+
+
+class NotificationOutboxTests(NewsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(name='Спорт')
+        self.category.subscribers.add(User.objects.create(username='reader', email='reader@example.com'))
+
+    def make_entry(self, **fields):
+        entry = NotificationOutbox.enqueue(self.make_post(categories=[self.category]))
+        if fields:
+            NotificationOutbox.objects.filter(pk=entry.pk).update(**fields)
+        return entry
+
+    def assertEntry(self, entry, status, attempts):
+        entry.refresh_from_db()
+        self.assertEqual((entry.status, entry.attempts), (status, attempts))
+
+    def test_drain_sends_entry_once(self):
+        entry = self.make_entry()
+
+        self.assertEqual(drain_notification_outbox(), 1)
+        self.assertEqual(drain_notification_outbox(), 0)
+        self.assertEntry(entry, NotificationOutbox.SENT, 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_event_is_enqueued_once_per_post(self):
+        entry = self.make_entry()
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            NotificationOutbox.enqueue(entry.post)
+
+    def test_entry_being_sent_is_not_taken_again(self):
+        entry = self.make_entry(status=NotificationOutbox.PROCESSING, attempts=1, locked_at=timezone.now())
+
+        self.assertEqual(drain_notification_outbox(), 0)
+        self.assertEntry(entry, NotificationOutbox.PROCESSING, 1)
+        self.assertEqual(mail.outbox, [])
+
+    def test_stale_entry_is_retried(self):
+        locked_at = timezone.now() - timezone.timedelta(seconds=settings.OUTBOX_LOCK_TIMEOUT + 1)
+        entry = self.make_entry(status=NotificationOutbox.PROCESSING, attempts=1, locked_at=locked_at)
+
+        self.assertEqual(drain_notification_outbox(), 1)
+        self.assertEntry(entry, NotificationOutbox.SENT, 2)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_stale_entry_without_attempts_left_fails(self):
+        locked_at = timezone.now() - timezone.timedelta(seconds=settings.OUTBOX_LOCK_TIMEOUT + 1)
+        entry = self.make_entry(
+            status=NotificationOutbox.PROCESSING, attempts=settings.OUTBOX_MAX_ATTEMPTS, locked_at=locked_at
+        )
+
+        self.assertEqual(drain_notification_outbox(), 0)
+        self.assertEntry(entry, NotificationOutbox.FAILED, settings.OUTBOX_MAX_ATTEMPTS)
+        self.assertEqual(mail.outbox, [])
+
+    def test_failed_send_returns_entry_to_queue(self):
+        entry = self.make_entry()
+
+        with mock.patch('post_news.tasks.send_post_notification', side_effect=SMTPException), \
+                self.assertLogs('post_news.tasks', 'ERROR'):
+            self.assertEqual(drain_notification_outbox(), 0)
+        self.assertEntry(entry, NotificationOutbox.PENDING, 1)
+
+        self.assertEqual(drain_notification_outbox(), 1)
+        self.assertEntry(entry, NotificationOutbox.SENT, 2)
+
+    def test_stale_retry_skips_sent_chunks(self):
+        self.category.subscribers.add(User.objects.create(username='reader2', email='reader2@example.com'))
+        entry = self.make_entry()
+
+        with self.settings(NOTIFICATION_CHUNK_SIZE=1), \
+                mock.patch('post_news.tasks.report_notification_throughput.run'):
+            send_post_notification(entry.post_id, entry.pk)
+        first, second = entry.chunks.order_by('after_pk')
+        NotificationChunk.objects.filter(pk=second.pk).update(sent_at=None, started_at=None)
+        locked_at = timezone.now() - timezone.timedelta(seconds=settings.OUTBOX_LOCK_TIMEOUT + 1)
+        NotificationOutbox.objects.filter(pk=entry.pk).update(
+            status=NotificationOutbox.PROCESSING, attempts=1, locked_at=locked_at
+        )
+        mail.outbox = []
+
+        with self.settings(NOTIFICATION_CHUNK_SIZE=1):
+            self.assertEqual(drain_notification_outbox(), 1)
+        self.assertEntry(entry, NotificationOutbox.SENT, 2)
+        self.assertEqual([message.to[0] for message in mail.outbox], ['reader2@example.com'])
+        self.assertEqual(entry.chunks.count(), 2)
+
+    def test_chunk_taken_by_another_worker_is_not_sent_again(self):
+        entry = self.make_entry(status=NotificationOutbox.PROCESSING, attempts=1, locked_at=timezone.now())
+        chunk = NotificationChunk.objects.create(outbox=entry, after_pk=0, last_pk=10 ** 6, started_at=timezone.now())
+
+        result = send_notification_chunk(entry.post_id, 0, 10 ** 6, chunk.pk)
+        self.assertEqual(result['sent'], 0)
+        report_notification_throughput([result], entry.post_id, entry.pk)
+        self.assertEntry(entry, NotificationOutbox.PROCESSING, 1)
+        self.assertEqual(mail.outbox, [])
+
+    def test_failed_chunk_is_released(self):
+        entry = self.make_entry(status=NotificationOutbox.PROCESSING, attempts=1, locked_at=timezone.now())
+        chunk = NotificationChunk.objects.create(outbox=entry, after_pk=0, last_pk=10 ** 6)
+
+        with mock.patch('post_news.tasks.personalize', side_effect=SMTPException), \
+                self.assertRaises(SMTPException):
+            send_notification_chunk(entry.post_id, 0, 10 ** 6, chunk.pk)
+        chunk.refresh_from_db()
+        self.assertEqual((chunk.started_at, chunk.sent_at), (None, None))
+
+    def test_form_enqueues_new_post_only(self):
+        author = self.make_author()
+        data = {
+            'title': 'Заголовок', 'text': 'Текст', 'post_type': Post.NEWS,
+            'author': author.pk, 'categories': [self.category.pk],
+        }
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post = PostForm(data).save()
+        self.assertEntry(NotificationOutbox.objects.get(post=post), NotificationOutbox.SENT, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            PostForm({**data, 'title': 'Новый заголовок'}, instance=post).save()
+        self.assertEqual(NotificationOutbox.objects.count(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class VoteFlushTests(NewsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = self.make_author()
+        self.post = self.make_post(author=self.author)
+
+    def assertRatings(self, post, author):
+        self.post.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual((self.post.rating, self.author.rating), (post, author))
+
+    def test_votes_wait_for_flush(self):
+        self.post.like()
+        self.post.like()
+        self.post.dislike()
+
+        self.assertEqual(votes.pending_delta(votes.POST, self.post.pk), 1)
+        self.assertRatings(0, 0)
+
+        self.assertEqual(votes.flush(votes.POST), {self.post.pk: 1})
+        self.assertRatings(1, 3)
+        self.assertFalse(PendingVote.objects.exists())
+        self.assertEqual(votes.flush(votes.POST), {})
+        self.assertRatings(1, 3)
+
+    def test_pending_deltas_are_exported_per_post(self):
+        other = self.make_post(author=self.author)
+        self.post.like()
+        other.dislike()
+        other.dislike()
+
+        with self.settings(METRICS_ALLOWED_IPS=['127.0.0.1']):
+            body = self.client.get('/metrics').content.decode()
+        self.assertIn(f'news_pending_vote_delta{{kind="post",id="{self.post.pk}"}} 1\n', body)
+        self.assertIn(f'news_pending_vote_delta{{kind="post",id="{other.pk}"}} -2\n', body)
+
+    def test_cancelled_votes_are_dropped(self):
+        self.post.like()
+        self.post.dislike()
+
+        self.assertEqual(votes.flush(votes.POST), {})
+        self.assertFalse(PendingVote.objects.exists())
+        self.assertRatings(0, 0)
+
+    def test_comment_votes_rate_commenter_and_post_author(self):
+        commenter = self.make_author('commenter')
+        comment = Comment.objects.create(post=self.post, user=commenter.user, text='Комментарий')
+        comment.like()
+        comment.like()
+        self.post.like()
+
+        self.assertEqual(flush_votes(), {votes.POST: 1, votes.COMMENT: 1})
+        comment.refresh_from_db()
+        commenter.refresh_from_db()
+        self.assertEqual((comment.rating, commenter.rating), (2, 2))
+        self.assertRatings(1, 3 + 2)
+
+    def test_flush_racing_another_flush_changes_nothing(self):
+        self.post.like()
+        self.post.like()
+        delete = QuerySet.delete
+
+        def concurrent_delete(queryset):
+            # Параллельный сброс уже удалил один из прочитанных голосов
+            PendingVote.objects.filter(pk=PendingVote.objects.earliest('pk').pk)._raw_delete('default')
+            return delete(queryset)
+
+        with mock.patch.object(QuerySet, 'delete', autospec=True, side_effect=concurrent_delete):
+            self.assertEqual(votes.flush(votes.POST), {})
+        self.assertRatings(0, 0)
+        self.assertEqual(PendingVote.objects.count(), 2)
+
+
+class AuthorRatingTests(NewsTestCase):
+    def baseline_rating(self, author):
+        # Формула исходного Author.update_rating: три суммы по автору
+        post_rating = author.post_set.aggregate(total=Sum('rating'))['total'] or 0
+        comment_rating = Comment.objects.filter(user=author.user).aggregate(total=Sum('rating'))['total'] or 0
+        post_comment_rating = Comment.objects.filter(post__author=author).aggregate(total=Sum('rating'))['total'] or 0
+        return post_rating * 3 + comment_rating + post_comment_rating
+
+    def test_recompute_matches_baseline_formula(self):
+        first, second, idle = self.make_author('first'), self.make_author('second'), self.make_author('idle')
+        reader = User.objects.create(username='reader')
+        posts = [
+            self.make_post(author=first, rating=5),
+            self.make_post(author=first, rating=-2),
+            self.make_post(author=second, rating=7),
+        ]
+        for user, post, rating in [
+            (first.user, posts[0], 4), (first.user, posts[2], -3), (second.user, posts[1], 6),
+            (reader, posts[0], 2), (reader, posts[2], 1),
+        ]:
+            Comment.objects.create(user=user, post=post, text='Комментарий', rating=rating)
+        Author.objects.update(rating=100)
+
+        ratings = Author.recompute_ratings()
+        for author in (first, second, idle):
+            author.refresh_from_db()
+            self.assertEqual(author.rating, self.baseline_rating(author), author.user.username)
+            self.assertEqual(ratings[author.pk], author.rating)
+
+        Author.objects.filter(pk=second.pk).update(rating=0)
+        second.update_rating()
+        self.assertEqual(second.rating, self.baseline_rating(second))
+
+    def test_flush_after_recompute_keeps_both(self):
+        author = self.make_author()
+        post = self.make_post(author=author, rating=2)
+        Author.recompute_ratings()
+        post.like()
+
+        votes.flush(votes.POST)
+        author.refresh_from_db()
+        self.assertEqual(author.rating, self.baseline_rating(author))
+
+
+class WeeklyDigestTests(NewsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.sport = Category.objects.create(name='Спорт')
+        self.city = Category.objects.create(name='Город')
+        author = self.make_author()
+        self.match = self.make_post(author=author, title='Матч', categories=[self.sport])
+        self.park = self.make_post(author=author, title='Парк', categories=[self.city, self.sport])
+        old = self.make_post(author=author, title='Прошлогодний матч', categories=[self.sport])
+        # Та же неделя года, но год назад: в дайджест не попадает
+        Post.objects.filter(pk=old.pk).update(created_at=timezone.now() - timezone.timedelta(weeks=52))
+
+    def subscriber(self, username, *categories, email=None):
+        user = User.objects.create(username=username, email=f'{username}@example.com' if email is None else email)
+        for category in categories:
+            category.subscribers.add(user)
+        return user
+
+    def test_users_with_same_categories_share_one_render(self):
+        self.subscriber('anna', self.sport)
+        self.subscriber('boris', self.sport)
+        self.subscriber('vera', self.sport, self.city)
+        self.subscriber('nobody', self.sport, email='')
+
+        digest = WeeklyDigest()
+        letters = {username: (email, message) for username, email, message in digest}
+        self.assertEqual(sorted(letters), ['anna', 'boris', 'vera'])
+        self.assertEqual(len(digest.rendered), 2)
+        self.assertIs(letters['anna'][1], letters['boris'][1])
+
+        message = letters['vera'][1]
+        self.assertLess(message.index('Парк'), message.index('Матч'))
+        self.assertNotIn('Прошлогодний', message)
+
+    def test_query_count_does_not_grow_with_subscribers(self):
+        for number in range(20):
+            self.subscriber(f'reader{number}', self.sport if number % 2 else self.city)
+        Site.objects.clear_cache()
+
+        # Посты недели, подписки и текущий сайт
+        with self.assertNumQueries(3):
+            self.assertEqual(send_weekly_digest(), 20)
+        self.assertIn('Здравствуй, reader1.', mail.outbox[1].body)
+
+
+class CacheGenerationTests(NewsTestCase):
+    def test_bump_waits_for_commit(self):
+        before = caching.make_key(caching.POSTS, 'page')
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            caching.bump(caching.POSTS)
+        self.assertEqual(caching.make_key(caching.POSTS, 'page'), before)
+
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(caching.make_key(caching.POSTS, 'page'), before)
+
+    def test_rolled_back_bump_keeps_generation(self):
+        before = caching.generation(caching.POSTS)
+
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            caching.bump(caching.POSTS)
+            transaction.set_rollback(True)
+        self.assertEqual(caching.generation(caching.POSTS), before)
+
+    def test_bump_only_touches_its_namespaces(self):
+        other = caching.generation(caching.CATEGORIES)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            caching.bump(caching.POSTS)
+        self.assertEqual(caching.generation(caching.CATEGORIES), other)
+
+    def test_evicted_generation_starts_anew(self):
+        before = caching.generation(caching.POSTS)
+
+        cache.delete(f'ns:{caching.POSTS}:gen')
+        self.assertNotEqual(caching.generation(caching.POSTS), before)
+
+    def test_vote_flush_invalidates_post_feeds(self):
+        category = Category.objects.create(name='Спорт')
+        post = self.make_post(categories=[category])
+        namespaces = [caching.POSTS, caching.post_namespace(post.pk), caching.category_namespace(category.pk)]
+        before = [caching.generation(namespace) for namespace in namespaces]
+        post.like()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            votes.flush(votes.POST)
+        for namespace, generation in zip(namespaces, before):
+            self.assertNotEqual(caching.generation(namespace), generation, namespace)
+
+    def test_saved_post_is_served_fresh(self):
+        post = self.make_post(title='Старый заголовок')
+        url = reverse('api_post_detail', args=[post.pk])
+        self.assertEqual(self.client.get(url).json()['title'], 'Старый заголовок')
+
+        post.title = 'Новый заголовок'
+        with self.captureOnCommitCallbacks(execute=True):
+            post.save()
+        self.assertEqual(self.client.get(url).json()['title'], 'Новый заголовок')
+
+
+    def test_file_cache_incr_loses_no_updates(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        shared = LockingFileBasedCache(directory, {})
+        shared.add('generation', 0, None)
+
+        def worker():
+            for _ in range(25):
+                shared.incr('generation')
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(shared.get('generation'), 200)
+
+    def test_file_cache_incr_keeps_expiry(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        shared = LockingFileBasedCache(directory, {})
+        shared.add('window', 0, 0.2)
+
+        self.assertEqual(shared.incr('window'), 1)
+        time.sleep(0.3)
+        self.assertIsNone(shared.get('window'))
+        with self.assertRaises(ValueError):
+            shared.incr('window')
+
+class AsyncViewTests(NewsTestCase):
+    def test_async_key_matches_sync_key(self):
+        namespace = caching.post_namespace(1)
+
+        self.assertEqual(async_to_sync(caching.amake_key)(namespace, 'object'), caching.make_key(namespace, 'object'))
+        with self.captureOnCommitCallbacks(execute=True):
+            caching.bump(namespace)
+        self.assertEqual(async_to_sync(caching.amake_key)(namespace, 'object'), caching.make_key(namespace, 'object'))
+
+    def test_post_detail_caches_under_namespace_keys(self):
+        post = self.make_post(title='Асинхронный пост')
+        request = RequestFactory().get(reverse('post_detail', args=[post.pk]))
+
+        response = async_to_sync(async_views.post_detail)(request, pk=post.pk)
+        self.assertContains(response, 'Асинхронный пост')
+        self.assertEqual(cache.get(caching.make_key(caching.post_namespace(post.pk), 'object')), post)
+        self.assertEqual(cache.get(caching.make_key(caching.comments_namespace(post.pk), 'list')), [])
+
+
+class SingleFlightTests(NewsTestCase):
+    def counting(self, value, delay=0.0):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(delay)
+            return value
+        return compute, calls
+
+    def test_concurrent_misses_compute_once(self):
+        compute, calls = self.counting(['значение'], delay=0.2)
+        barrier = threading.Barrier(5)
+        results = []
+
+        def worker():
+            barrier.wait()
+            results.append(cache.get_or_set('hot', compute, 60))
+
+        threads = [threading.Thread(target=worker) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [['значение']] * 5)
+
+    def test_none_is_cached(self):
+        compute, calls = self.counting(None)
+
+        self.assertIsNone(cache.get_or_set('missing', compute, 60))
+        self.assertIsNone(cache.get_or_set('missing', compute, 60))
+        self.assertEqual(len(calls), 1)
+
+    def test_lock_released_without_value_is_taken_over(self):
+        compute, calls = self.counting('значение')
+        shared = caches['shared']
+        shared.add('broken:lock', 1, 60)
+        # Тот, кто держал блокировку, упал и снял её, ничего не записав
+        threading.Timer(0.1, shared.delete, ['broken:lock']).start()
+
+        started = time.monotonic()
+        self.assertEqual(cache.get_or_set('broken', compute, 60), 'значение')
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(len(calls), 1)
+
+    @override_settings(CACHES={
+        **TEST_CACHES,
+        'default': {**TEST_CACHES['default'], 'OPTIONS': {'SHARED': 'shared', 'LOCK_TIMEOUT': 0.2}},
+    })
+    def test_stuck_lock_is_ignored_after_timeout(self):
+        compute, calls = self.counting('значение')
+        caches['shared'].add('stuck:lock', 1, 60)
+
+        self.assertEqual(cache.get_or_set('stuck', compute, 60), 'значение')
+        self.assertEqual(len(calls), 1)
+
+    def test_file_cache_add_has_one_winner(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        shared = LockingFileBasedCache(directory, {})
+
+        for attempt in range(10):
+            barrier = threading.Barrier(8)
+            added = []
+
+            def worker():
+                barrier.wait()
+                added.append(shared.add(f'lock{attempt}', 1, 60))
+
+            threads = [threading.Thread(target=worker) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(added.count(True), 1)
+
+    def test_each_get_returns_a_copy(self):
+        cache.get_or_set('list', ['значение'], 60)
+
+        cache.get('list').append('чужое')
+        self.assertEqual(cache.get('list'), ['значение'])
+
+
+@override_settings(RATE_LIMITS={'test': '3/m/user'})
+class RateLimitTests(NewsTestCase):
+    # Начало окна: 6000 секунд — ровно сотое минутное окно
+    WINDOW_START = 6000.0
+
+    def request(self, ip='10.0.0.1', user_id=None):
+        request = RequestFactory().post('/', REMOTE_ADDR=ip)
+        request.session = {} if user_id is None else {SESSION_KEY: str(user_id)}
+        return request
+
+    def at(self, seconds):
+        patcher = mock.patch.object(ratelimit, 'time')
+        patcher.start().time.return_value = self.WINDOW_START + seconds
+        self.addCleanup(patcher.stop)
+
+    def hits(self, request, count):
+        return [ratelimit.hit(request, 'test') for _ in range(count)]
+
+    def test_limit_within_window(self):
+        self.at(0)
+        request = self.request()
+
+        self.assertEqual(self.hits(request, 4), [(True, 60)] * 3 + [(False, 60)])
+
+    def test_previous_window_counts_by_remaining_share(self):
+        request = self.request()
+        self.at(0)
+        self.hits(request, 3)
+
+        # Половина следующего окна: 1 + 3 * 0.5 = 2.5, затем 2 + 1.5 = 3.5
+        self.at(90)
+        self.assertEqual(self.hits(request, 2), [(True, 30), (False, 30)])
+
+    def test_limit_resets_after_two_windows(self):
+        request = self.request()
+        self.at(0)
+        self.hits(request, 4)
+
+        self.at(120)
+        self.assertEqual(self.hits(request, 3), [(True, 60)] * 3)
+
+    def test_check_does_not_count(self):
+        request = self.request()
+        self.at(0)
+        self.hits(request, 2)
+
+        for _ in range(5):
+            self.assertEqual(ratelimit.check(request, 'test'), (False, 60))
+        self.hits(request, 1)
+        self.assertEqual(ratelimit.check(request, 'test'), (True, 60))
+
+    def test_clients_are_counted_separately(self):
+        self.at(0)
+        self.hits(self.request(user_id=1), 3)
+
+        self.assertEqual(ratelimit.hit(self.request(user_id=1, ip='10.0.0.2'), 'test'), (False, 60))
+        self.assertEqual(ratelimit.hit(self.request(user_id=2), 'test'), (True, 60))
+        self.assertEqual(ratelimit.hit(self.request(), 'test'), (True, 60))
+
+    @override_settings(RATE_LIMITS={'vote': '2/m/user'})
+    def test_view_answers_429_over_limit(self):
+        post = self.make_post()
+        self.client.force_login(User.objects.create(username='voter'))
+        url = reverse('post_vote', args=[post.pk])
+
+        self.assertEqual(self.client.post(url, {'value': 'like'}).status_code, 302)
+        self.assertEqual(self.client.post(url, {'value': 'like'}).status_code, 302)
+        response = self.client.post(url, {'value': 'like'})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(PendingVote.objects.count(), 2)
+
+
+@override_settings(RATE_LIMITS={'news_create': '2/d/user'})
+class NewsLimitTests(NewsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = self.make_author()
+        self.author.user.user_permissions.add(Permission.objects.get(codename='add_post'))
+        self.client.force_login(self.author.user)
+        self.category = Category.objects.create(name='Спорт')
+
+    def publish(self, author=None):
+        return self.client.post(reverse('news_create'), {
+            'title': 'Новость', 'text': 'Текст', 'post_type': Post.NEWS,
+            'author': (author or self.author).pk, 'categories': [self.category.pk],
+        })
+
+    def publish_earlier(self, hours_ago, post_type=Post.NEWS, author=None):
+        post = self.make_post(author=author or self.author, post_type=post_type)
+        Post.objects.filter(pk=post.pk).update(created_at=timezone.now() - timezone.timedelta(hours=hours_ago))
+
+    def test_news_over_daily_limit_is_rejected(self):
+        self.publish_earlier(20)
+        self.publish_earlier(1)
+
+        response = self.publish()
+        self.assertEqual(response.status_code, 429)
+        # Место освободится, когда новость 20-часовой давности выйдет из суточного окна
+        self.assertAlmostEqual(int(response['Retry-After']), 4 * 60 * 60, delta=60)
+        self.assertEqual(Post.objects.count(), 2)
+
+    def test_limit_counts_author_from_form(self):
+        other = self.make_author('other')
+        self.publish_earlier(2, author=other)
+        self.publish_earlier(1, author=other)
+
+        self.assertEqual(self.publish(author=other).status_code, 429)
+        self.assertEqual(self.publish().status_code, 302)
+        self.assertEqual(self.publish().status_code, 302)
+        self.assertEqual(self.publish().status_code, 429)
+
+    def test_news_outside_window_and_articles_do_not_count(self):
+        self.publish_earlier(25)
+        self.publish_earlier(1, post_type=Post.ARTICLE)
+        self.publish_earlier(1)
+
+        self.assertEqual(self.publish().status_code, 302)
+        self.assertEqual(Post.objects.filter(post_type=Post.NEWS).count(), 3)
+
+
+class SchedulerTests(NewsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now().replace(second=0, microsecond=0)
+
+    def at(self, seconds):
+        return self.now + timezone.timedelta(seconds=seconds)
+
+    def claim(self, seconds=0, scheduled_at=None):
+        return scheduler.claim('job', scheduler.MINUTE, 60, now=self.at(seconds), scheduled_at=scheduled_at)
+
+    def test_period_is_claimed_once(self):
+        run = self.claim()
+
+        self.assertEqual((run.status, run.attempts), (JobRun.RUNNING, 1))
+        self.assertIsNone(self.claim(10))
+        self.assertEqual(JobRun.objects.count(), 1)
+
+    def test_expired_lease_is_taken_over(self):
+        first = self.claim()
+
+        # Воркер взял задание из очереди позже, но период — по времени отправки
+        second = self.claim(61, scheduled_at=self.now)
+        self.assertEqual((second.pk, second.attempts), (first.pk, 2))
+
+        # Прежний владелец аренды не перезаписывает итог нового запуска
+        scheduler._finish(first, JobRun.SUCCESS, time.monotonic())
+        second.refresh_from_db()
+        self.assertEqual(second.status, JobRun.RUNNING)
+
+    def test_overlapping_run_is_skipped_then_retried(self):
+        scheduler.claim('job', scheduler.MINUTE, 120, now=self.now)
+
+        self.assertIsNone(self.claim(60))
+        skipped = JobRun.objects.get(period=scheduler.period_key(scheduler.MINUTE, self.at(60)))
+        self.assertEqual(skipped.status, JobRun.SKIPPED)
+
+        # Пропущенный период можно выполнить, когда предыдущий запуск закончится
+        run = self.claim(121, scheduled_at=self.at(60))
+        self.assertEqual((run.pk, run.status, run.attempts), (skipped.pk, JobRun.RUNNING, 2))
+
+    def test_run_once_records_result(self):
+        self.assertEqual(scheduler.run_once('job', scheduler.MINUTE, 60, lambda: {'post': 2, 'comment': 3}), {
+            'post': 2, 'comment': 3,
+        })
+        self.assertIsNone(scheduler.run_once('job', scheduler.MINUTE, 60, lambda: 1))
+
+        run = JobRun.objects.get()
+        self.assertEqual((run.status, run.items), (JobRun.SUCCESS, 5))
+
+    def test_run_once_records_failure(self):
+        def fail():
+            raise RuntimeError('нет связи')
+
+        with self.assertRaises(RuntimeError), self.assertLogs('post_news.scheduler', 'ERROR'):
+            scheduler.run_once('job', scheduler.MINUTE, 60, fail)
+        run = JobRun.objects.get()
+        self.assertEqual((run.status, run.error), (JobRun.FAILED, 'RuntimeError: нет связи'))
+
+    def test_beat_stamps_scheduled_time(self):
+        body = (('flush_votes',), {}, {})
+        stamp_scheduled_time(sender=run_scheduled_job.name, body=body)
+
+        scheduled_at = parse_datetime(body[1]['scheduled_at'])
+        self.assertLess(abs(timezone.now() - scheduled_at), timezone.timedelta(seconds=5))
+
+
+class ApiTests(NewsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = self.make_author()
+        self.posts = [self.make_post(author=self.author, title=f'Пост {number}') for number in range(3)]
+
+    def get(self, url, **params):
+        return self.client.get(url, params)
+
+    def assertError(self, response, status, detail):
+        self.assertEqual(response.status_code, status)
+        self.assertIn(detail, response.json()['detail'])
+
+    def test_fields_select_columns(self):
+        response = self.get(reverse('api_post_list'), fields='id, title,id')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.json()['results'][0]), ['id', 'title'])
+
+    def test_unknown_fields_are_rejected(self):
+        url = reverse('api_post_list')
+
+        self.assertError(self.get(url, fields='title,password'), 400, 'Unknown fields: password')
+        self.assertError(self.get(url, fields=' , '), 400, 'Unknown fields')
+        self.assertError(self.get(reverse('api_post_detail', args=[self.posts[0].pk]), fields='rank'), 400, 'rank')
+
+    def test_limit_bounds(self):
+        url = reverse('api_post_list')
+
+        for limit in ('0', '-1', 'много', str(settings.API_MAX_PAGE_SIZE + 1)):
+            self.assertError(self.get(url, limit=limit), 400, 'limit must be between')
+        self.assertEqual(len(self.get(url, limit=settings.API_MAX_PAGE_SIZE).json()['results']), 3)
+
+    def test_cursor_walks_pages(self):
+        url = reverse('api_post_list')
+
+        first = self.get(url, limit=2, fields='title').json()
+        second = self.client.get(first['next']).json()
+        self.assertEqual(
+            [row['title'] for row in first['results'] + second['results']],
+            ['Пост 2', 'Пост 1', 'Пост 0'],
+        )
+        self.assertIsNone(second['next'])
+        self.assertIsNotNone(second['previous'])
+
+    def test_bad_cursor_and_type_are_rejected(self):
+        url = reverse('api_post_list')
+
+        self.assertError(self.get(url, cursor='не-курсор'), 400, 'Invalid cursor.')
+        self.assertError(self.get(url, type='XX'), 400, 'type must be one of')
+
+    def test_missing_objects_are_404(self):
+        missing = self.posts[-1].pk + 1
+
+        self.assertError(self.client.get(reverse('api_post_detail', args=[missing])), 404, 'Post not found.')
+        self.assertError(self.client.get(reverse('api_category_posts', args=[missing])), 404, 'Category not found.')
+
+    def test_errors_are_not_cached(self):
+        url = reverse('api_post_detail', args=[self.posts[-1].pk + 1])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        self.make_post(author=self.author, title='Новый пост')
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class CursorPaginationTests(NewsTestCase):
+    def setUp(self):
+        super().setUp()
+        author = self.make_author()
+        self.posts = [self.make_post(author=author, title=f'Пост {number}') for number in range(23)]
+        # Одинаковое время у соседних постов: порядок решает id
+        now = timezone.now()
+        for number, post in enumerate(self.posts):
+            Post.objects.filter(pk=post.pk).update(created_at=now - timezone.timedelta(minutes=number // 4))
+        self.expected = list(Post.objects.order_by('-created_at', '-id').values_list('pk', flat=True))
+
+    def test_round_trip_never_repeats_or_skips(self):
+        paginator = CursorPaginator(Post.objects.all(), 5)
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_cursor))
+        self.assertEqual([post.pk for page in pages for post in page], self.expected)
+
+        backwards = [pages[-1]]
+        while backwards[-1].has_previous():
+            backwards.append(paginator.page(backwards[-1].previous_cursor))
+        self.assertEqual(
+            [[post.pk for post in page] for page in reversed(backwards)],
+            [[post.pk for post in page] for page in pages],
+        )
+
+    def test_first_page_link_keeps_cursor_mode(self):
+        url = reverse('post_list')
+        first = self.client.get(url, {'cursor': ''})
+        self.assertTrue(first.context['page_obj'].has_next())
+
+        second = self.client.get(url, {'cursor': first.context['page_obj'].next_cursor})
+        self.assertContains(second, 'href="?cursor="')
+        self.assertEqual(
+            [post.pk for post in first.context['page_obj']],
+            self.expected[:PostList.paginate_by],
+        )
+
+
+class SearchTests(NewsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = self.make_author()
+
+    def search(self, query, queryset=None):
+        return list(full_text_search(Post.objects.all() if queryset is None else queryset, query))
+
+    def test_edited_post_is_found_by_new_text(self):
+        post = self.make_post(author=self.author, title='Погода', text='Завтра дождь')
+
+        post.title = 'Футбол'
+        post.text = 'Сборная выиграла матч'
+        post.save()
+
+        self.assertEqual(self.search('погода'), [])
+        found = self.search('выиграла')
+        self.assertEqual(found, [post])
+        self.assertIn(f'{search.SNIPPET_START}выиграла{search.SNIPPET_END}', found[0].search_snippet)
+
+    def test_title_match_ranks_first(self):
+        in_text = self.make_post(author=self.author, title='Город', text='Новости спорта')
+        in_title = self.make_post(author=self.author, title='Спорт', text='Итоги недели')
+
+        self.assertEqual(self.search('спорт'), [in_title, in_text])
+
+    def test_results_compose_with_cursor_pagination(self):
+        posts = [self.make_post(author=self.author, title=f'Спорт {number}') for number in range(5)]
+        self.make_post(author=self.author, title='Погода')
+
+        paginator = CursorPaginator(full_text_search(Post.objects.filter(post_type=Post.NEWS), 'спорт'), 2)
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_cursor))
+        self.assertEqual(
+            [post.pk for page in pages for post in page],
+            sorted((post.pk for post in posts), reverse=True),
+        )
+
+
+class FragmentCacheTests(NewsTestCase):
+    def setUp(self):
+        super().setUp()
+        author = self.make_author()
+        self.posts = [self.make_post(author=author, title=f'Пост {number}') for number in range(3)]
+
+    def render(self):
+        with mock.patch('django.template.backends.django.Template.render', autospec=True,
+                        side_effect=lambda template, context: context['post'].title) as render:
+            rows = caching.render_fragments('post_row.html', Post.objects.order_by('pk'), name='post')
+        return rows, render.call_count
+
+    def test_edit_renders_only_changed_row(self):
+        self.assertEqual(self.render(), (['Пост 0', 'Пост 1', 'Пост 2'], 3))
+        self.assertEqual(self.render()[1], 0)
+
+        post = self.posts[1]
+        post.title = 'Новый заголовок'
+        post.save()
+        self.assertEqual(self.render(), (['Пост 0', 'Новый заголовок', 'Пост 2'], 1))
+
+    def test_template_version_replaces_all_rows(self):
+        self.render()
+
+        with mock.patch.object(caching, 'FRAGMENT_VERSION', caching.FRAGMENT_VERSION + 1):
+            self.assertEqual(self.render()[1], 3)
+
+
+class CategoryPageTests(NewsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(name='Спорт')
+        author = self.make_author()
+        self.news = [self.make_post(author=author, categories=[self.category]) for _ in range(12)]
+        self.articles = [
+            self.make_post(author=author, categories=[self.category], post_type=Post.ARTICLE) for _ in range(3)
+        ]
+        self.url = reverse('category_detail', args=[self.category.pk])
+
+    def test_news_and_articles_are_paginated_separately(self):
+        first = self.client.get(self.url)
+        news, articles = first.context['news'], first.context['articles']
+        self.assertEqual(len(news), 10)
+        self.assertEqual([post.pk for post in articles], [post.pk for post in reversed(self.articles)])
+        self.assertFalse(articles.has_next())
+        # Текст поста на странице категории не нужен и не читается
+        self.assertIn('text', news[0].get_deferred_fields())
+
+        second = self.client.get(self.url, {'news_cursor': news.next_cursor})
+        self.assertEqual(
+            [post.pk for post in news] + [post.pk for post in second.context['news']],
+            [post.pk for post in reversed(self.news)],
+        )
+        self.assertEqual(len(second.context['articles']), 3)
+
+    def test_invalid_cursor_is_not_found(self):
+        self.assertEqual(self.client.get(self.url, {'news_cursor': 'мусор'}).status_code, 404)
+
+    def test_subscribe_confirms_before_adding(self):
+        url = reverse('subscribe', args=[self.category.pk])
+        self.assertRedirects(self.client.get(url), f'{settings.LOGIN_URL}?next={url}', fetch_redirect_response=False)
+
+        user = User.objects.create(username='reader', email='reader@example.com')
+        self.client.force_login(user)
+        self.assertContains(self.client.get(url), 'csrfmiddlewaretoken')
+        self.assertFalse(self.category.subscribers.exists())
+
+        self.assertRedirects(self.client.post(url), self.url, fetch_redirect_response=False)
+        self.assertEqual(list(self.category.subscribers.all()), [user])
+
+
+class QueryPlanTests(NewsTestCase):
+    def test_hot_queries_use_indexes(self):
+        category = Category.objects.create(name='Спорт')
+        author = self.make_author()
+        for post_type in (Post.NEWS, Post.ARTICLE):
+            self.make_post(author=author, categories=[category], post_type=post_type)
+
+        out = StringIO()
+        call_command('check_query_plans', '--analyze', stdout=out)
+        self.assertNotIn('FAIL', out.getvalue())
+
+    def test_table_scan_is_reported(self):
+        plan = ['SEARCH post_news_post USING INDEX post_created_idx', 'SCAN post_news_postcategory']
+        self.assertEqual(check_query_plans.unindexed_steps(plan), ['SCAN post_news_postcategory'])
+
+    def test_post_is_linked_to_category_once(self):
+        category = Category.objects.create(name='Спорт')
+        post = self.make_post(categories=[category])
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            PostCategory.objects.create(post=post, category=category)
+
+
+class ExcerptTests(NewsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = self.make_author()
+        self.text = ' '.join(f'слово{number}' for number in range(30))
+
+    def test_excerpt_is_computed_on_save(self):
+        post = self.make_post(author=self.author, text=self.text)
+        self.assertEqual(post.excerpt, Post.make_excerpt(self.text))
+        self.assertEqual(len(post.excerpt.split()), Post.EXCERPT_WORDS)
+
+        post.text = 'Короткий текст'
+        post.save(update_fields=['text'])
+        post.refresh_from_db()
+        self.assertEqual(post.excerpt, 'Короткий текст')
+
+    def test_backfill_fills_missing_excerpts(self):
+        posts = [self.make_post(author=self.author, text=self.text) for _ in range(3)]
+        Post.objects.update(excerpt='')
+
+        out = StringIO()
+        call_command('backfill_excerpts', '--batch-size', '2', stdout=out)
+        self.assertIn('Backfilled 3 excerpts.', out.getvalue())
+        self.assertEqual(
+            set(Post.objects.filter(pk__in=[post.pk for post in posts]).values_list('excerpt', flat=True)),
+            {Post.make_excerpt(self.text)},
+        )
+
+    def test_feed_does_not_load_text(self):
+        self.make_post(author=self.author, text=self.text)
+
+        response = self.client.get(reverse('post_list'))
+        post = response.context['posts'][0]
+        self.assertIn('text', post.get_deferred_fields())
+        self.assertContains(response, Post.make_excerpt(self.text))
+
+
+class CensorTests(TestCase):
+    def test_whole_words_are_masked_in_any_case(self):
+        self.assertEqual(
+            censor_text('Редиска и ИДИОТ, но не дураками'),
+            'Р****** и И****, но не дураками',
+        )
+
+    def test_words_sharing_a_prefix(self):
+        with self.settings(CENSOR_WORDS=['дура', 'дурак']):
+            self.assertEqual(censor_text('дура, дурак, дураки'), 'д***, д****, дураки')
+        self.assertEqual(censor_text('дура'), 'дура')
+
+    def test_empty_word_list_leaves_text(self):
+        with self.settings(CENSOR_WORDS=[]):
+            self.assertEqual(censor_text('редиска'), 'редиска')
+
+    def test_filters(self):
+        self.assertIsNone(custom_filters.censor(None))
+        self.assertEqual(
+            custom_filters.highlight(f'<b>{search.SNIPPET_START}спорт{search.SNIPPET_END}'),
+            '&lt;b&gt;<mark>спорт</mark>',
+        )
+
+
+class ConditionalGetTests(NewsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = self.make_author()
+        self.category = Category.objects.create(name='Спорт')
+        self.post = self.make_post(author=self.author, categories=[self.category])
+
+    def test_post_page_answers_not_modified_without_queries(self):
+        url = reverse('post_detail', args=[self.post.pk])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['ETag'].startswith('W/'))
+
+        with self.assertNumQueries(0):
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual((not_modified.status_code, not_modified.content), (304, b''))
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304
+        )
+
+    def test_edit_changes_post_version(self):
+        url = reverse('post_detail', args=[self.post.pk])
+        etag = self.client.get(url)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.title = 'Новый заголовок'
+            self.post.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Новый заголовок')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_new_post_changes_category_version(self):
+        url = reverse('category_detail', args=[self.category.pk])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.make_post(author=self.author, categories=[self.category], title='Свежая новость')
+        self.assertContains(self.client.get(url, HTTP_IF_NONE_MATCH=etag), 'Свежая новость')
+
+
+class SnapshotTests(NewsTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        settings_override = override_settings(
+            SNAPSHOTS_ENABLED=True, SNAPSHOT_DIR=directory, SNAPSHOT_HOST='testserver', SNAPSHOT_LIST_PAGES=2
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.category = Category.objects.create(name='Спорт')
+
+    def publish(self, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.make_post(categories=[self.category], **fields)
+
+    def test_publish_writes_and_delete_removes_snapshot(self):
+        post = self.publish(title='Снимок поста')
+        file = snapshots.snapshot_file(snapshots.post_path(post.pk), QueryDict())
+        self.assertIn('Снимок поста', file.read_text())
+        self.assertTrue(file.with_name(file.name + snapshots.VERSION_SUFFIX).exists())
+        for path in [reverse('post_list'), *snapshots.category_paths([self.category.pk])]:
+            self.assertIn('Снимок поста', snapshots.snapshot_file(path, QueryDict()).read_text())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post.delete()
+        self.assertFalse(file.exists())
+        self.assertFalse(file.with_name(file.name + snapshots.VERSION_SUFFIX).exists())
+
+    def test_snapshot_is_served_only_for_current_version(self):
+        post = self.publish(title='Снимок поста')
+        path = snapshots.post_path(post.pk)
+        file = snapshots.snapshot_file(path, QueryDict())
+        file.write_text('из снимка')
+        version = file.with_name(file.name + snapshots.VERSION_SUFFIX).read_text()
+
+        def serve(page_version, **headers):
+            request = RequestFactory().get(path, **headers)
+            request.page_version = page_version
+            return snapshots.serve(request)
+
+        self.assertEqual(serve(version).content.decode(), 'из снимка')
+        self.assertIsNone(serve(f'{version}.1'))
+        # Снимок строится для анонимного посетителя
+        self.assertIsNone(serve(version, HTTP_COOKIE=f'{settings.SESSION_COOKIE_NAME}=1'))
+
+    def test_only_known_pages_have_snapshot_files(self):
+        self.assertEqual(
+            snapshots.snapshot_file('/posts/', QueryDict('page=2')), snapshots.root() / 'posts' / 'page-2.html'
+        )
+        self.assertIsNone(snapshots.snapshot_file('/posts/', QueryDict('page=1')))
+        self.assertIsNone(snapshots.snapshot_file('/posts/search/', QueryDict('q=спорт')))
+        self.assertIsNone(snapshots.snapshot_file('/posts/', QueryDict('cursor=../../etc')))
+
+
+class TransferTests(NewsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = self.make_author()
+        sport, city = Category.objects.create(name='Спорт'), Category.objects.create(name='Город')
+        self.make_post(author=self.author, title='Матч', text='Сборная выиграла', categories=[sport])
+        self.make_post(author=self.author, title='Парк', text='Открыли парк', categories=[city, sport])
+        self.make_post(author=self.author, title='Обзор', text='Без категорий', post_type=Post.ARTICLE)
+
+    def exported(self):
+        return [{**record, 'id': None} for record in transfer.export_records()]
+
+    def test_import_of_export_restores_posts(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = f'{directory}/posts.jsonl'
+        before = self.exported()
+
+        call_command('export_posts', '--output', path, stdout=StringIO())
+        Post.objects.all().delete()
+        out = StringIO()
+        call_command('import_posts', path, '--batch-size', '2', stdout=out)
+
+        self.assertIn('Imported 3 posts.', out.getvalue())
+        self.assertEqual(self.exported(), before)
+        self.assertEqual(NotificationOutbox.objects.count(), 3)
+
+    def test_query_count_does_not_grow_with_batch(self):
+        records = [json.dumps({'title': f'Пост {number}', 'text': 'Текст', 'author': 'author',
+                               'categories': ['Спорт']}) for number in range(30)]
+
+        # Авторы, категории, посты, текущие и новые привязки, время категории, outbox, savepoint
+        with self.assertNumQueries(9):
+            self.assertEqual(transfer.import_posts(records, batch_size=30), 30)
+        self.assertEqual(PostCategory.objects.filter(category__name='Спорт').count(), 32)
+
+    def test_invalid_record_stops_import_at_its_line(self):
+        lines = [
+            json.dumps({'title': 'Пост', 'text': 'Текст', 'author': 'author'}),
+            json.dumps({'title': 'Пост', 'text': 'Текст', 'author': 'author', 'categories': ['Нет такой']}),
+        ]
+
+        with self.assertRaises(transfer.InvalidRecord) as raised:
+            transfer.import_posts(lines, batch_size=1)
+        self.assertEqual(raised.exception.line, 2)
+        self.assertEqual(Post.objects.count(), 4)
+
+
+class CategorySyncTests(NewsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.sport, self.city, self.science = (
+            Category.objects.create(name=name) for name in ('Спорт', 'Город', 'Наука')
+        )
+        self.author = self.make_author()
+        self.post = self.make_post(author=self.author, categories=[self.sport, self.city])
+
+    def links(self):
+        return dict(PostCategory.objects.filter(post=self.post).values_list('category_id', 'pk'))
+
+    def form_data(self, *categories, **fields):
+        return {
+            'title': 'Заголовок', 'text': 'Текст поста', 'post_type': Post.NEWS,
+            'author': self.author.pk, 'categories': [category.pk for category in categories], **fields,
+        }
+
+    def test_sync_changes_only_the_difference(self):
+        before = self.links()
+
+        # Выборка привязок, один DELETE (с выборкой для post_delete) и один INSERT;
+        # остальное — время изменения затронутых категорий из сигналов
+        with self.assertNumQueries(6):
+            self.assertEqual(PostCategory.objects.sync({self.post.pk: [self.city, self.science.pk]}), (1, 1))
+        after = self.links()
+        self.assertEqual(set(after), {self.city.pk, self.science.pk})
+        self.assertEqual(after[self.city.pk], before[self.city.pk])
+
+    def test_unchanged_categories_are_not_rewritten(self):
+        before = self.links()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(PostCategory.objects.sync({self.post.pk: [self.sport, self.city]}), (0, 0))
+        self.assertEqual(self.links(), before)
+
+    def test_form_saves_post_and_categories_together(self):
+        form = PostForm(self.form_data(self.science, title='Новый заголовок'), instance=self.post)
+        self.assertTrue(form.is_valid(), form.errors)
+
+        with mock.patch.object(PostCategory.objects, 'sync', side_effect=IntegrityError), \
+                self.assertRaises(IntegrityError):
+            form.save()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.title, 'Заголовок')
+        self.assertEqual(set(self.links()), {self.sport.pk, self.city.pk})
+
+        PostForm(self.form_data(self.science), instance=self.post).save()
+        self.assertEqual(set(self.links()), {self.science.pk})
@@ -0,0 +1,201 @@
+"""
+Массовый импорт и экспорт постов.
+
+Формат — по посту на строку JSONL:
+
+    {"title": "...", "text": "...", "post_type": "NW", "author": "username",
+     "categories": ["Спорт", "Наука"], "created_at": "2024-01-31T12:00:00+03:00"}
+
+Автор и категории задаются именами, поэтому выгрузка одной базы
+загружается в другую. post_type и created_at необязательны.
+
+Импорт идёт пачками: в памяти только текущая пачка, на неё приходится
+по одному bulk_create постов, их категорий и записей outbox в одной
+транзакции, а инвалидация кэша, снимки и рассылка запускаются один раз
+на пачку, а не на пост. Категории привязываются общим
+PostCategory.objects.sync, как в форме и админке.
+
+Экспорт читает базу через iterator() кусками и отдаёт строки генератором.
+"""
+import csv
+import io
+import json
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import caching
+from .mailing import chunked
+from .models import Author, Category, NotificationOutbox, Post, PostCategory
+from .tasks import drain_notification_outbox, render_snapshots
+
+EXPORT_FIELDS = ['id', 'post_type', 'created_at', 'author', 'categories', 'title', 'text']
+POST_TYPES = {value for value, label in Post.POST_TYPES}
+
+
+class InvalidRecord(ValueError):
+    """Ошибка в данных импорта; line — номер строки во входном потоке."""
+
+    def __init__(self, line, message):
+        super().__init__(f'line {line}: {message}')
+        self.line = line
+
+
+def read_jsonl(lines):
+    """Разбирает строки JSONL в пары (номер строки, запись), пропуская пустые."""
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            raise InvalidRecord(number, f'invalid JSON: {error}')
+        if not isinstance(record, dict):
+            raise InvalidRecord(number, 'expected a JSON object')
+        categories = record.get('categories', [])
+        if not isinstance(record.get('author'), str) or not (
+            isinstance(categories, list) and all(isinstance(name, str) for name in categories)
+        ):
+            raise InvalidRecord(number, 'author must be a username and categories a list of names')
+        yield number, record
+
+
+def _parse_created_at(number, value):
+    created_at = parse_datetime(value) if isinstance(value, str) else None
+    if created_at is None:
+        raise InvalidRecord(number, f'bad created_at {value!r}')
+    if timezone.is_naive(created_at):
+        created_at = timezone.make_aware(created_at)
+    return created_at
+
+
+def import_batch(records, notify=True):
+    """
+    Создаёт посты пачки с категориями. records — пары (номер строки, запись).
+    Возвращает число созданных постов.
+    """
+    usernames = {record['author'] for _, record in records}
+    authors = dict(Author.objects.filter(user__username__in=usernames).values_list('user__username', 'pk'))
+    names = {name for _, record in records for name in record.get('categories', ())}
+    categories = dict(Category.objects.filter(name__in=names).values_list('name', 'pk'))
+
+    posts, post_categories, dated = [], [], []
+    for number, record in records:
+        title, text = record.get('title'), record.get('text')
+        if not title or not isinstance(title, str) or not isinstance(text, str):
+            raise InvalidRecord(number, 'title and text are required')
+        if record['author'] not in authors:
+            raise InvalidRecord(number, f'unknown author {record["author"]!r}')
+        post_type = record.get('post_type', Post.NEWS)
+        if post_type not in POST_TYPES:
+            raise InvalidRecord(number, f'bad post_type {post_type!r}')
+        missing = [name for name in record.get('categories', ()) if name not in categories]
+        if missing:
+            raise InvalidRecord(number, f'unknown categories {missing}')
+
+        # bulk_create не вызывает Post.save, превью считается здесь
+        post = Post(
+            author_id=authors[record['author']], post_type=post_type,
+            title=title, text=text, excerpt=Post.make_excerpt(text),
+        )
+        posts.append(post)
+        post_categories.append([categories[name] for name in dict.fromkeys(record.get('categories', ()))])
+        if 'created_at' in record:
+            dated.append((post, _parse_created_at(number, record['created_at'])))
+
+    with transaction.atomic():
+        Post.objects.bulk_create(posts)
+        # auto_now_add перезаписывает created_at при вставке,
+        # исходные даты проставляются одним bulk_update
+        for post, created_at in dated:
+            post.created_at = created_at
+        Post.objects.bulk_update([post for post, _ in dated], ['created_at'])
+
+        # Категории всей пачки одним bulk_create; категории
+        # инвалидирует сигнал sync, тоже один раз на пачку
+        PostCategory.objects.sync({
+            post.pk: category_ids for post, category_ids in zip(posts, post_categories)
+        })
+
+        # bulk_create постов не шлёт сигналов: то, что они делают
+        # для одного поста, делается здесь один раз на пачку
+        if notify:
+            NotificationOutbox.objects.bulk_create([
+                NotificationOutbox(
+                    post=post,
+                    event=NotificationOutbox.POST_CREATED,
+                    idempotency_key=f'{NotificationOutbox.POST_CREATED}:{post.pk}',
+                )
+                for post in posts
+            ])
+            transaction.on_commit(drain_notification_outbox.delay)
+        caching.bump(caching.POSTS)
+        if settings.SNAPSHOTS_ENABLED:
+            transaction.on_commit(partial(render_snapshots.delay, feed=True))
+
+    return len(posts)
+
+
+def import_posts(lines, batch_size=500, notify=True):
+    """Импортирует посты из строк JSONL. Возвращает число созданных постов."""
+    created = 0
+    for batch in chunked(read_jsonl(lines), batch_size):
+        created += import_batch(batch, notify=notify)
+    return created
+
+
+def export_records(chunk_size=2000, using=None):
+    """
+    Посты в порядке id словарями формата импорта, по chunk_size строк из базы за раз.
+    using — база для чтения; по умолчанию её выбирает роутер.
+    """
+    queryset = Post.objects.using(using).order_by('pk').select_related('author__user').only(
+        'id', 'post_type', 'created_at', 'title', 'text', 'author__user__username'
+    ).prefetch_related(Prefetch('categories', queryset=Category.objects.using(using).only('id', 'name')))
+    # С prefetch_related iterator() подгружает категории на каждый кусок
+    for post in queryset.iterator(chunk_size=chunk_size):
+        yield {
+            'id': post.pk,
+            'post_type': post.post_type,
+            'created_at': post.created_at.isoformat(),
+            'author': post.author.user.username,
+            'categories': [category.name for category in post.categories.all()],
+            'title': post.title,
+            'text': post.text,
+        }
+
+
+def export_jsonl(records):
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def export_csv(records):
+    # csv.writer пишет в буфер, который опустошается после каждой строки
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    writer.writerow(EXPORT_FIELDS)
+    yield flush()
+    for record in records:
+        writer.writerow([
+            '|'.join(record[field]) if field == 'categories' else record[field]
+            for field in EXPORT_FIELDS
+        ])
+        yield flush()
+
+
+FORMATS = {
+    'jsonl': (export_jsonl, 'application/x-ndjson; charset=utf-8'),
+    'csv': (export_csv, 'text/csv; charset=utf-8'),
+}
@@ -1,8 +1,23 @@
+from django.conf import settings
 from django.contrib.auth.views import LoginView, LogoutView
 from django.urls import path
 # Импортируем созданное нами представление
 from .views import PostList, PostDetail, PostSearchView, PostCreateView, PostUpdateView, PostDeleteView, \
-    BaseRegisterView, upgrade_me, CategoryListView, CategoryDetailView, subscribe_to_category
+    BaseRegisterView, upgrade_me, CategoryListView, CategoryDetailView, subscribe_to_category, vote_post, \
+    export_posts
+from . import async_views
+
+# Под ASGI страницы для чтения отдают асинхронные представления
+if settings.ASYNC_READ_VIEWS:
+    post_list = async_views.post_list
+    post_detail = async_views.post_detail
+    category_list = async_views.category_list
+    category_detail = async_views.category_detail
+else:
+    post_list = PostList.as_view()
+    post_detail = PostDetail.as_view()
+    category_list = CategoryListView.as_view()
+    category_detail = CategoryDetailView.as_view()
 
 urlpatterns = [
    # path — означает путь.
@@ -11,15 +26,17 @@ urlpatterns = [
    # Т.к. наше объявленное представление является классом,
    # а Django ожидает функцию, нам надо представить этот класс в виде view.
    # Для этого вызываем метод as_view.
-   path('', PostList.as_view(), name='post_list'),
+   path('', post_list, name='post_list'),
    # pk — это первичный ключ товара, который будет выводиться у нас в шаблон
    # int — указывает на то, что принимаются только целочисленные значения
-   path('<int:pk>', PostDetail.as_view(), name='post_detail'),
+   path('<int:pk>', post_detail, name='post_detail'),
    path('search/', PostSearchView.as_view(), name='post_search'),
+   path('export/', export_posts, name='post_export'),
    path('news/create/', PostCreateView.as_view(), name='news_create'),
    path('articles/create/', PostCreateView.as_view(), name='articles_create'),
    path('<int:pk>/edit/', PostUpdateView.as_view(), name='post_edit'),
    path('<int:pk>/delete/', PostDeleteView.as_view(), name='post_delete'),
+   path('<int:pk>/vote/', vote_post, name='post_vote'),
    path('login/',
         LoginView.as_view(template_name='post_news/login.html'),
         name='login'),
@@ -30,7 +47,7 @@ urlpatterns = [
         BaseRegisterView.as_view(template_name='post_news/signup.html'),
         name='signup'),
    path('upgrade/', upgrade_me, name='upgrade'),
-   path('categories/', CategoryListView.as_view(), name='category_list'),
-   path('category/<int:pk>/', CategoryDetailView.as_view(), name='category_detail'),
+   path('categories/', category_list, name='category_list'),
+   path('category/<int:pk>/', category_detail, name='category_detail'),
    path('subscribe/<int:category_id>/', subscribe_to_category, name='subscribe'),
 ]
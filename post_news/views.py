@@ -1,28 +1,69 @@
+import math
 from datetime import datetime
+from functools import partial
 
 from django.utils import timezone
 
 from django.core.cache import cache
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 from django.contrib.auth.models import User, Group
-from django.core.exceptions import ValidationError
-from django.shortcuts import redirect, get_object_or_404
+from django.db import transaction
+from django.http import Http404, HttpResponseBadRequest, StreamingHttpResponse
+from django.shortcuts import redirect, get_object_or_404, render
 from django.urls import reverse_lazy
 from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
+from django.views.decorators.http import require_http_methods, require_POST
 # Импортируем класс, который говорит нам о том,
 # что в этом представлении мы будем выводить список объектов из БД
 from django.views.generic import ListView, DetailView, DeleteView, UpdateView, CreateView, TemplateView
 
+from news import db_routers
+
+from . import caching, ratelimit, transfer
+from .caching import cache_page_in, conditional_page
 from .filters import PostFilter
 from .forms import PostForm, BaseRegisterForm
-from .models import Post, Category, PostCategory
+from .models import Author, Post, Category
+from .pagination import CursorPaginationMixin, CursorPaginator, InvalidCursor
+
+
+# Версии страниц для условного GET. Время изменения читается одним
+# запросом по первичному ключу и кэшируется в пространстве страницы:
+# оно сбрасывается тем же сигналом, что и само время изменения
+
+def posts_version(request, *args, **kwargs):
+    # Лента меняется при любом изменении постов, в том числе при удалении,
+    # её версия — поколение пространства POSTS; дата выводится на странице
+    return f'{caching.generation(caching.POSTS)}:{timezone.localdate()}'
+
+
+def post_version(request, pk):
+    return cache.get_or_set(
+        caching.make_key(caching.post_namespace(pk), 'version'),
+        Post.objects.filter(pk=pk).values_list('updated_at', flat=True).first,
+        300
+    )
+
 
+def categories_version(request, *args, **kwargs):
+    return caching.generation(caching.CATEGORIES)
 
-class PostList(ListView):
+
+def category_version(request, pk):
+    return cache.get_or_set(
+        caching.make_key(caching.category_namespace(pk), 'version'),
+        Category.objects.filter(pk=pk).values_list('content_updated_at', flat=True).first,
+        300
+    )
+
+
+class PostList(CursorPaginationMixin, ListView):
     # Указываем модель, объекты которой мы будем выводить
     model = Post
+    # Читаем только выводимые колонки, полный текст поста в списке не нужен
+    queryset = Post.objects.only('id', 'title', 'created_at', 'updated_at', 'excerpt')
     # Поле, которое будет использоваться для сортировки объектов
     ordering = ['-created_at']
     # Указываем имя шаблона, в котором будут все инструкции о том,
@@ -47,7 +88,8 @@ class PostList(ListView):
 
         return context
 
-    @method_decorator(cache_page(60))  # кэш на 1 минуту для главной страницы
+    @method_decorator(conditional_page(posts_version))
+    @method_decorator(cache_page_in(60, caching.POSTS))  # кэш на 1 минуту для главной страницы
     def dispatch(self, request, *args, **kwargs):
         return super().dispatch(request, *args, **kwargs)
 
@@ -60,56 +102,68 @@ class PostDetail(DetailView):
     # Название объекта, в котором будет выбранный пользователем продукт
     context_object_name = 'post'
 
-    @method_decorator(cache_page(300))  # кэш на 5 минут для страницы поста
+    @method_decorator(conditional_page(post_version))
+    @method_decorator(cache_page_in(300, caching.post_namespace))  # кэш на 5 минут для страницы поста
     def dispatch(self, request, *args, **kwargs):
         return super().dispatch(request, *args, **kwargs)
 
     def get_object(self, queryset=None):
         # Кэширование объекта поста/статьи
-        cache_key = f'post_detail_{self.kwargs["pk"]}'
-        post = cache.get(cache_key)
-
-        if post is None:
-            post = super().get_object(queryset)
-
-            cache.set(cache_key, post, None)
-
-        return post
+        # get_or_set: при промахе пост из базы читает только один воркер
+        cache_key = caching.make_key(caching.post_namespace(self.kwargs['pk']), 'object')
+        return cache.get_or_set(cache_key, partial(super().get_object, queryset), 300)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        comments_key = f'post_comments_{self.object.pk}'
+        comments_key = caching.make_key(caching.comments_namespace(self.object.pk), 'list')
         context['comments'] = cache.get(comments_key)
 
         if context['comments'] is None:
-            context['comments'] = self.object.comments.all()
-            cache.set(comments_key, context['comments'], None)
+            context['comments'] = list(self.object.comment_set.all())
+            cache.set(comments_key, context['comments'], 300)
 
         return context
 
 
-class PostSearchView(ListView):
+class PostSearchView(CursorPaginationMixin, ListView):
     model = Post
     template_name = 'search.html'
     context_object_name = 'posts'
     paginate_by = 10
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = super().get_queryset().select_related('author__user').only(
+            'id', 'title', 'created_at', 'author__user__username'
+        )
         self.filterset = PostFilter(self.request.GET, queryset=queryset)
         return self.filterset.qs
 
+    def use_cursor_pagination(self):
+        # Результаты полнотекстового поиска отсортированы по релевантности,
+        # а не по дате, поэтому для них остаётся обычная пагинация
+        return not self.request.GET.get('q') and super().use_cursor_pagination()
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['filterset'] = self.filterset
         return context
 
-    @method_decorator(cache_page(300))  # кэш на 5 минут для поиска
+    @method_decorator(cache_page_in(300, caching.POSTS))  # кэш на 5 минут для поиска
     def dispatch(self, request, *args, **kwargs):
         return super().dispatch(request, *args, **kwargs)
 
 
+# Запросы лимита новостей; их же планы проверяет check_query_plans
+
+def news_author(author_id):
+    return Author.objects.select_for_update().filter(pk=author_id).values_list('pk', flat=True)
+
+
+def news_in_window(author_id, rate, now):
+    return Post.recent_news(author_id, now - timezone.timedelta(seconds=rate.period))[:rate.limit]
+
+
 class PostCreateView(LoginRequiredMixin, PermissionRequiredMixin,  CreateView):
     model = Post
     form_class = PostForm
@@ -119,29 +173,43 @@ class PostCreateView(LoginRequiredMixin, PermissionRequiredMixin,  CreateView):
     permission_required = 'post_news.add_post'
     raise_exception = True
 
-    def form_valid(self, form):
-
-        today = timezone.now().date()
-        news_count = Post.objects.filter(
-            author=self.request.user,
-            created_at__date=today,
-            post_type=Post.NEWS
-        ).count()
-
-        if news_count >= 3:
-            raise ValidationError('Вы не можете публиковать более трех новостей в день.')
+    def is_news(self):
+        return 'news/create' in self.request.path
 
-        if 'news/create' in self.request.path:
+    def form_valid(self, form):
+        if self.is_news():
             form.instance.post_type = Post.NEWS
         elif 'articles/create' in self.request.path:
             form.instance.post_type = Post.ARTICLE
 
-        response = super().form_valid(form)
-
-        cache.delete_pattern('post_list_*')
-        cache.delete_pattern('search_results_*')
-
-        return response
+        # Пост, его категории и запись в outbox фиксируются одной транзакцией.
+        # Лимит новостей считается по базе, у автора, который указан в форме:
+        # счётчик в кэше привязан к сессии и может недосчитать
+        with transaction.atomic():
+            if self.is_news():
+                retry_after = self.news_retry_after(form.cleaned_data['author'])
+                if retry_after:
+                    return ratelimit.too_many_requests(retry_after)
+            return super().form_valid(form)
+
+    def news_retry_after(self, author):
+        """
+        Через сколько секунд автор сможет опубликовать новость, 0 — сейчас.
+        Вызывается в транзакции вставки: строка автора блокируется
+        (в SQLite транзакция IMMEDIATE сразу берёт блокировку записи),
+        поэтому параллельные запросы не насчитают одни и те же новости.
+        """
+        author_id = news_author(author.pk).first()
+        if author_id is None:
+            return 0
+        rate = ratelimit.get_rate('news_create')
+        now = timezone.now()
+        period = timezone.timedelta(seconds=rate.period)
+        latest = list(news_in_window(author_id, rate, now))
+        if len(latest) < rate.limit:
+            return 0
+        # Место освободится, когда самая старая из последних limit новостей выйдет из окна
+        return max(1, math.ceil((latest[-1] + period - now).total_seconds()))
 
 
 class PostUpdateView(LoginRequiredMixin, PermissionRequiredMixin, UpdateView):
@@ -153,21 +221,6 @@ class PostUpdateView(LoginRequiredMixin, PermissionRequiredMixin, UpdateView):
     permission_required = 'post_news.change_post'
     raise_exception = True
 
-    def form_valid(self, form):
-
-        old_post = self.get_object()
-
-        response = super().form_valid(form)
-
-        cache_key = f'post_detail_{self.object.pk}'
-        cache.delete(cache_key)
-
-        cache.delete_pattern(f'post_comments_{self.object.pk}')
-        cache.delete_pattern('post_list_*')
-        cache.delete_pattern('search_results_*')
-
-        return response
-
 
 class PostDeleteView(LoginRequiredMixin, PermissionRequiredMixin, DeleteView):
     model = Post
@@ -177,26 +230,16 @@ class PostDeleteView(LoginRequiredMixin, PermissionRequiredMixin, DeleteView):
     permission_required = 'post_news.delete_post'
     raise_exception = True
 
-    def post(self, request, *args, **kwargs):
-
-        post = self.get_object()
-
-        response = super().post(request, *args, **kwargs)
-        cache_key = f'post_detail_{post.pk}'
-        cache.delete(cache_key)
-
-        cache.delete_pattern(f'post_comments_{post.pk}')
-        cache.delete_pattern('post_list_*')
-        cache.delete_pattern('search_results_*')
-
-        return response
-
 
 class BaseRegisterView(CreateView):
     model = User
     form_class = BaseRegisterForm
     success_url = '/'
 
+    @method_decorator(ratelimit.limit('signup'))
+    def dispatch(self, request, *args, **kwargs):
+        return super().dispatch(request, *args, **kwargs)
+
 
 class IndexView(LoginRequiredMixin, TemplateView):
     template_name = 'protect/index.html'
@@ -220,24 +263,25 @@ class CategoryDetailView(DetailView):
     model = Category
     template_name = 'category_detail.html'
     context_object_name = 'category'
+    paginate_by = 10
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-
-        post_categories = PostCategory.objects.filter(category=self.object)
+    @method_decorator(conditional_page(category_version))
+    @method_decorator(cache_page_in(300, caching.category_namespace))  # кэш до изменения постов категории
+    def dispatch(self, request, *args, **kwargs):
+        return super().dispatch(request, *args, **kwargs)
 
-        news = Post.objects.filter(
-            postcategory__category=self.object,
-            post_type=Post.NEWS
-        )
+    def get_stream(self, post_type, cursor_param):
+        queryset = Post.category_stream(self.object.pk, post_type)
+        try:
+            return CursorPaginator(queryset, self.paginate_by).page(self.request.GET.get(cursor_param))
+        except InvalidCursor:
+            raise Http404('Неверный курсор страницы.')
 
-        articles = Post.objects.filter(
-            postcategory__category=self.object,
-            post_type=Post.ARTICLE
-        )
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
 
-        context['news'] = news
-        context['articles'] = articles
+        context['news'] = self.get_stream(Post.NEWS, 'news_cursor')
+        context['articles'] = self.get_stream(Post.ARTICLE, 'articles_cursor')
 
         return context
 
@@ -247,12 +291,51 @@ class CategoryListView(ListView):
     template_name = 'category_list.html'
     context_object_name = 'categories'
 
-    @method_decorator(cache_page(600))  # кэш на 10 минут для списка категорий
+    @method_decorator(conditional_page(categories_version))
+    @method_decorator(cache_page_in(600, caching.CATEGORIES))  # кэш на 10 минут для списка категорий
     def dispatch(self, request, *args, **kwargs):
         return super().dispatch(request, *args, **kwargs)
 
 
+# Лимит снаружи проверки входа: отказ не загружает пользователя
+@ratelimit.limit('subscribe')
+@login_required
+@require_http_methods(['GET', 'POST'])
 def subscribe_to_category(request, category_id):
     category = get_object_or_404(Category, id=category_id)
+    if request.method != 'POST':
+        # Форма с csrf-токеном живёт здесь, а не на кэшируемой странице категории
+        return render(request, 'subscribe.html', {'category': category})
     category.subscribers.add(request.user)
-    return redirect('category_detail', category_id=category.id)
+    return redirect('category_detail', pk=category.id)
+
+
+@ratelimit.limit('vote')
+@login_required
+@require_POST
+def vote_post(request, pk):
+    value = request.POST.get('value')
+    if value not in ('like', 'dislike'):
+        return HttpResponseBadRequest('value должен быть like или dislike.')
+    post = get_object_or_404(Post.objects.only('id'), pk=pk)
+    # Голос копится в PendingVote и переносится в рейтинг задачей flush_votes
+    if value == 'like':
+        post.like()
+    else:
+        post.dislike()
+    return redirect('post_detail', pk=pk)
+
+
+@staff_member_required
+def export_posts(request):
+    # Выгрузка идёт потоком: в памяти только текущий кусок из базы
+    export_format = request.GET.get('format', 'jsonl')
+    if export_format not in transfer.FORMATS:
+        return HttpResponseBadRequest('format должен быть jsonl или csv.')
+    encode, content_type = transfer.FORMATS[export_format]
+    # Тело читается после того, как middleware сбросит маршрутизацию,
+    # поэтому база выбирается сейчас и передаётся явно
+    records = transfer.export_records(using=db_routers.read_database())
+    response = StreamingHttpResponse(encode(records), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="posts.{export_format}"'
+    return response
@@ -0,0 +1,119 @@
+"""
+Голоса с отложенной записью в рейтинг.
+
+Голос — одна вставка строки PendingVote, строка поста или комментария
+при этом не меняется, и параллельные голоса не ждут друг друга на ней.
+Периодическая задача ``flush`` суммирует накопленные голоса по объектам
+и пишет суммы в базу одним UPDATE с F()-выражением на пачку объектов,
+вместе с дельтами рейтинга авторов, а учтённые голоса удаляет в той же
+транзакции. UPDATE не шлёт сигналов, поэтому кэш страниц и API
+с рейтингом flush инвалидирует сам.
+
+Журнал живёт в базе, а не в кэше: incr атомарен не у всякого бэкенда
+(у файлового — только у LockingFileBasedCache), а ключи кэш вытесняет
+при переполнении, и потерянный ключ журнала — потерянные голоса.
+"""
+from django.apps import apps
+from django.db import transaction
+from django.db.models import Case, Count, F, Max, Sum, Value, When
+
+from . import caching
+
+POST = 'post'
+COMMENT = 'comment'
+
+MODELS = {
+    POST: 'post_news.Post',
+    COMMENT: 'post_news.Comment',
+}
+
+FLUSH_BATCH_SIZE = 500
+
+
+def _model():
+    return apps.get_model('post_news.PendingVote')
+
+
+def _votes(kind):
+    return _model().objects.filter(kind=kind)
+
+
+def record_vote(kind, pk, delta):
+    _model().objects.create(kind=kind, object_id=pk, delta=delta)
+
+
+def pending_delta(kind, pk):
+    return _votes(kind).filter(object_id=pk).aggregate(delta=Sum('delta'))['delta'] or 0
+
+
+def pending_deltas(kind):
+    """Ещё не записанные в рейтинг дельты: {pk: дельта}."""
+    return {
+        pk: delta
+        for pk, delta in _votes(kind).values('object_id').annotate(
+            delta=Sum('delta')
+        ).order_by().values_list('object_id', 'delta')
+        if delta
+    }
+
+
+def apply_deltas(model, deltas, field='rating'):
+    items = [(pk, delta) for pk, delta in deltas.items() if delta]
+    for start in range(0, len(items), FLUSH_BATCH_SIZE):
+        batch = items[start:start + FLUSH_BATCH_SIZE]
+        model.objects.filter(pk__in=[pk for pk, _ in batch]).update(**{
+            field: F(field) + Case(
+                *[When(pk=pk, then=Value(delta)) for pk, delta in batch],
+                default=Value(0),
+                output_field=model._meta.get_field(field),
+            )
+        })
+
+
+def _invalidate(kind, deltas):
+    # Рейтинг поста есть в ленте API, в самом посте и в лентах его категорий;
+    # рейтинг комментария — в комментариях поста
+    if not deltas:
+        return
+    if kind == POST:
+        category_ids = apps.get_model('post_news.PostCategory').objects.filter(
+            post_id__in=list(deltas)
+        ).values_list('category_id', flat=True).distinct()
+        caching.bump(
+            caching.POSTS,
+            *map(caching.post_namespace, deltas),
+            *map(caching.category_namespace, category_ids),
+        )
+    else:
+        post_ids = apps.get_model(MODELS[kind]).objects.filter(
+            pk__in=list(deltas)
+        ).values_list('post_id', flat=True).distinct()
+        caching.bump(*map(caching.comments_namespace, post_ids))
+
+
+def flush(kind):
+    """Переносит накопленные голоса в рейтинги. Возвращает {pk: дельта}."""
+    with transaction.atomic():
+        # Голоса, пришедшие во время сброса, получат id больше last
+        # и дождутся следующего запуска
+        last = _votes(kind).aggregate(last=Max('pk'))['last']
+        if last is None:
+            return {}
+        batch = _votes(kind).filter(pk__lte=last)
+        rows = list(batch.values('object_id').annotate(
+            delta=Sum('delta'), votes=Count('pk')
+        ).order_by().values_list('object_id', 'delta', 'votes'))
+
+        # Те же голоса уже забрал параллельный сброс: его DELETE
+        # зафиксирован раньше, и наш удалит не все прочитанные строки
+        if batch.delete()[0] != sum(votes for _, _, votes in rows):
+            transaction.set_rollback(True)
+            return {}
+
+        deltas = {pk: delta for pk, delta, _ in rows if delta}
+        apply_deltas(apps.get_model(MODELS[kind]), deltas)
+        # Рейтинг авторов поддерживается инкрементально в той же транзакции
+        author = apps.get_model('post_news.Author')
+        apply_deltas(author, author.vote_deltas(kind, deltas))
+        _invalidate(kind, deltas)
+    return deltas